@@ -14,6 +14,8 @@ from os.path import expanduser
 from queue import Empty
 import pyarrow.plasma as plasma
 from improv.actor import Actor, Spike, RunManager
+from improv.message import FrameMessage
+from improv.roi import ROITable
 import traceback
 
 import logging; logger = logging.getLogger(__name__)
@@ -23,8 +25,8 @@ class OnePProcessor(Actor):
     ''' Using 1p method from Caiman
     '''
     
-    def __init__(self, *args, init_filename='data/tmp.hdf5', config_file=None):
-        super().__init__(*args)
+    def __init__(self, *args, init_filename='data/tmp.hdf5', config_file=None, **kwargs):
+        super().__init__(*args, **kwargs)
         print('initfile ', init_filename, 'config file ', config_file)
         self.param_file = config_file
         print(init_filename)
@@ -40,6 +42,7 @@ class OnePProcessor(Actor):
         self.done = False
         self.dropped_frames = []
         self.coords = None
+        self.coords_id = None
         self.ests = None
         self.A = None
         self.num = 0
@@ -87,7 +90,8 @@ class OnePProcessor(Actor):
         self.timestamp = []
         self.counter = 0
 
-        with RunManager(self.name, self.runProcess, self.setup, self.q_sig, self.q_comm) as rm:
+        with RunManager(self.name, self.runProcess, self.setup, self.q_sig, self.q_comm,
+                        inputs=[self.q_in], spin=self.spin) as rm:
             logger.info(rm)
 
         print('Processor broke, avg time per frame: ', np.mean(self.total_times, axis=0))
@@ -131,10 +135,12 @@ class OnePProcessor(Actor):
             t = time.time()
             self.done = False
             try:
-                self.frame = self.client.getID(frame[0][0])
+                frame_id = frame.ids[0]
+                self.frame = self.client.getID(frame_id)
 
                 ##motion correct
                 frame = self.onAc.mc_next(self.frame_number+init, self.frame)
+                self.client.checkFrame(frame_id) # ring slot may be reused while we read it
                 ##fit frame
                 t2 = time.time()
                 self.onAc.fit_next(self.frame_number+init, self.frame.ravel(order='F'))
@@ -145,7 +151,7 @@ class OnePProcessor(Actor):
             except ObjectNotFoundError:
                 logger.error('Processor: Frame {} unavailable from store, droppping'.format(self.frame_number))
                 self.dropped_frames.append(self.frame_number)
-                self.q_out.put([1])
+                self.q_out.put(FrameMessage.missing(self.frame_number))
             except KeyError as e:
                 logger.error('Processor: Key error... {0}'.format(e))
                 # Proceed at all costs
@@ -176,15 +182,12 @@ class OnePProcessor(Actor):
         self._updateCoords(A,dims,C.shape[0])
         t4 = time.time()
 
-        ids = []
-        ids.append([self.client.put(self.coords, 'coords'+str(self.frame_number)), 'coords'+str(self.frame_number)])
-        ids.append([self.client.put(image, 'proc_image'+str(self.frame_number)), 'proc_image'+str(self.frame_number)])
-        ids.append([self.client.put(C, 'C'+str(self.frame_number)), 'C'+str(self.frame_number)])
-        ids.append([self.frame_number, str(self.frame_number)])
+        bundle_id = self.client.putMany({'coords': self.coords_id, 'image': image, 'C': C},
+                                        'estimates', frame=self.frame_number)
 
         t5 = time.time()
 
-        self.put(ids)
+        self.put(FrameMessage(self.frame_number, [bundle_id]))
 
         t6= time.time()
 
@@ -197,7 +200,8 @@ class OnePProcessor(Actor):
         '''
         if self.coords is None: #initial calculation
             self.A = A
-            self.coords = get_contours(A, dims)
+            self.coords = ROITable.fromContours(get_contours(A, dims))
+            self._putCoords()
             self.num = num
 
         elif self.num<num: #np.shape(A)[1] > np.shape(self.A)[1] and self.frame_number % 200 == 0:
@@ -206,8 +210,16 @@ class OnePProcessor(Actor):
             # TODO: maybe only recalc coords that are new?
             logger.info('Recomputing spatial contours')
             self.A = A
-            self.coords = get_contours(A, dims)
             self.counter += 1
+            self.coords = ROITable.fromContours(get_contours(A, dims), version=self.counter)
+            self._putCoords()
+            self.num = num
+
+    def _putCoords(self):
+        ''' Put the ROI table when it changes; the estimates for each
+            frame refer to the current one by id
+        '''
+        self.coords_id = self.client.put(self.coords, 'coords', frame=self.coords.version)
 
 
     def makeImage(self):
@@ -14,7 +14,9 @@ from os.path import expanduser
 from queue import Empty
 import pyarrow.plasma as plasma
 from improv.actor import Actor, Spike, RunManager
+from improv.message import FrameMessage
 from improv.actors.process import CaimanProcessor
+from improv.roi import ROITable
 import traceback
 
 import logging; logger = logging.getLogger(__name__)
@@ -26,8 +28,8 @@ class BasicProcessor(CaimanProcessor):
     '''
     
     #TODO: Default data set for this. Ask for using Tolias from caiman...?
-    def __init__(self, *args, init_filename='data/Tolias_mesoscope_2.hdf5', config_file=None):
-        super().__init__(*args, init_filename=init_filename, config_file=config_file)
+    def __init__(self, *args, init_filename='data/Tolias_mesoscope_2.hdf5', config_file=None, **kwargs):
+        super().__init__(*args, init_filename=init_filename, config_file=config_file, **kwargs)
     
     def run(self):
         ''' Run the processor continually on input frames
@@ -42,7 +44,8 @@ class BasicProcessor(CaimanProcessor):
         self.timestamp = []
         self.counter = 0
 
-        with RunManager(self.name, self.runProcess, self.setup, self.q_sig, self.q_comm) as rm:
+        with RunManager(self.name, self.runProcess, self.setup, self.q_sig, self.q_comm,
+                        inputs=[self.q_in], spin=self.spin) as rm:
             logger.info(rm)
 
         print('Processor broke, avg time per frame: ', np.mean(self.total_times, axis=0))
@@ -70,44 +73,6 @@ class BasicProcessor(CaimanProcessor):
         np.savetxt('output/timing/shape_time.txt', self.shape_time)
         np.savetxt('output/timing/detect_time.txt', self.detect_time)
 
-    def runProcess(self):
-        ''' Run process. Runs once per frame.
-            Output is a location in the DS to continually
-            place the Estimates results, with ref number that
-            corresponds to the frame number (TODO)
-        '''
-        init = self.params['init_batch']
-        frame = self._checkFrames()
-
-        if frame is not None:
-            t = time.time()
-            self.done = False
-            try:
-                self.frame = self.client.getID(frame[0][0])
-                self.frame = self._processFrame(self.frame, self.frame_number+init)
-                t2 = time.time()
-                self._fitFrame(self.frame_number+init, self.frame.reshape(-1, order='F'))
-                self.fitframe_time.append([time.time()-t2])
-                self.putEstimates()
-                self.timestamp.append([time.time(), self.frame_number])
-            except ObjectNotFoundError:
-                logger.error('Processor: Frame {} unavailable from store, droppping'.format(self.frame_number))
-                self.dropped_frames.append(self.frame_number)
-                self.q_out.put([1])
-            except KeyError as e:
-                logger.error('Processor: Key error... {0}'.format(e))
-                # Proceed at all costs
-                self.dropped_frames.append(self.frame_number)
-            except Exception as e:
-                logger.error('Processor error: {}: {} during frame number {}'.format(type(e).__name__,
-                                                                                            e, self.frame_number))
-                print(traceback.format_exc())
-                self.dropped_frames.append(self.frame_number)
-            self.frame_number += 1
-            self.total_times.append(time.time()-t)
-        else:
-            pass
-
     def putEstimates(self):
         ''' Put whatever estimates we currently have
             into the data store
@@ -127,11 +92,8 @@ class BasicProcessor(CaimanProcessor):
         self._updateCoords(A,dims)
         t4 = time.time()
 
-        ids = []
-        ids.append([self.client.put(self.coords, 'coords'+str(self.frame_number)), 'coords'+str(self.frame_number)])
-        ids.append([self.client.put(image, 'proc_image'+str(self.frame_number)), 'proc_image'+str(self.frame_number)])
-        ids.append([self.client.put(C, 'C'+str(self.frame_number)), 'C'+str(self.frame_number)])
-        ids.append([self.frame_number, str(self.frame_number)])
+        bundle_id = self.client.putMany({'coords': self.coords_id, 'image': image, 'C': C},
+                                        'estimates', frame=self.frame_number)
 
         t5 = time.time()
 
@@ -141,7 +103,7 @@ class BasicProcessor(CaimanProcessor):
         # else:
         # self.put(ids, save=[False]*4)
 
-        self.put(ids)
+        self.put(FrameMessage(self.frame_number, [bundle_id]))
 
         t6= time.time()
 
@@ -156,15 +118,17 @@ class BasicProcessor(CaimanProcessor):
         '''
         if self.coords is None: #initial calculation
             self.A = A
-            self.coords = get_contours(A, dims)
+            self.coords = ROITable.fromContours(get_contours(A, dims))
+            self._putCoords()
 
         elif np.shape(A)[1] > np.shape(self.A)[1] and self.frame_number % 200 == 0:
             #Only recalc if we have new components
             # FIXME: Since this is only for viz, only do this every 100 frames
             # TODO: maybe only recalc coords that are new?
             self.A = A
-            self.coords = get_contours(A, dims)
             self.counter += 1
+            self.coords = ROITable.fromContours(get_contours(A, dims), version=self.counter)
+            self._putCoords()
 
 
     def makeImage(self):
@@ -67,7 +67,8 @@ class BasicCaimanVisual(Actor):
         self.tune = None
         self.raw = None
         self.color = None
-        self.coords = None
+        self.coords = None  # ROITable
+        self.coords_id = None
         
         self.draw = True
 
@@ -81,26 +82,29 @@ class BasicCaimanVisual(Actor):
 
     def getData(self):
         t = time.time()
-        ids = None
         try:
-            id = self.links['raw_frame_queue'].get(timeout=0.0001)
-            self.raw_frame_number = id[0][1]
-            self.raw = self.client.getID(id[0][0])
+            msg = self.links['raw_frame_queue'].get(timeout=0.0001)
+            self.raw_frame_number = msg.frame
+            self.raw = self.client.getID(msg.ids[0])
         except Empty as e:
             pass
         except Exception as e:
             logger.error('Visual: Exception in get data: {}'.format(e))
         try: 
-            ids = self.q_in.get(timeout=0.0001)
-            ids= [id[0] for id in ids]
-            if ids is not None and ids[0]==1:
+            msg = self.q_in.get(timeout=0.0001)
+            if msg.isMissing:
                 print('visual: missing frame')
                 self.frame_num += 1
                 self.total_times.append([time.time(), time.time()-t])
                 raise Empty
-            self.frame_num = ids[-1]
+            self.frame_num = msg.frame
             if self.draw:
-                (self.Cx, self.C, self.Cpop, self.tune, self.color, self.coords) = self.client.getList(ids[:-1])
+                res = self.client.getMany(msg.ids[0])
+                (self.Cx, self.C, self.Cpop, self.tune, self.color, coords_id) = (res['Cx'], res['Call'],
+                    res['Cpop'], res['tune'], res['color'], res['analys_coords'])
+                if coords_id != self.coords_id:
+                    self.coords = self.client.getID(coords_id)
+                    self.coords_id = coords_id
                 # self.getCurves()
                 # self.getFrames()
                 self.total_times.append([time.time(), time.time()-t])
@@ -149,8 +153,8 @@ class BasicCaimanVisual(Actor):
             identifies which neuron is closest to this point
             and updates plotEstimates to use that neuron
         '''
-        neurons = [o['neuron_id']-1 for o in self.coords]
-        com = np.array([o['CoM'] for o in self.coords])
+        neurons = self.coords.ids - 1
+        com = self.coords.com
         #dist = cdist(com, [np.array([y, self.raw.shape[0]-x])])
         dist = cdist(com, [np.array([self.raw.shape[0]-x, self.raw.shape[1]-y])])
         if np.min(dist) < 50:
@@ -170,8 +174,8 @@ class BasicCaimanVisual(Actor):
 
     def getFirstSelect(self):
         first = None
-        if self.coords:
-            com = [o['CoM'] for o in self.coords]
+        if self.coords is not None and len(self.coords):
+            com = self.coords.com
             #first = [np.array([self.raw.shape[0]-com[0][1], com[0][0]])]
             first = [np.array([self.raw.shape[0]-com[0][0], self.raw.shape[1]-com[0][1]])]
             #first = [com[0]]
@@ -192,8 +196,7 @@ class BasicCaimanVisual(Actor):
             image2 = np.stack([image, image, image, image], axis=-1).astype(np.uint8).copy()
             image2[...,3] = 150
             if self.coords is not None:
-                coords = [o['coordinates'] for o in self.coords]
-                for i,c in enumerate(coords):
+                for i,c in enumerate(self.coords.contours()):
                     ind = c[~np.isnan(c).any(axis=1)].astype(int)
                     #rot_ind = np.array([[i[1],self.raw.shape[0]-i[0]] for i in ind])
                     #rot_ind = np.array([[self.raw.shape[0]-i[0],self.raw.shape[1]-i[1]] for i in ind])
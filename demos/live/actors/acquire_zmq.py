@@ -10,6 +10,7 @@ import json
 from pathlib import Path
 from skimage.external.tifffile import imread
 from improv.actor import Actor, Spike, RunManager
+from improv.message import FrameMessage
 from queue import Empty
 
 import logging; logger = logging.getLogger(__name__)
@@ -17,11 +18,12 @@ logger.setLevel(logging.INFO)
 
 class ZMQAcquirer(Actor):
 
-    def __init__(self, *args, ip=None, ports=None, **kwargs):
+    def __init__(self, *args, ip=None, ports=None, ring_size=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.ip = ip
         self.ports = ports
         self.frame_num = 0
+        self.ring_size = ring_size # if set, frames go to a preallocated ring of this many slots
 
         # Sanity check
         # ipaddress.ip_address(self.ip)  # Check if IP is valid.
@@ -168,8 +170,11 @@ class ZMQAcquirer(Actor):
                                                                                             # array.sum(), time.time() - t0))
                 # output example: b'frame ch0 10:02:01.115 AM 10/11/2019' messsage length: 1049637. Element sum: 48891125; time to process: 0.04192757606506348
                 
-                obj_id = self.client.put(array, 'acq_raw' + str(self.frame_num))
-                self.q_out.put([{str(self.frame_num): obj_id}])
+                if self.ring_size:
+                    obj_id = self.client.putRing(array, 'acq_raw', self.ring_size)
+                else:
+                    obj_id = self.client.put(array, 'acq_raw', frame=self.frame_num)
+                self.q_out.put(FrameMessage(self.frame_num, [obj_id]))
 
                 self.saveArray.append(array)
                 self.frametimes.append([self.frame_num, time.time()])
@@ -7,6 +7,7 @@ import random
 from pathlib import Path
 from skimage.io import imread
 from improv.actor import Actor, Spike, RunManager
+from improv.message import FrameMessage
 from queue import Empty
 from improv.actors.acquire import FileAcquirer
 
@@ -51,10 +52,13 @@ class TbifAcquirer(FileAcquirer):
             frame = self.getFrame(self.frame_num)
             if self.frame_num == len(self.data):
                 print('Done with dataset ', self.frame_num)
-            id = self.client.put(frame, 'acq_raw'+str(self.frame_num))
+            if self.ring_size:
+                id = self.client.putRing(frame, 'acq_raw', self.ring_size)
+            else:
+                id = self.client.put(frame, 'acq_raw', frame=self.frame_num)
             self.timestamp.append([time.time(), self.frame_num])
             try:
-                self.q_out.put([{str(self.frame_num):id}])
+                self.q_out.put(FrameMessage(self.frame_num, [id]))
                 self.links['stim_queue'].put({self.frame_num:self.stim[self.frame_num % len(self.stim)]})
                 #logger.info('Current stim: {}'.format(self.stim[self.frame_num]))
                 self.frame_num += 1
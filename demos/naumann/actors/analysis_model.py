@@ -1,5 +1,6 @@
 from improv.actor import Actor, Spike, RunManager
 from improv.store import ObjectNotFoundError
+from improv.message import FrameMessage
 from queue import Empty
 import numpy as np
 import time
@@ -91,18 +92,17 @@ class ModelAnalysis(Actor):
             Create X and Y for plotting
         '''
         t = time.time()
-        ids = None
 
         try:
-            ids = self.q_in.get(timeout=0.0001)
-            if ids is not None and ids[0]==1:
+            msg = self.q_in.get(timeout=0.0001)
+            if msg.isMissing:
                 print('analysis: missing frame')
                 self.total_times.append(time.time()-t)
-                self.q_out.put([1])
+                self.q_out.put(FrameMessage.missing(msg.frame))
                 raise Empty
             # t = time.time()
-            self.frame = ids[-1]
-            (self.coordDict, self.image, self.S) = self.client.getList(ids[:-1])
+            self.frame = msg.frame
+            (self.coordDict, self.image, self.S) = self.client.getList(list(msg.ids))
             self.C = self.S
             self.coords = [o['coordinates'] for o in self.coordDict]
             
@@ -426,9 +426,8 @@ class ModelAnalysis(Actor):
         ids.append(self.client.put(self.allStims, 'stim'+str(self.frame)))
         ids.append(self.client.put(w, 'w'+str(self.frame)))
         ids.append(self.client.put(np.array(self.LL), 'LL'+str(self.frame)))
-        ids.append(self.frame)
 
-        self.q_out.put(ids)
+        self.q_out.put(FrameMessage(self.frame, ids))
         self.puttime.append(time.time()-t)
 
     def stimAvg_start(self):
@@ -16,6 +16,7 @@ from os.path import expanduser
 import os
 from queue import Empty
 from improv.actor import Actor, Spike, RunManager
+from improv.message import FrameMessage
 import traceback
 
 import logging; logger = logging.getLogger(__name__)
@@ -136,7 +137,10 @@ class CaimanProcessor(Actor):
             t = time.time()
             self.done = False
             try:
-                self.frame = self.client.getID(frame[0][str(self.frame_number)])
+                frame_id = self._frameID(frame, self.frame_number)
+                if frame_id is None:
+                    raise KeyError(str(self.frame_number))
+                self.frame = self.client.getID(frame_id)
                 self.frame = self._processFrame(self.frame, self.frame_number+init)
                 t2 = time.time()
                 self._fitFrame(self.frame_number+init, self.frame.reshape(-1, order='F'))
@@ -146,7 +150,7 @@ class CaimanProcessor(Actor):
             except ObjectNotFoundError:
                 logger.error('Processor: Frame {} unavailable from store, droppping'.format(self.frame_number))
                 self.dropped_frames.append(self.frame_number)
-                self.q_out.put([1])
+                self.q_out.put(FrameMessage.missing(self.frame_number))
             except KeyError as e:
                 logger.error('Processor: Key error... {0}'.format(e))
                 # Proceed at all costs
@@ -263,9 +267,8 @@ class CaimanProcessor(Actor):
         ids.append(self.client.put(self.coords, 'coords'+str(self.frame_number)))
         ids.append(self.client.put(image, 'proc_image'+str(self.frame_number)))
         ids.append(self.client.put(C, 'S'+str(self.frame_number)))
-        ids.append(self.frame_number)
         t6 = time.time()
-        self.q_out.put(ids)
+        self.q_out.put(FrameMessage(self.frame_number, ids))
         #self.q_comm.put([self.frame_number])
 
         ## figures only
@@ -287,6 +290,17 @@ class CaimanProcessor(Actor):
             # logger.info('No frames for processing')
             return None
 
+    def _frameID(self, message, frame_number):
+        ''' Store id of frame frame_number in a q_in message, or None.
+            Messages are FrameMessages, or {frame number: id} dicts
+        '''
+        if isinstance(message, FrameMessage):
+            return message.ids[0] if message.ids else None
+        try:
+            return message[0][str(frame_number)]
+        except (KeyError, IndexError, TypeError):
+            return None
+
 
     def _processFrame(self, frame, frame_number):
         ''' Do some basic processing on a single frame
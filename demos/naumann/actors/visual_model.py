@@ -79,25 +79,24 @@ class CaimanVisual(Actor):
 
     def getData(self):
         t = time.time()
-        ids = None
         try:
-            id = self.links['raw_frame_queue'].get(timeout=0.0001)
-            self.raw_frame_number = list(id[0].keys())[0]
-            self.raw = self.client.getID(id[0][self.raw_frame_number])
+            msg = self.links['raw_frame_queue'].get(timeout=0.0001)
+            self.raw_frame_number = msg.frame
+            self.raw = self.client.getID(msg.ids[0])
         except Empty as e:
             pass
         except Exception as e:
             logger.error('Visual: Exception in get data: {}'.format(e))
         try: 
-            ids = self.q_in.get(timeout=0.0001)
-            if ids is not None and ids[0]==1:
+            msg = self.q_in.get(timeout=0.0001)
+            if msg.isMissing:
                 print('visual: missing frame')
                 self.frame_num += 1
                 self.total_times.append([time.time(), time.time()-t])
                 raise Empty
-            self.frame_num = ids[-1]
+            self.frame_num = msg.frame
             if self.draw:
-                (self.Cx, self.C, self.Cpop, self.tune, self.color, self.coords, self.allStims, self.w, self.LL) = self.client.getList(ids[:-1])
+                (self.Cx, self.C, self.Cpop, self.tune, self.color, self.coords, self.allStims, self.w, self.LL) = self.client.getList(list(msg.ids))
                 self.total_times.append([time.time(), time.time()-t])
             self.timestamp.append([time.time(), self.frame_num])
         except Empty as e:
@@ -1,9 +1,12 @@
 import asyncio
 from queue import Empty
 import time
+import select
 from typing import Awaitable, Callable
 import traceback
 
+from improv.message import FrameMessage
+
 
 import logging; logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -14,11 +17,17 @@ class Actor():
         Needs to have a store and links for communication
         Also needs at least a setup and run function
     '''
-    def __init__(self, name, links={}, **kwargs):
+    def __init__(self, name, links={}, batch_size=1, spin=0, **kwargs):
         ''' Require a name for multiple instances of the same actor/class
             Create initial empty dict of Links for easier referencing
+            batch_size: most messages getBatch takes at once (an actor
+            option in the config)
+            spin: seconds a RunManager waiting on inputs may poll them
+            before blocking (an actor option in the config)
         '''
         self.q_watchout = None
+        self.q_watchin = None
+        self.client = None
         self.name = name
         self.links = links
         self.done = False # TODO: obsolete, remove
@@ -29,6 +38,8 @@ class Actor():
         # q_in and q_out are for passing ID information to access data in the store
         self.q_in = None
         self.q_out = None
+        self.batch_size = batch_size
+        self.spin = spin
 
     def __repr__(self):
         ''' Return this instance name and links dict
@@ -71,6 +82,12 @@ class Actor():
         self.q_watchout= q_watch
         self.links.update({'q_watchout':self.q_watchout})
 
+    def setLinkSaved(self, q_saved):
+        ''' Set the queue of ids the Watcher has saved, to unpin
+        '''
+        self.q_watchin = q_saved
+        self.links.update({'q_watchin':self.q_watchin})
+
     def addLink(self, name, link):
         ''' Function provided to add additional data links by name
             using same form as q_in or q_out
@@ -92,23 +109,60 @@ class Actor():
         '''
         raise NotImplementedError
 
+    def getBatch(self, q_in=None, timeout=0):
+        ''' Messages waiting on q_in (default self.q_in), up to batch_size,
+            waiting up to timeout seconds for the first. Returns a list,
+            empty if nothing came. Lets an actor that fell behind handle
+            its backlog together, e.g. fetching every frame in one store call
+        '''
+        if q_in is None:
+            q_in = self.q_in
+        return q_in.get_batch(self.batch_size, timeout)
+
     def put(self, idnames, q_out= None, save=None):
-    
+        ''' Send idnames on q_out (default self.q_out), also handing those
+            flagged in save to the Watcher.
+            idnames may be a FrameMessage; save then flags its ids.
+            Returns the number of messages the link's policy dropped
+        '''
+        if q_out == None:
+            q_out= self.q_out
+
+        dropped = q_out.put(idnames)
+
+        self.unpinSaved()
+
+        if isinstance(idnames, FrameMessage):
+            idnames = [[id, str(idnames.frame)] for id in idnames.ids]
         if save==None:
             save= [False]*len(idnames)
 
         if len(save)<len(idnames):
             save= save + [False]*(len(idnames)-len(save))
 
-        if q_out == None:
-            q_out= self.q_out
-
-        q_out.put(idnames)
- 
         for i in range(len(idnames)):
             if save[i]:
                 if self.q_watchout:
-                    self.q_watchout.put(idnames[i])
+                    # Saved objects are exempt from eviction until the Watcher
+                    # has written them and sent them back on q_watchin
+                    if (self.client is not None and self.q_watchin is not None
+                            and self.client.pin(idnames[i][0])):
+                        self.q_watchout.put(list(idnames[i]) + [True])
+                    else:
+                        self.q_watchout.put(idnames[i])
+        return dropped
+
+    def unpinSaved(self):
+        ''' Return the objects the Watcher has saved to this actor's
+            eviction policies. Runs on every put
+        '''
+        if self.q_watchin is None:
+            return
+        while True:
+            try:
+                self.client.unpin(self.q_watchin.get_nowait())
+            except Empty:
+                return
 
 
     def run(self):
@@ -174,9 +228,17 @@ class Spike():
 
 
 class RunManager():
+    ''' Runs runMethod over and over while running, handling signals
+        from Nexus on q_sig between calls.
+        By default it polls q_sig after every call. Given inputs (the
+        Links runMethod reads), it instead waits until q_sig or one of
+        them has something, so an idle actor sleeps rather than spins;
+        it blocks on q_sig alone while not running. spin: seconds, at
+        most, to poll before blocking, for actors that must react
+        within a millisecond; adapted between spin/64 and spin by
+        whether data came while polling
     '''
-    '''
-    def __init__(self, name, runMethod, setup, q_sig, q_comm):
+    def __init__(self, name, runMethod, setup, q_sig, q_comm, inputs=None, spin=0):
         self.run = False
         self.config = False
         self.runMethod = runMethod
@@ -184,12 +246,17 @@ class RunManager():
         self.q_sig = q_sig
         self.q_comm = q_comm
         self.actorName = name
+        self.inputs = inputs
+        self.spin = spin
+        self.spinFor = spin
 
         #TODO make this tunable
         self.timeout = 0.000001
 
     def __enter__(self):
         self.start = time.time()
+        if self.inputs is not None:
+            return self._runEvents()
 
         while True:
             if self.run:
@@ -208,24 +275,74 @@ class RunManager():
                 self.config = False #Run once
             try: 
                 signal = self.q_sig.get(timeout=self.timeout)
-                if signal == Spike.run(): 
-                    self.run = True
-                    logger.warning('Received run signal, begin running')
-                elif signal == Spike.setup():
-                    self.config = True
-                elif signal == Spike.quit():
-                    logger.warning('Received quit signal, aborting')
+                if not self._signal(signal):
                     break
-                elif signal == Spike.pause():
-                    logger.warning('Received pause signal, pending...')
-                    self.run = False
-                elif signal == Spike.resume(): #currently treat as same as run
-                    logger.warning('Received resume signal, resuming')
-                    self.run = True
             except Empty as e:
                 pass #no signal from Nexus
         return None #Status...?
 
+    def _runEvents(self):
+        ''' The run loop when waiting on q_sig and inputs
+        '''
+        waitables = [self.q_sig] + list(self.inputs)
+        while True:
+            if self.run:
+                try:
+                    self.runMethod()
+                except Exception as e:
+                    logger.error('Actor '+self.actorName+' exception during run: {}'.format(e))
+                    print(traceback.format_exc())
+                self._wait(waitables)
+            elif self.config:
+                try:
+                    self.setup()
+                    self.q_comm.put([Spike.ready()])
+                except Exception as e:
+                    logger.error('Actor '+self.actorName+' exception during setup: {}'.format(e))
+                    raise Exception
+                self.config = False
+            try:
+                # Idle until Nexus says otherwise
+                signal = self.q_sig.get(block=not self.run)
+            except Empty:
+                continue
+            if not self._signal(signal):
+                return None
+
+    def _wait(self, waitables):
+        ''' Return once any of waitables is readable: poll for up to
+            spinFor seconds, then block
+        '''
+        if self.spinFor > 0:
+            deadline = time.perf_counter() + self.spinFor
+            while True:
+                if select.select(waitables, [], [], 0)[0]:
+                    self.spinFor = min(2*self.spinFor, self.spin)
+                    return
+                if time.perf_counter() >= deadline:
+                    break
+            self.spinFor = max(self.spinFor/2, self.spin/64)
+        select.select(waitables, [], [])
+
+    def _signal(self, signal):
+        ''' Act on a signal from Nexus; False on quit
+        '''
+        if signal == Spike.run():
+            self.run = True
+            logger.warning('Received run signal, begin running')
+        elif signal == Spike.setup():
+            self.config = True
+        elif signal == Spike.quit():
+            logger.warning('Received quit signal, aborting')
+            return False
+        elif signal == Spike.pause():
+            logger.warning('Received pause signal, pending...')
+            self.run = False
+        elif signal == Spike.resume(): #currently treat as same as run
+            logger.warning('Received resume signal, resuming')
+            self.run = True
+        return True
+
 
     def __exit__(self, type, value, traceback):
         logger.info('Ran for '+str(time.time()-self.start)+' seconds')
@@ -6,6 +6,7 @@ import numpy as np
 from skimage.io import imread
 
 from improv.actor import Actor, RunManager
+from improv.message import FrameMessage
 
 import logging; logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -16,7 +17,7 @@ class FileAcquirer(Actor):
     '''Class to import data from files and output
        frames in a buffer, or discrete.
     '''
-    def __init__(self, *args, filename=None, framerate=30, **kwargs):
+    def __init__(self, *args, filename=None, framerate=30, ring_size=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.frame_num = 0
         self.data = None
@@ -24,6 +25,7 @@ class FileAcquirer(Actor):
         self.flag = False
         self.filename = filename
         self.framerate = 1/framerate 
+        self.ring_size = ring_size # if set, frames go to a preallocated ring of this many slots
 
     def setup(self):
         '''Get file names from config or user input
@@ -85,11 +87,14 @@ class FileAcquirer(Actor):
             # if self.frame_num > 1500 and self.frame_num < 1800:
             #     frame = None
             t= time.time()
-            id = self.client.put(frame, 'acq_raw'+str(self.frame_num))
+            if self.ring_size:
+                id = self.client.putRing(frame, 'acq_raw', self.ring_size)
+            else:
+                id = self.client.put(frame, 'acq_raw', frame=self.frame_num)
             t1= time.time()
             self.timestamp.append([time.time(), self.frame_num])
             try:
-                self.put([[id, str(self.frame_num)]], save=[True])
+                self.put(FrameMessage(self.frame_num, [id]), save=[True])
                 self.frame_num += 1
                  #also log to disk #TODO: spawn separate process here?  
             except Exception as e:
@@ -213,9 +218,10 @@ class TiffAcquirer(Actor):
     ''' Loops through a TIF file.
     '''
 
-    def __init__(self, *args, filename=None, framerate=30, **kwargs):
+    def __init__(self, *args, filename=None, framerate=30, ring_size=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.filename = filename
+        self.ring_size = ring_size
 
         if not os.path.exists(filename):
             raise ValueError('TIFF file {} does not exist.'.format(filename))
@@ -236,8 +242,11 @@ class TiffAcquirer(Actor):
 
     def run_acquirer(self):
         t0 = time.time()
-        id_store = self.client.put(self.imgs[self.n_frame], 'acq_raw' + str(self.n_frame))
-        self.q_out.put([[id_store, str(self.n_frame)]])
+        if self.ring_size:
+            id_store = self.client.putRing(self.imgs[self.n_frame], 'acq_raw', self.ring_size)
+        else:
+            id_store = self.client.put(self.imgs[self.n_frame], 'acq_raw', frame=self.n_frame)
+        self.q_out.put(FrameMessage(self.n_frame, [id_store]))
         self.n_frame += 1
 
         time.sleep(1 / self.fps)
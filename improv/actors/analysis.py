@@ -5,6 +5,7 @@ from queue import Empty
 import os
 
 from improv.actor import Actor, Spike, RunManager
+from improv.message import FrameMessage
 from improv.store import ObjectNotFoundError
 
 import logging; logger = logging.getLogger(__name__)
@@ -12,8 +13,8 @@ logger.setLevel(logging.INFO)
 
 class MeanAnalysis(Actor):
     #TODO: Add additional error handling
-    def __init__(self, *args):
-        super().__init__(*args)
+    def __init__(self, *args, batch_size=16, **kwargs):
+        super().__init__(*args, batch_size=batch_size, **kwargs)
 
     def setup(self, param_file=None):
         ''' Set custom parameters here
@@ -32,7 +33,8 @@ class MeanAnalysis(Actor):
         self.Call = None
         self.Cx = None
         self.Cpop = None
-        self.coords = None
+        self.coords = None  # ROITable
+        self.coords_id = None
         self.color = None
         self.runMean = None
         self.runMeanOn = None
@@ -47,7 +49,8 @@ class MeanAnalysis(Actor):
         self.stimtime = []
         self.timestamp = []
 
-        with RunManager(self.name, self.runAvg, self.setup, self.q_sig, self.q_comm) as rm:
+        with RunManager(self.name, self.runAvg, self.setup, self.q_sig, self.q_comm,
+                        inputs=[self.q_in, self.links['input_stim_queue']], spin=self.spin) as rm:
             logger.info(rm)
         
         print('Analysis broke, avg time per frame: ', np.mean(self.total_times, axis=0))
@@ -76,25 +79,32 @@ class MeanAnalysis(Actor):
             Create X and Y for plotting
         '''
         t = time.time()
-        ids = None
-        try: 
-            sig = self.links['input_stim_queue'].get(timeout=0.0001)
+        for sig in self.getBatch(self.links['input_stim_queue'], timeout=0.0001):
             self.updateStim_start(sig)
-        except Empty as e:
-            pass #no change in input stimulus
         try:
-            ids = self.q_in.get(timeout=0.0001)
-            ids = [id[0] for id in ids]
-            if ids is not None and ids[0]==1:
-                print('analysis: missing frame')
+            messages = self.getBatch(timeout=0.0001)
+            if not messages:
+                raise Empty
+            # Each bundle holds the whole window of estimates, so after a
+            # stall only the newest of the waiting ones needs analyzing
+            for msg in messages:
+                if msg.isMissing:
+                    print('analysis: missing frame')
+                    self.q_out.put(FrameMessage.missing(msg.frame))
+            found = [msg for msg in messages if not msg.isMissing]
+            if not found:
                 self.total_times.append(time.time()-t)
-                self.q_out.put([1])
                 raise Empty
+            msg = found[-1]
             # t = time.time()
-            self.frame = ids[-1]
-            (self.coordDict, self.image, self.S) = self.client.getList(ids[:-1])
+            self.frame = msg.frame
+            estimates = self.client.getMany(msg.ids[0])
+            (coords_id, self.image, self.S) = (estimates['coords'], estimates['image'], estimates['C'])
             self.C = self.S
-            self.coords = [o['coordinates'] for o in self.coordDict]
+            if coords_id != self.coords_id:
+                # The ROI table only changes when components are added
+                self.coords = self.client.getID(coords_id)
+                self.coords_id = coords_id
             
             # Compute tuning curves based on input stimulus
             # Just do overall average activity for now
@@ -174,16 +184,11 @@ class MeanAnalysis(Actor):
         ''' Throw things to DS and put IDs in queue for Visual
         '''
         t = time.time()
-        ids = []
-        ids.append([self.client.put(self.Cx, 'Cx'+str(self.frame)), 'Cx'+str(self.frame)])
-        ids.append([self.client.put(self.Call, 'Call'+str(self.frame)), 'Call'+str(self.frame)])
-        ids.append([self.client.put(self.Cpop, 'Cpop'+str(self.frame)), 'Cpop'+str(self.frame)])
-        ids.append([self.client.put(self.tune, 'tune'+str(self.frame)), 'tune'+str(self.frame)])
-        ids.append([self.client.put(self.color, 'color'+str(self.frame)), 'color'+str(self.frame)])
-        ids.append([self.client.put(self.coordDict, 'analys_coords'+str(self.frame)), 'analys_coords'+str(self.frame)])
-        ids.append([self.frame, str(self.frame)])
+        bundle = {'Cx': self.Cx, 'Call': self.Call, 'Cpop': self.Cpop, 'tune': self.tune,
+                  'color': self.color, 'analys_coords': self.coords_id}
+        bundle_id = self.client.putMany(bundle, 'analysis', frame=self.frame)
 
-        self.put(ids, save= [False, False, False, False, False, False, False])
+        self.put(FrameMessage(self.frame, [bundle_id]), save=[False])
 
         self.puttime.append(time.time()-t)
 
@@ -337,7 +342,7 @@ class MeanAnalysis(Actor):
         color[...,3] = 255
             # color = self.color.copy() #TODO: don't stack image each time?
         if self.coords is not None:
-            for i,c in enumerate(self.coords):
+            for i,c in enumerate(self.coords.contours()):
                 #c = np.array(c)
                 ind = c[~np.isnan(c).any(axis=1)].astype(int)
                 cv2.fillConvexPoly(color, ind, self._tuningColor(i, color[ind[:,1], ind[:,0]]))
@@ -16,6 +16,8 @@ from os.path import expanduser
 import os
 from queue import Empty
 from improv.actor import Actor, Spike, RunManager
+from improv.message import FrameMessage
+from improv.roi import ROITable
 import traceback
 
 import logging; logger = logging.getLogger(__name__)
@@ -26,8 +28,9 @@ class CaimanProcessor(Actor):
        interface with our pipeline.
        Uses code from caiman/source_extraction/cnmf/online_cnmf.py
     '''
-    def __init__(self, *args, init_filename='data/Tolias_mesoscope_2.hdf5', config_file=None):
-        super().__init__(*args)
+    def __init__(self, *args, init_filename='data/Tolias_mesoscope_2.hdf5', config_file=None,
+                 batch_size=16, **kwargs):
+        super().__init__(*args, batch_size=batch_size, **kwargs)
         print('initfile ', init_filename, 'config file ', config_file)
         self.param_file = config_file
         print(init_filename)
@@ -42,6 +45,7 @@ class CaimanProcessor(Actor):
         self.done = False
         self.dropped_frames = []
         self.coords = None
+        self.coords_id = None
         self.ests = None
         self.A = None
         self.saving= True
@@ -73,7 +77,8 @@ class CaimanProcessor(Actor):
         self.timestamp = []
         self.counter = 0
 
-        with RunManager(self.name, self.runProcess, self.setup, self.q_sig, self.q_comm) as rm:
+        with RunManager(self.name, self.runProcess, self.setup, self.q_sig, self.q_comm,
+                        inputs=[self.q_in], spin=self.spin) as rm:
             logger.info(rm)
 
         print('Processor broke, avg time per frame: ', np.mean(self.total_times, axis=0))
@@ -118,13 +123,13 @@ class CaimanProcessor(Actor):
                 print(traceback.format_exc())
         else:
             print('No OASIS')
-        self.coords1 = [o['CoM'] for o in self.coords]
+        self.coords1 = self.coords.com
         print(self.coords1[0])
         print('type ', type(self.coords1[0]))
-        np.savetxt('output/contours.txt', np.array(self.coords1))
+        np.savetxt('output/contours.txt', self.coords1)
 
     def runProcess(self):
-        ''' Run process. Runs once per frame.
+        ''' Run process. Runs once per batch of waiting frames.
             Output is a location in the DS to continually
             place the Estimates results, with ref number that
             corresponds to the frame number (TODO)
@@ -134,14 +139,21 @@ class CaimanProcessor(Actor):
 
         #proc_params = self.client.get('params_dict')
         init = self.params['init_batch']
-        frame = self._checkFrames()
+        messages = self._checkFrames()
+        # After a stall, take the backlog (up to batch_size frames) at once
+        frame_ids = [self._frameID(m, self.frame_number+i) for i,m in enumerate(messages)]
+        frames = self._getFrames(frame_ids)
 
-        if frame is not None:
+        for frame_id, frame in zip(frame_ids, frames):
             t = time.time()
             self.done = False
             try:
-                self.frame = self.client.getID(frame[0][str(self.frame_number)])
-                self.frame = self._processFrame(self.frame, self.frame_number+init)
+                if frame_id is None:
+                    raise KeyError(str(self.frame_number))
+                if frame is None:
+                    frame = self.client.getID(frame_id)
+                self.frame = self._processFrame(frame, self.frame_number+init)
+                self.client.checkFrame(frame_id) # ring slot may be reused while we copy
                 t2 = time.time()
                 self._fitFrame(self.frame_number+init, self.frame.reshape(-1, order='F'))
                 self.fitframe_time.append([time.time()-t2])
@@ -150,7 +162,7 @@ class CaimanProcessor(Actor):
             except ObjectNotFoundError:
                 logger.error('Processor: Frame {} unavailable from store, droppping'.format(self.frame_number))
                 self.dropped_frames.append(self.frame_number)
-                self.q_out.put([1])
+                self.q_out.put(FrameMessage.missing(self.frame_number))
             except KeyError as e:
                 logger.error('Processor: Key error... {0}'.format(e))
                 # Proceed at all costs
@@ -162,8 +174,6 @@ class CaimanProcessor(Actor):
                 self.dropped_frames.append(self.frame_number)
             self.frame_number += 1
             self.total_times.append(time.time()-t)
-        else:
-            pass
 
     def loadParams(self, param_file=None):
         ''' Load parameters from file or 'defaults' into store
@@ -263,14 +273,12 @@ class CaimanProcessor(Actor):
         self._updateCoords(A,dims)
         t5 = time.time()
 
-        ids = []
-        ids.append(self.client.put(self.coords, 'coords'+str(self.frame_number)))
-        ids.append(self.client.put(image, 'proc_image'+str(self.frame_number)))
-        ids.append(self.client.put(C, 'S'+str(self.frame_number)))
-        ids.append(self.frame_number)
+        # one bundle per frame; consumers read it back with getMany
+        bundle_id = self.client.putMany({'coords': self.coords_id, 'image': image, 'C': C},
+                                        'estimates', frame=self.frame_number)
         t6 = time.time()
 
-        self.q_out.put(ids)
+        self.put(FrameMessage(self.frame_number, [bundle_id]))
 
 
         #self.q_comm.put([self.frame_number])
@@ -280,15 +288,38 @@ class CaimanProcessor(Actor):
 
     def _checkFrames(self):
         ''' Check to see if we have frames for processing
+            Returns up to batch_size messages, or an empty list
+        '''
+        return self.getBatch(timeout=0.0005)
+
+    def _frameID(self, message, frame_number):
+        ''' Store id of frame frame_number in a q_in message, or None.
+            Messages are FrameMessages, or {frame number: id} dicts
         '''
+        if isinstance(message, FrameMessage):
+            return message.ids[0] if message.ids else None
         try:
-            res = self.q_in.get(timeout=0.0005)
-            return res
-        #TODO: add'l error handling
-        except Empty:
-            # logger.info('No frames for processing')
+            return message[0][str(frame_number)]
+        except (KeyError, IndexError, TypeError):
             return None
 
+    def _getFrames(self, frame_ids):
+        ''' Get the frames for a batch of ids in one store call.
+            Entries are None where the id is None or the frame has to be
+            got (or fail) on its own, e.g. an overwritten ring slot; if
+            any frame is missing (e.g. evicted), all are got on their own
+        '''
+        ids = [i for i in frame_ids if i is not None]
+        try:
+            got = iter(self.client.getList(ids, timeout=0) if ids else [])
+        except Exception:
+            got = iter([None]*len(ids))
+        frames = []
+        for i in frame_ids:
+            f = None if i is None else next(got)
+            frames.append(f if isinstance(f, np.ndarray) else None)
+        return frames
+
 
     def _processFrame(self, frame, frame_number):
         ''' Do some basic processing on a single frame
@@ -350,15 +381,23 @@ class CaimanProcessor(Actor):
         '''
         if self.coords is None: #initial calculation
             self.A = A
-            self.coords = get_contours(A, dims)
+            self.coords = ROITable.fromContours(get_contours(A, dims))
+            self._putCoords()
 
         elif np.shape(A)[1] > np.shape(self.A)[1]: # and self.frame_number % 50 == 0:
             #Only recalc if we have new components
             # FIXME: Since this is only for viz, only do this every 100 frames
             # TODO: maybe only recalc coords that are new?
             self.A = A
-            self.coords = get_contours(A, dims)
             self.counter += 1
+            self.coords = ROITable.fromContours(get_contours(A, dims), version=self.counter)
+            self._putCoords()
+
+    def _putCoords(self):
+        ''' Put the ROI table when it changes; the estimates for each
+            frame refer to the current one by id
+        '''
+        self.coords_id = self.client.put(self.coords, 'coords', frame=self.coords.version)
 
 
     def makeImage(self):
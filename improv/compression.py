@@ -0,0 +1,111 @@
+''' Compression codecs for data persisted to disk (LMDBStore records,
+    BasicWatcher files), selected per object type in the settings block:
+
+        settings:
+          codecs:
+            acq_raw: delta
+            estimates: zlib
+
+    none:    stored as is
+    zlib:    stdlib zlib (fast level)
+    lzma:    stdlib lzma, slower but smaller
+    shuffle: numpy arrays are byte-shuffled (all first bytes of each
+             element, then all second bytes, ...) before zlib; groups the
+             mostly-constant high bytes of e.g. 16-bit frames together
+    delta:   integer arrays store differences between consecutive values,
+             then shuffle; suits slowly varying integer imaging frames
+
+    shuffle and delta apply to numpy arrays only; for other objects they
+    fall back to zlib. Decoding always uses the codec recorded with the data.
+'''
+import zlib
+import lzma
+import struct
+import numpy as np
+
+import logging; logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CODECS = ('none', 'zlib', 'lzma', 'shuffle', 'delta')
+CODEC_IDS = {name: i for i, name in enumerate(CODECS)}
+ZLIB_LEVEL = 1
+LZMA_PRESET = 1
+
+# dtype string, number of dimensions; followed by the shape
+_ARRAY = struct.Struct('<16sB')
+
+
+def checkCodec(codec):
+    if codec not in CODEC_IDS:
+        raise ValueError('Unknown codec {}; choose from {}'.format(codec, ', '.join(CODECS)))
+    return codec
+
+
+def isArrayCodec(codec, obj):
+    ''' Whether codec can encode obj with encodeArray rather than
+        compressing its serialized bytes
+    '''
+    if codec not in ('shuffle', 'delta') or not isinstance(obj, np.ndarray):
+        return False
+    return obj.dtype.kind in 'biufc' and obj.ndim <= 255
+
+
+def compress(data, codec):
+    ''' Compress bytes with a byte codec (zlib or lzma)
+    '''
+    if codec == 'none':
+        return data
+    if codec == 'lzma':
+        return lzma.compress(data, preset=LZMA_PRESET)
+    return zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress(data, codec):
+    if codec == 'none':
+        return data
+    if codec == 'lzma':
+        return lzma.decompress(data)
+    return zlib.decompress(data)
+
+
+def encodeArray(arr, codec):
+    ''' Encode a numeric array with shuffle or delta (see module doc)
+    '''
+    arr = np.ascontiguousarray(arr)
+    flat = arr.reshape(-1)
+    if codec == 'delta' and arr.dtype.kind in 'iu':
+        # differences wrap around in the array's own dtype; cumsum undoes them exactly
+        delta = np.empty_like(flat)
+        delta[:1] = flat[:1]
+        np.subtract(flat[1:], flat[:-1], out=delta[1:])
+        flat = delta
+    header = _ARRAY.pack(arr.dtype.str.encode(), arr.ndim)
+    shape = struct.pack('<{}Q'.format(arr.ndim), *arr.shape)
+    return header + shape + zlib.compress(_shuffle(flat), ZLIB_LEVEL)
+
+
+def decodeArray(buf, codec):
+    ''' Rebuild an array encoded by encodeArray. Returns a new, writeable array
+    '''
+    dtype, ndim = _ARRAY.unpack_from(buf, 0)
+    dtype = np.dtype(dtype.rstrip(b'\0').decode())
+    pos = _ARRAY.size
+    shape = struct.unpack_from('<{}Q'.format(ndim), buf, pos)
+    pos += 8*ndim
+    flat = _unshuffle(zlib.decompress(buf[pos:]), dtype)
+    if codec == 'delta' and dtype.kind in 'iu':
+        flat = np.cumsum(flat, dtype=dtype)
+    return flat.reshape(shape)
+
+
+def _shuffle(arr):
+    if arr.dtype.itemsize == 1:
+        return arr.tobytes()
+    return np.ascontiguousarray(arr.reshape(-1).view(np.uint8).reshape(-1, arr.dtype.itemsize).T).tobytes()
+
+
+def _unshuffle(data, dtype):
+    planes = np.frombuffer(data, dtype=np.uint8)
+    if dtype.itemsize == 1:
+        return planes.view(dtype).copy()
+    return np.ascontiguousarray(planes.reshape(dtype.itemsize, -1).T).view(dtype).reshape(-1)
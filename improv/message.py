@@ -0,0 +1,106 @@
+''' Fixed-layout frame messages for Links.
+
+    Actors pass each other a frame number and the store ids of what they
+    put for that frame. As a FrameMessage this has one shape everywhere,
+    and the shared-memory queues (improv.shm_queue) pack it straight into
+    the queue with struct instead of pickling it:
+
+        header: frame (int64), timestamp (float64), sent (int64),
+                flags (uint32), id count (uint16), 2 bytes padding
+        per id: kind (uint8), 23-byte name or raw ObjectID, slot, seq (int64)
+
+    A store id is its raw 20 bytes; a RingRef keeps its ring name (up to
+    23 bytes), slot and sequence number. Other messages still go through
+    Links pickled.
+
+    sent is the time.monotonic_ns() at which a traced Link last sent the
+    message (0 if untraced), for the tracing in improv.trace.
+'''
+import time
+import struct
+
+from improv.shm_store import ObjectID
+from improv.ring import RingRef
+
+_HEADER = struct.Struct('<qdqIH2x')
+_ID = struct.Struct('<B23sqq')
+_OBJECT, _RING = 0, 1
+
+
+class FrameMessage():
+    ''' A frame number, the ids put for it, when the message was made
+        (time.time()), flags and when it was last sent
+    '''
+    __slots__ = ('frame', 'ids', 'timestamp', 'flags', 'sent')
+
+    MISSING = 1  # the frame was dropped upstream; ids is empty
+
+    def __init__(self, frame, ids=(), timestamp=None, flags=0, sent=0):
+        self.frame = frame
+        self.ids = tuple(ids)
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.flags = flags
+        self.sent = sent
+
+    @staticmethod
+    def missing(frame):
+        ''' Message saying frame was dropped
+        '''
+        return FrameMessage(frame, flags=FrameMessage.MISSING)
+
+    @property
+    def isMissing(self):
+        return bool(self.flags & FrameMessage.MISSING)
+
+    def __eq__(self, other):
+        return (isinstance(other, FrameMessage) and self.frame == other.frame and
+                self.ids == other.ids and self.timestamp == other.timestamp and
+                self.flags == other.flags and self.sent == other.sent)
+
+    def __reduce__(self):
+        return (FrameMessage, (self.frame, self.ids, self.timestamp, self.flags, self.sent))
+
+    def __repr__(self):
+        return 'FrameMessage(frame={}, ids={}, flags={})'.format(self.frame, list(self.ids), self.flags)
+
+    def nbytes(self):
+        ''' Packed size. Raises ValueError if an id cannot be packed
+        '''
+        for i in self.ids:
+            if isinstance(i, RingRef):
+                if len(i.name) > 23:
+                    raise ValueError('Ring name {} is too long to pack'.format(i.name))
+            elif not hasattr(i, 'binary'):
+                raise ValueError('Cannot pack id {!r}'.format(i))
+        return _HEADER.size + _ID.size*len(self.ids)
+
+    def packInto(self, buf, offset):
+        ''' Write the message at offset in buf; nbytes() must have succeeded
+        '''
+        _HEADER.pack_into(buf, offset, self.frame, self.timestamp, self.sent, self.flags, len(self.ids))
+        offset += _HEADER.size
+        for i in self.ids:
+            if isinstance(i, RingRef):
+                _ID.pack_into(buf, offset, _RING, i.name.encode(), i.slot, i.seq)
+            else:
+                _ID.pack_into(buf, offset, _OBJECT, i.binary(), 0, 0)
+            offset += _ID.size
+
+    @staticmethod
+    def unpackFrom(buf, offset):
+        ''' Read a message written by packInto. Store ids come back as
+            shm_store.ObjectIDs (Limbo converts them for plasma)
+        '''
+        frame, timestamp, sent, flags, count = _HEADER.unpack_from(buf, offset)
+        offset += _HEADER.size
+        ids = []
+        for _ in range(count):
+            kind, raw, slot, seq = _ID.unpack_from(buf, offset)
+            if kind == _RING:
+                ids.append(RingRef(raw.rstrip(b'\0').decode(), slot, seq))
+            elif kind == _OBJECT:
+                ids.append(ObjectID(raw[:20]))
+            else:
+                raise ValueError('Unknown id kind {}'.format(kind))
+            offset += _ID.size
+        return FrameMessage(frame, ids, timestamp, flags, sent)
@@ -0,0 +1,166 @@
+''' Store operation metrics in shared memory.
+
+    Each Limbo records the latency and bytes of its store operations, per
+    operation and object name prefix, into its own StoreMetrics block.
+    The block is written by one process only, with plain stores and no
+    locks, and can be read by any other process at any time (e.g. Nexus,
+    which creates the Limbos before forking the actors). A reader may see
+    a count and histogram that are one operation apart.
+
+    Latencies go into log2 buckets of nanoseconds, so percentiles are
+    accurate to a factor of two.
+'''
+import os
+import json
+import time
+import struct
+from multiprocessing import shared_memory
+import numpy as np
+import scipy.sparse
+
+import logging; logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MAX_SLOTS = 128  # (operation, prefix) pairs per block
+BUCKETS = 40  # bucket i holds latencies in [2**i, 2**(i+1)) ns
+_KEY_SIZE = 64
+_HEADER = struct.Struct('<qq')  # slot count, creating pid
+# Per slot: count, bytes, total ns, max ns, latency buckets
+_COUNT, _BYTES, _TOTAL, _MAX, _HIST = 0, 1, 2, 3, 4
+_SLOT = _HIST + BUCKETS
+_KEYS_OFFSET = 64
+_SLOTS_OFFSET = _KEYS_OFFSET + MAX_SLOTS*_KEY_SIZE
+
+
+def nbytes(obj):
+    ''' Cheap size estimate of an object put or got: arrays and byte
+        strings, one level into small containers (e.g. putMany bundles)
+    '''
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if scipy.sparse.issparse(obj):
+        return sum(a.nbytes for a in (obj.data, getattr(obj, 'indices', obj.data),
+                                      getattr(obj, 'indptr', obj.data)))
+    if isinstance(obj, dict) and len(obj) <= 64:
+        return sum(nbytes(v) for v in obj.values() if not isinstance(v, (dict, list, tuple)))
+    if isinstance(obj, (list, tuple)) and len(obj) <= 64:
+        return sum(nbytes(v) for v in obj if not isinstance(v, (dict, list, tuple)))
+    return 0
+
+
+class StoreMetrics():
+    ''' Latency histograms, byte and object counts per (operation, prefix)
+        for one Limbo, in a shared memory block.
+        Use StoreMetrics.create in the process that sets up the Limbo and
+        record() from the one process using it; snapshot() from anywhere
+    '''
+    def __init__(self, shm, owner_pid=None):
+        self.shm = shm
+        self.name = shm.name
+        self.owner_pid = owner_pid
+        self.counters = shm.buf[_SLOTS_OFFSET:].cast('q')
+        self.slots = {}  # (op, prefix): slot, in the writing process
+
+    @staticmethod
+    def create():
+        ''' Allocate a new zeroed block, unlinked by close() in this
+            process (not in forked children)
+        '''
+        size = _SLOTS_OFFSET + MAX_SLOTS*_SLOT*8
+        shm = shared_memory.SharedMemory('imx' + os.urandom(8).hex(), create=True, size=size)
+        _HEADER.pack_into(shm.buf, 0, 0, os.getpid())
+        return StoreMetrics(shm, os.getpid())
+
+    @staticmethod
+    def attach(name):
+        from improv.shm_store import _openSegment
+        return StoreMetrics(_openSegment(name))
+
+    def __reduce__(self):
+        return (StoreMetrics.attach, (self.name,))
+
+    def record(self, op, prefix, start_ns, size=0):
+        ''' Count one op on objects named prefix, started at
+            time.perf_counter_ns() start_ns, moving size bytes
+        '''
+        elapsed = time.perf_counter_ns() - start_ns
+        slot = self.slots.get((op, prefix))
+        if slot is None:
+            slot = self._addSlot(op, prefix)
+        c = self.counters
+        base = slot*_SLOT
+        c[base+_COUNT] += 1
+        c[base+_BYTES] += size
+        c[base+_TOTAL] += elapsed
+        if elapsed > c[base+_MAX]:
+            c[base+_MAX] = elapsed
+        c[base+_HIST+min(max(elapsed, 1).bit_length()-1, BUCKETS-1)] += 1
+
+    def snapshot(self):
+        ''' Current values as {op: {prefix: {count, bytes, mean_us,
+            p50_us, p99_us, max_us, hist}}}; percentiles are bucket
+            upper bounds
+        '''
+        out = {}
+        nslots = _HEADER.unpack_from(self.shm.buf, 0)[0]
+        counters = np.frombuffer(self.shm.buf, dtype=np.int64, offset=_SLOTS_OFFSET,
+                                 count=nslots*_SLOT).reshape(nslots, _SLOT).copy()
+        for slot in range(nslots):
+            key = bytes(self.shm.buf[_KEYS_OFFSET+slot*_KEY_SIZE:_KEYS_OFFSET+(slot+1)*_KEY_SIZE])
+            op, _, prefix = key.rstrip(b'\0').decode().partition('\0')
+            count, size, total, longest = counters[slot, :_HIST]
+            hist = counters[slot, _HIST:]
+            out.setdefault(op, {})[prefix] = {
+                'count': int(count), 'bytes': int(size),
+                'mean_us': total/count/1e3 if count else 0.0,
+                'p50_us': _percentile(hist, 0.5), 'p99_us': _percentile(hist, 0.99),
+                'max_us': longest/1e3, 'hist': hist.tolist()}
+        return out
+
+    def close(self):
+        ''' Unmap the block; the creating process also unlinks it
+        '''
+        self.counters.release()
+        self.shm.close()
+        if self.owner_pid == os.getpid():
+            self.shm.unlink()
+
+    def _addSlot(self, op, prefix):
+        nslots = _HEADER.unpack_from(self.shm.buf, 0)[0]
+        if nslots < MAX_SLOTS-1:
+            slot = self._writeKey(nslots, op, prefix)
+        else:
+            # The last slot collects everything past the limit
+            if nslots == MAX_SLOTS-1:
+                logger.warning('Metrics slots full; recording further prefixes as other')
+                self._writeKey(nslots, 'other', '')
+            slot = MAX_SLOTS-1
+        self.slots[(op, prefix)] = slot
+        return slot
+
+    def _writeKey(self, slot, op, prefix):
+        key = (op + '\0' + prefix).encode()[:_KEY_SIZE]
+        offset = _KEYS_OFFSET + slot*_KEY_SIZE
+        self.shm.buf[offset:offset+len(key)] = key
+        # Publish the slot once its key is written
+        struct.pack_into('<q', self.shm.buf, 0, slot+1)
+        return slot
+
+
+def _percentile(hist, q):
+    total = hist.sum()
+    if total == 0:
+        return 0.0
+    bucket = int(np.searchsorted(np.cumsum(hist), q*total))
+    return 2**(bucket+1)/1e3
+
+
+def writeSnapshot(path, snapshot):
+    ''' Write a metrics snapshot as JSON, replacing path atomically
+    '''
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, path)
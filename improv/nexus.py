@@ -2,15 +2,16 @@ import sys
 import os
 import time
 import subprocess
-from multiprocessing import Process, Queue, Manager, cpu_count, set_start_method
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
 import numpy as np
 from PyQt5 import QtGui, QtWidgets
-import pyarrow.plasma as plasma
 from importlib import import_module
 from improv import store
+from improv.metrics import writeSnapshot
+from improv import trace, store_proxy
+from improv.shm_queue import ShmQueue, BroadcastQueue, getAsync, DEFAULT_CAPACITY
 from improv.tweak import Tweak
-from threading import Thread
+from threading import Thread, Event
 import asyncio
 import concurrent
 import functools
@@ -36,6 +37,13 @@ logging.basicConfig(level=logging.DEBUG,
         #fh.setFormatter(formatter)
         #logger.addHandler(fh)
 
+# Links are shared memory mapped before the actors start, so actor, GUI
+# and watcher processes must be forked from Nexus
+try:
+    mp = multiprocessing.get_context('fork')
+except ValueError:
+    mp = None
+
 # TODO: Set up limbo.notify in async function (?)
 
 class Nexus():
@@ -48,11 +56,20 @@ class Nexus():
         return self.name
 
     def createNexus(self, file=None):
-        self._startStore(40000000000) #default size should be system-dependent; this is 40 GB
-
-        #connect to store and subscribe to notifications
-        self.limbo = store.Limbo()
-        self.limbo.subscribe()
+        if mp is None:
+            raise RuntimeError('improv needs the fork start method, which this platform does not have')
+        # store backend and size come from the settings block of the config
+        self.settings = Tweak(configFile=file).loadSettings()
+        self._startStore(self.settings['store_size'], backend=self.settings['store_backend'],
+                         store_loc=self.settings['store_loc'],
+                         spill_dir=self.settings['store_spill_dir'],
+                         high_water=self.settings['store_high_water'],
+                         proxy=self.settings['store_proxy'])
+
+        #connect to store
+        self.metrics = {}  # Limbo name: StoreMetrics, written by the actors
+        self.traces = {}  # actor name: TraceRing, if tracing
+        self.limbo = self.createLimbo(self.name)
 
         self.comm_queues = {}
         self.sig_queues = {}
@@ -74,7 +91,7 @@ class Nexus():
         '''
         for name,m in self.actors.items(): # m accesses the specific actor class instance
             if 'GUI' not in name: #GUI already started
-                p = Process(target=self.runActor, name=name, args=(m,))
+                p = mp.Process(target=self.runActor, name=name, args=(m,))
                 if 'Watcher' not in name:
                     if 'daemon' in self.tweak.actors[name].options: # e.g. suite2p creates child processes.
                         p.daemon = self.tweak.actors[name].options['daemon']
@@ -93,7 +110,7 @@ class Nexus():
                 loop.add_signal_handler(
                     s, lambda s=s: asyncio.ensure_future(self.stop_polling(s, loop))) #TODO
 
-            loop.run_until_complete(self.pollQueues()) #TODO: in Link executor, complete all tasks
+            loop.run_until_complete(self.pollQueues())
             logger.info('Shutdown loop')
         else:
             pass
@@ -136,7 +153,7 @@ class Nexus():
                 self.createActor(name, m)
                 self.actors[name].setup(visual=self.actors[visualClass])
 
-                self.p_GUI = Process(target=self.actors[name].run, name=name)
+                self.p_GUI = mp.Process(target=self.runActor, name=name, args=(self.actors[name],))
                 self.p_GUI.daemon = True
                 self.p_GUI.start()
 
@@ -161,19 +178,22 @@ class Nexus():
         if self.tweak.settings['use_watcher'] is not None:
 
             watchin = []
+            saved = {}
 
             for name in self.tweak.settings['use_watcher']:
                 watch_link= Link(name+'_watch', name, 'Watcher')
                 self.assignLink(name+'.watchout', watch_link)
                 watchin.append(watch_link)
+                saved[name] = Link(name+'_saved', 'Watcher', name)
+                self.assignLink(name+'.watchin', saved[name])
 
-            self.createWatcher(watchin)
+            self.createWatcher(watchin, saved)
 
         #TODO: error handling for if a user tries to use q_in without defining it
 
-    def createWatcher(self, watchin):
-        watcher= BasicWatcher('Watcher', inputs=watchin)
-        watcher.setStore(store.Limbo(watcher.name))
+    def createWatcher(self, watchin, saved=None):
+        watcher= BasicWatcher('Watcher', inputs=watchin, saved=saved, codecs=self.settings['codecs'])
+        watcher.setStore(self.createLimbo(watcher.name))
         q_comm = Link('Watcher_comm', watcher.name, self.name)
         q_sig = Link('Watcher_sig', self.name, watcher.name)
         self.comm_queues.update({q_comm.name:q_comm})
@@ -192,7 +212,7 @@ class Nexus():
         instance = clss(actor.name, **actor.options)
 
         # Add link to Limbo store
-        instance.setStore(store.Limbo(actor.name))
+        instance.setStore(self.createLimbo(actor.name))
 
         # Add signal and communication links
         q_comm = Link(actor.name+'_comm', actor.name, self.name)
@@ -201,25 +221,80 @@ class Nexus():
         self.sig_queues.update({q_sig.name:q_sig})
         instance.setCommLinks(q_comm, q_sig)
 
+        if self.settings['trace_file'] is not None:
+            self.traces[actor.name] = trace.TraceRing.create(self.settings['trace_capacity'])
+
         # Update information
         self.actors.update({name:instance})
 
+    def createLimbo(self, name):
+        ''' Connect a client of the configured store backend
+        '''
+        if self.settings['store_backend'] == 'shared_memory':
+            limbo = store.SharedLimbo(name, store_loc=self.settings['store_loc'],
+                                      eviction=self.settings['eviction'],
+                                      index_size=self.settings['index_size'],
+                                      codecs=self.settings['codecs'],
+                                      metrics=self.settings['store_metrics'])
+        else:
+            limbo = store.Limbo(name, store_loc=self.settings['store_loc'],
+                                eviction=self.settings['eviction'],
+                                index_size=self.settings['index_size'],
+                                codecs=self.settings['codecs'],
+                                metrics=self.settings['store_metrics'])
+        if limbo.metrics is not None:
+            self.metrics[name] = limbo.metrics
+        return limbo
+
+    def storeMetrics(self):
+        ''' Scrape the store: occupancy and object counts from the store
+            itself, and per-Limbo operation metrics (see improv.metrics)
+        '''
+        try:
+            occupancy = self.limbo.client.stats()
+        except AttributeError:  # plasma
+            occupancy = {'capacity': self.limbo.client.store_capacity(),
+                         'count': len(self.limbo.get_all())}
+        return {'time': time.time(), 'store': occupancy,
+                'limbos': {name: m.snapshot() for name, m in self.metrics.items()},
+                'link_drops': self.linkDrops()}
+
+    def linkDrops(self):
+        ''' Messages dropped so far by each data link's policy, by
+            connection end (e.g. 'Processor.q_in')
+        '''
+        return {end: link.dropped() for end, link in self.data_queues.items()}
+
+    def _exportMetrics(self, path, interval):
+        ''' Write storeMetrics to path every interval seconds until
+            self.metrics_stop is set
+        '''
+        while not self.metrics_stop.wait(interval):
+            try:
+                writeSnapshot(path, self.storeMetrics())
+            except Exception as e:
+                logger.error('Cannot write store metrics to {}: {}'.format(path, e))
+
     def createConnections(self):
         ''' Assemble links (multi or other)
             for later assignment
         '''
         for source,drain in self.tweak.connections.items():
             name = source.split('.')[0]
+            options = self.tweak.linkOptions.get(source, {})
+            maxsize = options.get('capacity', 0)
             #current assumption is connection goes from q_out to something(s) else
             if len(drain) > 1: #we need multiasyncqueue
-                link, endLinks = MultiLink(name+'_multi', source, drain)
+                link, endLinks = MultiLink(name+'_multi', source, drain, maxsize=maxsize,
+                                           policy=options.get('policy', self.settings['broadcast_policy']))
                 self.data_queues.update({source:link})
                 for i,e in enumerate(endLinks):
                     self.data_queues.update({drain[i]:e})
             else: #single input, single output
                 d = drain[0]
                 d_name = d.split('.') #TODO: check if .anything, if not assume q_in
-                link = Link(name+'_'+d_name[0], source, d)
+                link = Link(name+'_'+d_name[0], source, d, maxsize=maxsize,
+                            policy=options.get('policy', 'block'))
                 self.data_queues.update({source:link})
                 self.data_queues.update({d:link})
 
@@ -240,22 +315,25 @@ class Nexus():
             self.actors[classname].setLinkIn(link)
         elif linktype == 'watchout':
             self.actors[classname].setLinkWatch(link)
+        elif linktype == 'watchin':
+            self.actors[classname].setLinkSaved(link)
         else:
             self.actors[classname].addLink(linktype, link)
 
     def runActor(self, actor):
         '''Run the actor continually; used for separate processes
-            #TODO: hook into monitoring here?
+            Its Links trace into its TraceRing, if any
         '''
+        trace.attach(self.traces.get(actor.name))
         actor.run()
 
     def startWatcher(self):
-        self.watcher = store.Watcher('watcher', store.Limbo('watcher'))
+        self.watcher = store.Watcher('watcher', self.createLimbo('watcher'))
         q_sig = Link('watcher_sig', self.name, 'watcher')
         self.watcher.setLinks(q_sig)
         self.sig_queues.update({q_sig.name:q_sig})
 
-        self.p_watch = Process(target=self.watcher.run, name='watcher_process')
+        self.p_watch = mp.Process(target=self.watcher.run, name='watcher_process')
         self.p_watch.daemon = True
         self.p_watch.start()
         self.processes.append(self.p_watch)
@@ -264,6 +342,11 @@ class Nexus():
         logger.info('Starting processes')
         self.t = time.time()
 
+        self.metrics_stop = Event()
+        if self.settings['metrics_file'] is not None:
+            Thread(target=self._exportMetrics, daemon=True,
+                   args=(self.settings['metrics_file'], self.settings['metrics_interval'])).start()
+
         for p in self.processes:
             p.start()
 
@@ -306,9 +389,24 @@ class Nexus():
 
         logger.warning('Actors terminated')
         print('total time ', time.time()-self.t)
+        drops = {end: n for end, n in self.linkDrops().items() if n}
+        if drops:
+            logger.warning('Messages dropped by link policies: {}'.format(drops))
+        if self.traces:
+            self.writeTimeline(self.settings['trace_file'])
 
         self.destroyNexus()
 
+    def writeTimeline(self, path):
+        ''' Merge the actors' traces into one timeline at path
+            (see improv.trace)
+        '''
+        try:
+            trace.writeTimeline(path, self.traces)
+            logger.info('Wrote frame timeline to {}'.format(path))
+        except Exception as e:
+            logger.error('Cannot write frame timeline to {}: {}'.format(path, e))
+
     async def pollQueues(self):
         self.listing = [] #TODO: Remove or rewrite
         self.actorStates = dict.fromkeys(self.actors.keys())
@@ -388,36 +486,70 @@ class Nexus():
             to kill the process running the store (plasma server)
         '''
         logger.warning('Destroying Nexus')
+        if hasattr(self, 'metrics_stop'):
+            self.metrics_stop.set()
+        for m in self.metrics.values():
+            m.close()
+        for r in self.traces.values():
+            r.close()
         self._closeStore()
         logger.warning('Killed the central store')
 
     def _closeStore(self):
         ''' Internal method to kill the subprocess
             running the store (plasma sever)
+            Terminate first so the shared memory store can unlink its segments
         '''
         try:
-            self.p_Limbo.kill()
+            if getattr(self, 'p_proxy', None) is not None:
+                self.p_proxy.terminate()
+                self.p_proxy.wait(timeout=5)
+            self.p_Limbo.terminate()
+            try:
+                self.p_Limbo.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.p_Limbo.kill()
             logger.info('Store closed successfully')
         except Exception as e:
             logger.exception('Cannot close store {0}'.format(e))
 
-    def _startStore(self, size):
-        ''' Start a subprocess that runs the plasma store
-            Raises a RuntimeError exception size is undefined
-            Raises an Exception if the plasma store doesn't start
+    def _startStore(self, size, backend='plasma', store_loc='/tmp/store',
+                    spill_dir=None, high_water=0.9, proxy=None):
+        ''' Start a subprocess that runs the store
+            backend is 'plasma' (plasma_store) or 'shared_memory' (improv.shm_store)
+            spill_dir, high_water: shared_memory only; spill the least recently
+                used objects to files in spill_dir above high_water of size
+            proxy: 'host:port' to also serve the store on over TCP for
+                actors on other hosts (see improv.store_proxy); needs the
+                IMPROV_STORE_KEY environment variable
+            Raises a RuntimeError exception size or backend is undefined
+            Raises an Exception if the store doesn't start
         '''
         if size is None:
             raise RuntimeError('Server size needs to be specified')
+        if backend == 'plasma':
+            cmd = ['plasma_store', '-s', store_loc, '-m', str(size), '-e', 'hashtable://test']
+        elif backend == 'shared_memory':
+            cmd = [sys.executable, '-m', 'improv.shm_store', '-s', store_loc, '-m', str(size)]
+            if spill_dir is not None:
+                cmd += ['-d', spill_dir, '-w', str(high_water)]
+        else:
+            raise RuntimeError('Unknown store backend {}'.format(backend))
         try:
-            self.p_Limbo = subprocess.Popen(['plasma_store',
-                              '-s', '/tmp/store',
-                              '-m', str(size),
-                              '-e', 'hashtable://test'],
+            self.p_Limbo = subprocess.Popen(cmd,
                               stdout=subprocess.DEVNULL,
                               stderr=subprocess.DEVNULL)
             logger.info('Store started successfully')
         except Exception as e:
             logger.exception('Store cannot be started: {0}'.format(e))
+        self.p_proxy = None
+        if proxy is not None:
+            store_proxy.authKey()  # refuse to serve without a key
+            self.p_proxy = subprocess.Popen([sys.executable, '-m', 'improv.store_proxy',
+                                             '-s', store_loc, '-b', backend, '-a', str(proxy)],
+                                            stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.DEVNULL)
+            logger.info('Store proxy serving on {}'.format(proxy))
 
     async def stop_polling(self, signal, loop):
         ''' TODO: update asyncio library calls
@@ -436,24 +568,25 @@ class Nexus():
         logging.info('Shutdown complete.')
 
 
-def Link(name, start, end):
+def Link(name, start, end, maxsize=0, policy='block', capacity=DEFAULT_CAPACITY):
     ''' Abstract constructor for a queue that Nexus uses for
     inter-process/actor signaling and information passing
 
     A Link has an internal queue that can be synchronous (put, get)
-    as inherited from multiprocessing.Manager.Queue
-    or asynchronous (put_async, get_async) using async executors
+    as a shared-memory ShmQueue of capacity bytes
+    or asynchronous (put_async, get_async) on the running event loop
+    Links reach the actors by forking, so create them before startNexus
+    maxsize, policy: messages the Link holds (0 for no limit) and what
+    a put does beyond that (see improv.shm_queue); put returns the
+    number of messages dropped and dropped() counts them
     '''
 
-    m = Manager()
-    q = AsyncQueue(m.Queue(maxsize=0), name, start, end)
+    q = AsyncQueue(ShmQueue(capacity, maxsize, policy), name, start, end)
     return q
 
 class AsyncQueue(object):
     def __init__(self,q, name, start, end):
         self.queue = q
-        self.real_executor = None
-        self.cancelled_join = False
 
         # Notate what this queue is and from where to where
         # is it passing information
@@ -469,20 +602,8 @@ class AsyncQueue(object):
     def getEnd(self):
         return self.end
 
-    @property
-    def _executor(self):
-        if not self.real_executor:
-            self.real_executor = ThreadPoolExecutor(max_workers=cpu_count())
-        return self.real_executor
-
-    def __getstate__(self):
-        self_dict = self.__dict__
-        self_dict['_real_executor'] = None
-        return self_dict
-
     def __getattr__(self, name):
-        if name in ['qsize', 'empty', 'full', 'put', 'put_nowait',
-                    'get', 'get_nowait', 'close']:
+        if name in ['qsize', 'empty', 'full', 'close', 'fileno', 'dropped']:
             return getattr(self.queue, name)
         else:
             raise AttributeError("'%s' object has no attribute '%s'" %
@@ -492,52 +613,77 @@ class AsyncQueue(object):
         #return str(self.__class__) + ": " + str(self.__dict__)
         return 'Link '+self.name #+' From: '+self.start+' To: '+self.end
 
+    # Frame messages are traced as they pass (see improv.trace)
+
+    def put(self, item, block=True, timeout=None):
+        return trace.put(self.queue, item, block, timeout)
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        item = self.queue.get(block, timeout)
+        trace.dequeued(item)
+        return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def get_batch(self, max_items, timeout=None):
+        items = self.queue.get_batch(max_items, timeout)
+        for item in items:
+            trace.dequeued(item)
+        return items
+
     async def put_async(self, item):
-        loop = asyncio.get_event_loop()
-        res = await loop.run_in_executor(self._executor, self.put, item)
-        return res
+        ''' Put without blocking the event loop, retrying while full
+        '''
+        delay = 1e-4
+        while True:
+            try:
+                return trace.put(self.queue, item, block=False)
+            except Full:
+                await asyncio.sleep(delay)
+                delay = min(2*delay, 0.01)
 
     async def get_async(self):
-        loop = asyncio.get_event_loop()
+        ''' Wait on the queue's fileno in the running event loop,
+            so any number of Links can be awaited without threads
+        '''
         self.status = 'pending'
         try:
-            self.result = await loop.run_in_executor(self._executor, self.get)
+            self.result = await getAsync(self.queue)
+            trace.dequeued(self.result)
             self.status = 'done'
             return self.result
         except Exception as e:
             logger.exception('Error in get_async: {}'.format(e))
             pass
 
-    def cancel_join_thread(self):
-        self._cancelled_join = True
-        self._queue.cancel_join_thread()
-
-    def join_thread(self):
-        self._queue.join_thread()
-        if self._real_executor and not self._cancelled_join:
-            self._real_executor.shutdown()
 
-
-def MultiLink(name, start, end):
+def MultiLink(name, start, end, maxsize=0, policy='block', capacity=DEFAULT_CAPACITY):
     ''' End is a list
 
         Return a MultiAsyncQueue as q (for producer) and list of AsyncQueues as q_out (for consumers)
+        All share one BroadcastQueue: the producer writes each item once
+        and each consumer reads it through its own cursor.
+        maxsize, policy: as for Link, against the slowest consumer;
+        'drop-oldest' lets a consumer that fell behind skip ahead
     '''
-    m = Manager()
-
+    log = BroadcastQueue(len(end), capacity, maxsize, policy)
     q_out = []
-    for endpoint in end:
-        q = AsyncQueue(m.Queue(maxsize=0), name, start, endpoint)
+    for i,endpoint in enumerate(end):
+        q = AsyncQueue(log.reader(i), name, start, endpoint)
         q_out.append(q)
 
-    q = MultiAsyncQueue(m.Queue(maxsize=0), q_out, name, start, end)
+    q = MultiAsyncQueue(log, q_out, name, start, end)
 
     return q, q_out
 
 class MultiAsyncQueue(AsyncQueue):
     ''' Extension of AsyncQueue created by Link to have multiple endpoints.
-        A single producer queue's 'put' is copied to multiple consumer's queues
-        q_in is the producer queue, q_out are the consumer queues
+        A single producer queue's 'put' is read by multiple consumers
+        q_in is the producer's BroadcastQueue, q_out are the consumer queues
 
         #TODO: test the async nature of this group of queues
     '''
@@ -545,9 +691,6 @@ class MultiAsyncQueue(AsyncQueue):
         self.queue = q_in
         self.output = q_out
 
-        self.real_executor = None
-        self.cancelled_join = False
-
         self.name = name
         self.start = start
         self.end = end[0] #somewhat arbitrary endpoint naming
@@ -559,28 +702,16 @@ class MultiAsyncQueue(AsyncQueue):
         return 'MultiLink '+self.name
 
     def __getattr__(self, name):
-        # Remove put and put_nowait and define behavior specifically
-        #TODO: remove get capability
-        if name in ['qsize', 'empty', 'full',
-                    'get', 'get_nowait', 'close']:
+        # The producer end only puts
+        if name in ['qsize', 'empty', 'full', 'close', 'dropped']:
             return getattr(self.queue, name)
         else:
             raise AttributeError("'%s' object has no attribute '%s'" %
                                     (self.__class__.__name__, name))
 
-    def put(self, item):
-        for q in self.output:
-            q.put(item)
-
-    def put_nowait(self, item):
-        for q in self.output:
-            q.put_nowait(item)
-
 
 
 if __name__ == '__main__':
-    # set_start_method('fork')
-
     if len(sys.argv)>1:
         print('File is ', sys.argv[1])
         #TODO: Standard error handling for files
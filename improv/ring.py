@@ -0,0 +1,150 @@
+''' Preallocated shared-memory ring of fixed-shape frame slots.
+
+    An acquirer writes each frame into the next slot instead of allocating
+    a new store object per frame. Consumers get a RingRef (ring, slot,
+    sequence number) in place of an object id; Limbo.getID resolves it to a
+    read-only view of the slot. Every slot records the sequence number of
+    the frame it holds, so a consumer can tell if its frame was overwritten
+    (overrun) before or while it was reading it; Limbo raises
+    FrameOverrunError in that case.
+'''
+import os
+import struct
+from collections import namedtuple
+from multiprocessing import shared_memory
+import numpy as np
+
+from improv.shm_store import _openSegment
+
+import logging; logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# capacity, ndim, head (next sequence number), dtype, shape (up to 8 dims)
+_HEADER = struct.Struct('<QQQ16s8Q')
+_HEADER_SIZE = 128
+_ALIGN = 64
+_EMPTY = -1
+
+RingRef = namedtuple('RingRef', ['name', 'slot', 'seq'])
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class FrameRing():
+    ''' Fixed-capacity ring of frames with a single shape and dtype.
+        Use FrameRing.create in the producer and FrameRing.attach
+        (through Limbo.getID) in consumers.
+    '''
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.name = shm.name
+        self.owner = owner
+        capacity, ndim, _, dtype, *shape = _HEADER.unpack_from(shm.buf, 0)
+        self.capacity = capacity
+        self.shape = tuple(shape[:ndim])
+        self.dtype = np.dtype(dtype.rstrip(b'\0').decode())
+        self.slot_size = _align(int(np.prod(self.shape))*self.dtype.itemsize)
+        self.seqs = np.ndarray((capacity,), dtype=np.int64, buffer=shm.buf, offset=_HEADER_SIZE)
+        slots_offset = _align(_HEADER_SIZE + 8*capacity)
+        self.slots = [np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf,
+                                 offset=slots_offset + i*self.slot_size) for i in range(capacity)]
+        self.head = self._readHead()
+
+    @staticmethod
+    def create(shape, dtype, capacity):
+        ''' Allocate a new ring. The creating process owns the segment;
+            it is unlinked on close(), or by the resource tracker if the
+            process dies without closing it.
+        '''
+        dtype = np.dtype(dtype)
+        shape = tuple(int(s) for s in shape)
+        if len(shape) > 8:
+            raise ValueError('Frames may have at most 8 dimensions')
+        slot_size = _align(int(np.prod(shape))*dtype.itemsize)
+        size = _align(_HEADER_SIZE + 8*capacity) + capacity*slot_size
+        shm = shared_memory.SharedMemory('ir' + os.urandom(8).hex(), create=True, size=size)
+        _HEADER.pack_into(shm.buf, 0, capacity, len(shape), 0, dtype.str.encode(),
+                          *(shape + (0,)*(8-len(shape))))
+        ring = FrameRing(shm, owner=True)
+        ring.seqs[:] = _EMPTY
+        return ring
+
+    @staticmethod
+    def attach(name):
+        return FrameRing(_openSegment(name))
+
+    def descriptor(self):
+        ''' Small description of the ring to register with the store
+        '''
+        return {'name': self.name, 'shape': self.shape,
+                'dtype': self.dtype.str, 'capacity': self.capacity}
+
+    def put(self, frame):
+        ''' Copy frame into the next slot. Returns its RingRef.
+            Single producer only.
+        '''
+        seq = self.head
+        slot = seq % self.capacity
+        self.seqs[slot] = _EMPTY  # mark in progress for readers of the old frame
+        self.slots[slot][...] = frame
+        self.seqs[slot] = seq
+        self.head = seq + 1
+        self._writeHead(self.head)
+        return RingRef(self.name, slot, seq)
+
+    def get(self, ref):
+        ''' Read-only view of the frame for ref,
+            or None if the slot no longer holds it.
+            The view is overwritten in place when the ring wraps around;
+            call valid(ref) after using it, or copy it first.
+        '''
+        if not self.valid(ref):
+            return None
+        view = self.slots[ref.slot].view()
+        view.flags.writeable = False
+        return view
+
+    def copy(self, ref):
+        ''' Copy of the frame for ref, validated after copying.
+            None if the frame was overwritten before or during the copy.
+        '''
+        if not self.valid(ref):
+            return None
+        frame = self.slots[ref.slot].copy()
+        return frame if self.valid(ref) else None
+
+    def valid(self, ref):
+        ''' Whether the slot of ref still holds frame ref.seq
+        '''
+        return self.seqs[ref.slot] == ref.seq
+
+    def latest(self):
+        ''' RingRef of the most recently written frame, or None
+        '''
+        head = self._readHead()
+        if head == 0:
+            return None
+        return RingRef(self.name, (head-1) % self.capacity, head-1)
+
+    def close(self):
+        ''' Release this process' mapping; the owner also unlinks the ring
+        '''
+        self.seqs = None
+        self.slots = []
+        try:
+            self.shm.close()
+        except BufferError:
+            # Views are still exported; unmap with the last of them
+            self.shm._mmap = None
+            self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def _readHead(self):
+        return struct.unpack_from('<Q', self.shm.buf, 16)[0]
+
+    def _writeHead(self, head):
+        struct.pack_into('<Q', self.shm.buf, 16, head)
+
@@ -0,0 +1,71 @@
+''' Columnar table of ROI (component) contours.
+
+    Replaces the list of dicts from caiman's get_contours
+    ({'neuron_id', 'CoM', 'coordinates'} per component) with a few flat
+    arrays, so a table goes into the store as raw buffers (zero-copy with
+    the shared memory store) instead of as pickled Python objects.
+
+    Processors put a new table only when components change, each with a
+    higher version, and send its object id with every frame; consumers
+    fetch the table again only when that id changes.
+'''
+import numpy as np
+
+
+class ROITable():
+    ''' ROI contours and centers of mass, as arrays:
+        ids: component ids (caiman neuron_id, 1-based), shape (n,)
+        com: centers of mass, shape (n, 2)
+        vertices: all contour vertices concatenated, shape (m, 2);
+            NaN rows separate the pieces of a contour, as in caiman
+        offsets: contour i is vertices[offsets[i]:offsets[i+1]], shape (n+1,)
+        version: increases every time the processor updates the table
+    '''
+    __slots__ = ('ids', 'com', 'vertices', 'offsets', 'version')
+
+    def __init__(self, ids, com, vertices, offsets, version=0):
+        self.ids = ids
+        self.com = com
+        self.vertices = vertices
+        self.offsets = offsets
+        self.version = version
+
+    @staticmethod
+    def fromContours(contours, version=0):
+        ''' Build a table from the output of caiman's get_contours
+        '''
+        n = len(contours)
+        coords = [np.asarray(c['coordinates'], dtype=np.float64).reshape(-1, 2) for c in contours]
+        offsets = np.zeros(n+1, dtype=np.int64)
+        np.cumsum([len(c) for c in coords], out=offsets[1:])
+        vertices = np.concatenate(coords) if n else np.empty((0, 2))
+        ids = np.array([c['neuron_id'] for c in contours], dtype=np.int64)
+        com = np.array([c['CoM'] for c in contours], dtype=np.float64).reshape(n, 2)
+        return ROITable(ids, com, vertices, offsets, version)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __reduce__(self):
+        # Arrays pickle out-of-band, so the store keeps them as raw buffers
+        return (ROITable, (self.ids, self.com, self.vertices, self.offsets, self.version))
+
+    def contour(self, i):
+        ''' Vertices of contour i, a view into vertices
+        '''
+        return self.vertices[self.offsets[i]:self.offsets[i+1]]
+
+    def contours(self):
+        ''' All contours, as views into vertices
+        '''
+        return [self.contour(i) for i in range(len(self))]
+
+    def toContours(self):
+        ''' The table as caiman's get_contours list of dicts
+        '''
+        return [{'neuron_id': int(self.ids[i]), 'CoM': self.com[i], 'coordinates': self.contour(i)}
+                for i in range(len(self))]
+
+    def __repr__(self):
+        return 'ROITable({} ROIs, {} vertices, version {})'.format(
+            len(self), len(self.vertices), self.version)
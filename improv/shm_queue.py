@@ -0,0 +1,620 @@
+''' Shared-memory message queue behind nexus.Link.
+
+    Replaces a multiprocessing.Manager queue (a server process per Link,
+    with every put and get a round trip through it) with a byte ring in
+    an anonymous shared mapping. put pickles the item straight into the
+    ring and get unpickles it from there, so a message costs one pickle,
+    one copy and, to wake a blocked reader, one eventfd write.
+
+    Records are an 8-byte length followed by the pickle, 8-byte aligned;
+    a FrameMessage (improv.message) is packed in place of a pickle and
+    flagged in the length word.
+    a record that does not fit before the end of the ring is preceded by
+    a wrap marker and written at the start. Head and tail are byte counts
+    that only grow. Producers serialize on one lock and consumers on
+    another, so any number of each may share a queue, although Links
+    normally have one of each.
+
+    The mapping, the eventfd and the locks are inherited by forked
+    processes, which is how Nexus hands Links to its actors; a queue
+    cannot be pickled or opened by name.
+
+    fileno() is readable once an item has been put since get_nowait()
+    last raised Empty, so an event loop can wait on a queue directly
+    (see getAsync).
+
+    A queue holds at most capacity bytes and, if maxsize is set, maxsize
+    items. policy sets what a put does when it is full:
+        'block': wait for the reader (put_nowait raises queue.Full)
+        'drop-oldest': discard the oldest items to make room
+        'drop-newest': discard the item being put
+        'latest-only': keep only the newest item (maxsize 1, drop-oldest)
+    put returns the number of items it dropped, so the producer knows,
+    and dropped() counts them over the life of the queue.
+'''
+import os
+import time
+import mmap
+import pickle
+import select
+import struct
+import asyncio
+import multiprocessing
+from queue import Empty, Full
+
+from improv.message import FrameMessage
+
+import logging; logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_CAPACITY = 1 << 20  # bytes of messages in flight per queue
+POLICIES = ('block', 'drop-oldest', 'drop-newest', 'latest-only')
+_HEADER_SIZE = 64
+# Header words: tail (bytes written), head (bytes read), puts, gets, items dropped
+_TAIL, _HEAD, _PUTS, _GETS, _DROPPED = 0, 1, 2, 3, 4
+_LENGTH = struct.Struct('<q')
+# BroadcastQueue: floor (oldest intact byte) in place of head, then per reader:
+# cursor (next byte to read), next sequence number, items skipped
+_FLOOR = 5
+_READER_WORDS = 4
+_CURSOR, _NEXT_SEQ, _SKIPPED = 0, 1, 2
+_RECORD = struct.Struct('<qq')  # length, sequence number; records are 16-byte aligned
+_BINARY = 1 << 32  # length word flag: a packed FrameMessage, not a pickle
+_SIZE_MASK = _BINARY - 1
+_WRAP = -1
+
+
+def _padded(n, align=8):
+    return (n + align - 1) & -align
+
+
+def _encode(item):
+    ''' (payload, length word) for an item: a FrameMessage to pack in
+        place, else the item's pickle
+    '''
+    if type(item) is FrameMessage:
+        try:
+            return item, item.nbytes() | _BINARY
+        except ValueError:
+            pass
+    payload = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+    return payload, len(payload)
+
+
+def _store(buf, start, payload):
+    if type(payload) is FrameMessage:
+        payload.packInto(buf, start)
+    else:
+        buf[start:start+len(payload)] = payload
+
+
+def _load(buf, start, word):
+    if word & _BINARY:
+        return FrameMessage.unpackFrom(buf, start)
+    return pickle.loads(buf[start:start+word])
+
+
+def _checkPolicy(policy, maxsize):
+    ''' Validated policy and maxsize
+    '''
+    if policy not in POLICIES:
+        raise ValueError('Unknown queue policy {}; use one of {}'.format(policy, ', '.join(POLICIES)))
+    if maxsize < 0:
+        raise ValueError('maxsize must be 0 (no limit) or more')
+    return policy, (1 if policy == 'latest-only' else maxsize)
+
+
+class _Doorbell():
+    ''' Wakes a reader blocked on fileno(): an eventfd on Linux,
+        a pipe elsewhere. ring() may be called any number of times
+        before clear()
+    '''
+    def __init__(self):
+        if hasattr(os, 'eventfd'):
+            self.rfd = self.wfd = os.eventfd(0, os.EFD_NONBLOCK)
+            self.token = (1).to_bytes(8, 'little')
+        else:
+            self.rfd, self.wfd = os.pipe()
+            os.set_blocking(self.rfd, False)
+            os.set_blocking(self.wfd, False)
+            self.token = b'\0'
+
+    def fileno(self):
+        return self.rfd
+
+    def ring(self):
+        try:
+            os.write(self.wfd, self.token)
+        except BlockingIOError:
+            pass  # already rung
+
+    def clear(self):
+        try:
+            os.read(self.rfd, 4096)
+        except BlockingIOError:
+            pass
+
+    def wait(self, timeout=None):
+        ''' Block until rung or timeout (seconds) passes
+        '''
+        return bool(select.select([self.rfd], [], [], timeout)[0])
+
+    def close(self):
+        os.close(self.rfd)
+        if self.wfd != self.rfd:
+            os.close(self.wfd)
+
+
+class ShmQueue():
+    ''' Queue with the put/get interface of queue.Queue over a
+        capacity-byte ring in shared memory, holding up to maxsize
+        items (0 for no limit); policy is one of POLICIES.
+        A single item may take up to half the capacity pickled
+    '''
+    def __init__(self, capacity=DEFAULT_CAPACITY, maxsize=0, policy='block'):
+        self.policy, self.maxsize = _checkPolicy(policy, maxsize)
+        self.capacity = _padded(capacity)
+        self.mm = mmap.mmap(-1, _HEADER_SIZE + self.capacity)
+        self.counters = memoryview(self.mm)[:_HEADER_SIZE].cast('q')
+        self.data = memoryview(self.mm)[_HEADER_SIZE:]
+        self.doorbell = _Doorbell()
+        self.put_lock = multiprocessing.Lock()
+        self.get_lock = multiprocessing.Lock()
+
+    def __reduce__(self):
+        raise TypeError('ShmQueue is shared by forking, not pickling')
+
+    def fileno(self):
+        ''' Readable when items may have been put since get_nowait
+            last raised Empty
+        '''
+        return self.doorbell.fileno()
+
+    def qsize(self):
+        return self.counters[_PUTS] - self.counters[_GETS]
+
+    def empty(self):
+        return self.counters[_TAIL] == self.counters[_HEAD]
+
+    def full(self):
+        return self._room(_LENGTH.size + 8) is None
+
+    def dropped(self):
+        ''' Items dropped by the policy so far
+        '''
+        return self.counters[_DROPPED]
+
+    def put(self, item, block=True, timeout=None):
+        ''' Put item; when full, act on the policy. With 'block', wait
+            up to timeout seconds (forever if None) if block, else raise
+            queue.Full. Returns the number of items dropped
+        '''
+        record = _encode(item)
+        length = record[1] & _SIZE_MASK
+        size = _LENGTH.size + _padded(length)
+        if size > self.capacity // 2:
+            raise ValueError('Item of {} bytes does not fit in a queue of {} bytes; '
+                             'put it in the store and send its id'.format(length, self.capacity))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 1e-6
+        while True:
+            with self.put_lock:
+                dropped = self._put(record, size)
+            if dropped is not None:
+                break
+            if not block or (deadline is not None and time.monotonic() >= deadline):
+                raise Full
+            # Full queues are rare; back off instead of signalling space
+            time.sleep(delay)
+            delay = min(2*delay, 1e-3)
+        if not (dropped and self.policy == 'drop-newest'):  # else nothing was written
+            self.doorbell.ring()
+        return dropped
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        ''' Remove and return the next item, waiting up to timeout
+            seconds (forever if None) if block. Raises queue.Empty
+        '''
+        return _get(self, self.get_lock, block, timeout)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def get_batch(self, max_items, timeout=None):
+        ''' Up to max_items items in one call, waiting up to timeout
+            seconds (forever if None) for the first. Returns a list,
+            empty if nothing came
+        '''
+        return _getBatch(self, self.get_lock, max_items, timeout)
+
+    def close(self):
+        ''' Release this process's handles on the queue
+        '''
+        self.doorbell.close()
+
+    def _put(self, record, size):
+        ''' Write the record or apply the policy. Returns the number
+            of items dropped, or None if the put must wait
+        '''
+        skip = self._room(size)
+        if skip is not None:
+            self._write(record, size, skip)
+            return 0
+        if self.policy == 'block':
+            return None
+        if self.policy == 'drop-newest':
+            self.counters[_DROPPED] += 1
+            return 1
+        dropped = 0
+        with self.get_lock:
+            while skip is None:
+                self._discard()
+                dropped += 1
+                skip = self._room(size)
+            self.counters[_DROPPED] += dropped
+        self._write(record, size, skip)
+        return dropped
+
+    def _room(self, size):
+        ''' Bytes to skip to the start of the ring before writing a
+            record of size, or None if the queue is too full for it
+        '''
+        c = self.counters
+        tail = c[_TAIL]
+        if self.maxsize and c[_PUTS] - c[_GETS] >= self.maxsize:
+            return None
+        pos = tail % self.capacity
+        skip = self.capacity - pos if self.capacity - pos < size else 0
+        if skip + size > self.capacity - (tail - c[_HEAD]):
+            return None
+        return skip
+
+    def _write(self, record, size, skip):
+        c = self.counters
+        tail = c[_TAIL]
+        pos = tail % self.capacity
+        if skip:
+            _LENGTH.pack_into(self.data, pos, _WRAP)
+            pos = 0
+        _LENGTH.pack_into(self.data, pos, record[1])
+        _store(self.data, pos + _LENGTH.size, record[0])
+        c[_PUTS] += 1
+        # Publish the record last
+        c[_TAIL] = tail + skip + size
+
+    def _discard(self):
+        ''' Drop the oldest item, holding get_lock
+        '''
+        c = self.counters
+        head = c[_HEAD]
+        pos = head % self.capacity
+        length = _LENGTH.unpack_from(self.data, pos)[0]
+        if length == _WRAP:
+            head += self.capacity - pos
+            length = _LENGTH.unpack_from(self.data, 0)[0]
+        c[_GETS] += 1
+        c[_HEAD] = head + _LENGTH.size + _padded(length & _SIZE_MASK)
+
+    def _read(self):
+        c = self.counters
+        head = c[_HEAD]
+        if head == c[_TAIL]:
+            return False, None
+        pos = head % self.capacity
+        length = _LENGTH.unpack_from(self.data, pos)[0]
+        if length == _WRAP:
+            head += self.capacity - pos
+            pos = 0
+            length = _LENGTH.unpack_from(self.data, 0)[0]
+        item = _load(self.data, pos + _LENGTH.size, length)
+        c[_GETS] += 1
+        c[_HEAD] = head + _LENGTH.size + _padded(length & _SIZE_MASK)
+        return True, item
+
+
+def _get(q, lock, block, timeout):
+    ''' get for ShmQueue and BroadcastReader. The doorbell, rung after
+        every put, is cleared only on finding the queue empty, and rung
+        again if an item turns up after that: fileno() stays readable
+        while any item is left
+    '''
+    deadline = None if timeout is None else time.monotonic() + timeout
+    cleared = False
+    while True:
+        with lock:
+            found, item = q._read()
+        if found:
+            if cleared:
+                q.doorbell.ring()  # more may have been put before the clear
+            return item
+        if q.doorbell.wait(0):
+            q.doorbell.clear()
+            cleared = True
+            continue
+        if not block:
+            raise Empty
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Empty
+        q.doorbell.wait(remaining)
+
+
+def _getBatch(q, lock, max_items, timeout):
+    try:
+        items = [q.get(timeout=timeout)]
+    except Empty:
+        return []
+    with lock:
+        while len(items) < max_items:
+            found, item = q._read()
+            if not found:
+                break
+            items.append(item)
+    return items
+
+
+async def getAsync(q):
+    ''' Get from a ShmQueue or BroadcastReader in the running event
+        loop, waiting on its fileno rather than on a thread
+    '''
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            return q.get_nowait()
+        except Empty:
+            pass
+        ready = loop.create_future()
+        loop.add_reader(q.fileno(), lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_reader(q.fileno())
+
+
+class BroadcastQueue():
+    ''' One producer, a fixed number of readers: each item is pickled
+        and written once into a shared log of capacity bytes, and every
+        reader (see reader()) gets every item through its own cursor.
+        The log is full when the slowest reader is capacity bytes or
+        maxsize items behind; policy then acts as for ShmQueue, except
+        that with 'drop-oldest' and 'latest-only' the oldest items are
+        overwritten, and a reader that falls behind them skips ahead,
+        counting the items it missed
+    '''
+    def __init__(self, readers, capacity=DEFAULT_CAPACITY, maxsize=0, policy='block'):
+        self.policy, self.maxsize = _checkPolicy(policy, maxsize)
+        self.overwrite = self.policy in ('drop-oldest', 'latest-only')
+        self.readers = readers
+        self.capacity = _padded(capacity, 16)
+        header = _padded(_HEADER_SIZE + 8*_READER_WORDS*readers)
+        self.mm = mmap.mmap(-1, header + self.capacity)
+        self.counters = memoryview(self.mm)[:header].cast('q')
+        self.data = memoryview(self.mm)[header:]
+        self.doorbells = [_Doorbell() for _ in range(readers)]
+        self.get_locks = [multiprocessing.Lock() for _ in range(readers)]
+        self.put_lock = multiprocessing.Lock()
+
+    def __reduce__(self):
+        raise TypeError('BroadcastQueue is shared by forking, not pickling')
+
+    def reader(self, i):
+        ''' Read end for reader i, with the get interface of ShmQueue
+        '''
+        return BroadcastReader(self, i)
+
+    def qsize(self):
+        ''' Items the slowest reader has yet to get
+        '''
+        return max(self.reader(i).qsize() for i in range(self.readers))
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        c = self.counters
+        return not self.overwrite and not self._fits(c[_TAIL], _RECORD.size + 16)
+
+    def dropped(self):
+        ''' Items dropped by the policy before every reader got them;
+            may include items a reader was reading as they were dropped
+        '''
+        return self.counters[_DROPPED]
+
+    def put(self, item, block=True, timeout=None):
+        ''' Write item once for all readers; when full, act on the
+            policy. With 'block', wait up to timeout seconds (forever if
+            None) for the slowest reader if block, else raise queue.Full.
+            Returns the number of items dropped
+        '''
+        record = _encode(item)
+        length = record[1] & _SIZE_MASK
+        size = _RECORD.size + _padded(length, 16)
+        if size > self.capacity // 2:
+            raise ValueError('Item of {} bytes does not fit in a queue of {} bytes; '
+                             'put it in the store and send its id'.format(length, self.capacity))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 1e-6
+        while True:
+            with self.put_lock:
+                dropped = self._write(record, size)
+                if dropped is None and self.policy == 'drop-newest':
+                    self.counters[_DROPPED] += 1
+                    return 1
+            if dropped is not None:
+                break
+            if not block or (deadline is not None and time.monotonic() >= deadline):
+                raise Full
+            time.sleep(delay)
+            delay = min(2*delay, 1e-3)
+        for d in self.doorbells:
+            d.ring()
+        return dropped
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def close(self):
+        for d in self.doorbells:
+            d.close()
+
+    def _unread(self):
+        ''' Sequence number of the oldest item some reader has yet to get
+        '''
+        c = self.counters
+        return min(c[_readerWord(i, _NEXT_SEQ)] for i in range(self.readers))
+
+    def _fits(self, tail, needed):
+        ''' Whether needed bytes fit behind the slowest reader
+        '''
+        c = self.counters
+        if self.maxsize and c[_PUTS] - self._unread() >= self.maxsize:
+            return False
+        oldest = min(c[_readerWord(i, _CURSOR)] for i in range(self.readers))
+        return self.capacity - (tail - oldest) >= needed
+
+    def _write(self, record, size):
+        ''' Write the record, overwriting old ones if the policy allows.
+            Returns the number of unread items overwritten, or None if
+            the record does not fit
+        '''
+        c = self.counters
+        tail = c[_TAIL]
+        pos = tail % self.capacity
+        skip = self.capacity - pos if self.capacity - pos < size else 0
+        dropped = 0
+        if self.overwrite:
+            floor = c[_FLOOR]
+            unread = self._unread()
+            while floor < tail and (self.capacity - (tail - floor) < skip + size or
+                                    (self.maxsize and c[_PUTS] - self._seqAt(floor) >= self.maxsize)):
+                length, seq = _RECORD.unpack_from(self.data, floor % self.capacity)
+                if length != _WRAP and seq >= unread:
+                    dropped += 1
+                floor = self._nextRecord(floor)
+            # Move the floor before overwriting, so readers can tell
+            c[_FLOOR] = floor
+            c[_DROPPED] += dropped
+        elif not self._fits(tail, skip + size):
+            return None
+        if skip:
+            # Carries the next sequence number, as the record after it
+            _RECORD.pack_into(self.data, pos, _WRAP, c[_PUTS])
+            pos = 0
+        _RECORD.pack_into(self.data, pos, record[1], c[_PUTS])
+        _store(self.data, pos + _RECORD.size, record[0])
+        c[_PUTS] += 1
+        c[_TAIL] = tail + skip + size
+        return dropped
+
+    def _seqAt(self, at):
+        return _RECORD.unpack_from(self.data, at % self.capacity)[1]
+
+    def _nextRecord(self, at):
+        pos = at % self.capacity
+        length = _RECORD.unpack_from(self.data, pos)[0]
+        if length == _WRAP:
+            return at + self.capacity - pos
+        return at + _RECORD.size + _padded(length & _SIZE_MASK, 16)
+
+
+class BroadcastReader():
+    ''' Read end of a BroadcastQueue for one reader
+    '''
+    def __init__(self, log, index):
+        self.log = log
+        self.index = index
+        self.doorbell = log.doorbells[index]
+        self.lock = log.get_locks[index]
+        self.cursor = _readerWord(index, _CURSOR)
+        self.next_seq = _readerWord(index, _NEXT_SEQ)
+        self.skipped = _readerWord(index, _SKIPPED)
+
+    def __reduce__(self):
+        raise TypeError('BroadcastReader is shared by forking, not pickling')
+
+    def fileno(self):
+        return self.doorbell.fileno()
+
+    def qsize(self):
+        ''' Items put since the last get, including any overwritten
+        '''
+        c = self.log.counters
+        return c[_PUTS] - c[self.next_seq]
+
+    def empty(self):
+        c = self.log.counters
+        return c[self.cursor] == c[_TAIL]
+
+    def full(self):
+        return self.log.full()
+
+    def dropped(self):
+        ''' Items this reader skipped because it fell behind
+            (BroadcastQueue.dropped counts them for all readers)
+        '''
+        return self.log.counters[self.skipped]
+
+    def get(self, block=True, timeout=None):
+        ''' Next item for this reader, waiting up to timeout seconds
+            (forever if None) if block. Raises queue.Empty
+        '''
+        return _get(self, self.lock, block, timeout)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def get_batch(self, max_items, timeout=None):
+        ''' As ShmQueue.get_batch
+        '''
+        return _getBatch(self, self.lock, max_items, timeout)
+
+    def put(self, item, block=True, timeout=None):
+        raise NotImplementedError('Only the producer end of a broadcast can put')
+
+    put_nowait = put
+
+    def close(self):
+        self.doorbell.close()
+
+    def _read(self):
+        log = self.log
+        c = log.counters
+        skip = log.overwrite
+        while True:
+            at = c[self.cursor]
+            if at == c[_TAIL]:
+                return False, None
+            if skip and at < c[_FLOOR]:
+                c[self.cursor] = c[_FLOOR]
+                continue
+            pos = at % log.capacity
+            word, seq = _RECORD.unpack_from(log.data, pos)
+            length = word & _SIZE_MASK
+            start = pos + _RECORD.size
+            if skip:
+                # The producer may overwrite the record as we read it;
+                # use it only if the floor has not passed it by then
+                buf = bytes(log.data[start:start+length]) if 0 <= length <= log.capacity - start else b''
+                if c[_FLOOR] > at:
+                    continue
+                start = 0
+            else:
+                buf = log.data
+            if word == _WRAP:
+                c[self.cursor] = at + log.capacity - pos
+                continue
+            item = _load(buf, start, word)
+            if seq > c[self.next_seq]:
+                c[self.skipped] += seq - c[self.next_seq]
+            c[self.next_seq] = seq + 1
+            c[self.cursor] = at + _RECORD.size + _padded(length, 16)
+            return True, item
+
+
+def _readerWord(index, word):
+    return _HEADER_SIZE//8 + index*_READER_WORDS + word
@@ -0,0 +1,802 @@
+''' Shared-memory object store used in place of the Plasma server.
+
+    Each object lives in its own multiprocessing.shared_memory segment,
+    written by the putting process. A small index process (SharedMemoryServer)
+    keeps track of sealed objects and the bytes allocated against the
+    store capacity, and hands segment names to readers.
+    SharedMemoryClient mirrors the parts of the PlasmaClient API that Limbo
+    uses, so Limbo logic is shared between both backends.
+
+    With a spill directory, the least recently used objects are moved to
+    files there (named by object id) once usage passes a high-water mark,
+    and clients memory-map them on get, so a full store slows down
+    instead of refusing puts.
+
+    Every sealed object gets the next sequence number, so a client can
+    ask for the objects sealed after the last one it handled
+    (SharedMemoryClient.sealed_since) instead of diffing listings.
+
+    Clients can subscribe to name prefixes (SharedMemoryClient.subscribe)
+    and block on, select on or asynchronously iterate over the objects
+    sealed under them, instead of polling.
+
+    Run as a store process with:
+        $ python -m improv.shm_store -s /tmp/store -m 40000000000 [-d /spill/dir -w 0.9]
+'''
+import os
+import sys
+import mmap
+import time
+import queue
+import pickle
+import signal
+import struct
+import argparse
+import asyncio
+import threading
+from collections import OrderedDict, namedtuple
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.connection import Listener, Client
+
+import logging; logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Segment layout: header, buffer table, pickle stream, out-of-band buffers
+_HEADER = struct.Struct('<II')  # pickle length, number of buffers
+_BUFFER = struct.Struct('<QQ')  # offset, length
+_ALIGN = 64
+
+# Pushed to subscribers for every matching sealed object. name and frame
+# are as given to Limbo.put; frame is None for objects put without one
+Notification = namedtuple('Notification', ['name', 'frame', 'object_id'])
+
+
+class ObjectID():
+    ''' 20-byte object identifier, compatible with plasma.ObjectID usage
+    '''
+    __slots__ = ('_binary',)
+
+    def __init__(self, binary):
+        if len(binary) != 20:
+            raise ValueError('ObjectID must be 20 bytes, got {}'.format(len(binary)))
+        self._binary = bytes(binary)
+
+    @staticmethod
+    def from_random():
+        return ObjectID(os.urandom(20))
+
+    def binary(self):
+        return self._binary
+
+    def __eq__(self, other):
+        return isinstance(other, ObjectID) and self._binary == other._binary
+
+    def __hash__(self):
+        return hash(self._binary)
+
+    def __reduce__(self):
+        return (ObjectID, (self._binary,))
+
+    def __repr__(self):
+        return 'ObjectID(' + self._binary.hex() + ')'
+
+
+class ObjectNotAvailable():
+    ''' Sentinel returned by get for objects not (yet) in the store
+    '''
+    pass
+
+
+class ObjectExistsError(Exception):
+    ''' Raised when sealing an object ID that is already in the store
+    '''
+    pass
+
+
+class StoreFullError(Exception):
+    ''' Raised when an object does not fit in the remaining store capacity
+    '''
+    pass
+
+
+def _segmentName(object_id):
+    # Kept short: macOS limits shared memory names to 31 characters
+    return 'imp' + object_id.binary()[:12].hex()
+
+
+def _openSegment(name, create=False, size=0):
+    ''' Open a segment without handing it to this process' resource
+        tracker, which would otherwise unlink it when the process exits.
+        The store process owns segment lifetime.
+    '''
+    try:
+        return shared_memory.SharedMemory(name, create=create, size=size, track=False)
+    except TypeError:  # Python < 3.13
+        shm = shared_memory.SharedMemory(name, create=create, size=size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _unlinkSegment(name):
+    ''' Remove a segment by name. Attaching through the regular
+        constructor keeps resource tracker registrations balanced.
+    '''
+    try:
+        shm = shared_memory.SharedMemory(name)
+    except FileNotFoundError:
+        return
+    shm.unlink()
+    shm.close()
+
+
+def _removeFile(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class _SpillFile():
+    ''' Read-only mapping of a spilled object, used like a segment
+    '''
+    def __init__(self, path):
+        self.name = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buf = memoryview(self._mmap)
+
+    def close(self):
+        try:
+            self.buf.release()
+            self._mmap.close()
+        except BufferError:
+            pass  # views are still exported; unmapped with the last of them
+        self.buf = None
+        self._mmap = None
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def serialize(value):
+    ''' Pickle value with protocol 5, keeping contiguous buffers
+        (e.g. numpy arrays) out-of-band so they are copied exactly once.
+        Returns the pickle stream, raw buffers and total segment size.
+    '''
+    buffers = []
+    stream = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+    raws = [b.raw() for b in buffers]
+    end = _HEADER.size + _BUFFER.size*len(raws) + len(stream)
+    table = []
+    for raw in raws:
+        table.append((_align(end), raw.nbytes))
+        end = _align(end) + raw.nbytes
+    return stream, raws, table, max(end, 1)
+
+
+def writeSegment(buf, stream, raws, table):
+    ''' Lay out a serialized value into a writable buffer
+    '''
+    _HEADER.pack_into(buf, 0, len(stream), len(raws))
+    pos = _HEADER.size
+    for entry in table:
+        _BUFFER.pack_into(buf, pos, *entry)
+        pos += _BUFFER.size
+    buf[pos:pos+len(stream)] = stream
+    for (offset, length), raw in zip(table, raws):
+        buf[offset:offset+length] = raw
+
+
+def readSegment(buf, writeable=False):
+    ''' Rebuild a value from a segment buffer.
+        Out-of-band buffers are passed as read-only views, so numpy
+        arrays come back zero-copy and non-writeable, unless writeable
+        (buf must be a writable memoryview then).
+    '''
+    view = buf if writeable else buf.toreadonly()
+    stream_len, nbuf = _HEADER.unpack_from(view, 0)
+    pos = _HEADER.size
+    buffers = []
+    for _ in range(nbuf):
+        offset, length = _BUFFER.unpack_from(view, pos)
+        buffers.append(view[offset:offset+length])
+        pos += _BUFFER.size
+    return pickle.loads(view[pos:pos+stream_len], buffers=buffers)
+
+
+def segmentSize(buf):
+    ''' Bytes used by the value in a segment buffer, which may be
+        longer (segments are rounded up to pages)
+    '''
+    stream_len, nbuf = _HEADER.unpack_from(buf, 0)
+    end = _HEADER.size + _BUFFER.size*nbuf + stream_len
+    for k in range(nbuf):
+        offset, length = _BUFFER.unpack_from(buf, _HEADER.size + k*_BUFFER.size)
+        end = max(end, offset + length)
+    return end
+
+
+class SharedMemoryServer():
+    ''' Index and allocator process for the shared-memory store.
+        Tracks sealed objects (id -> segment name, size) against a fixed
+        capacity and unlinks segments on delete and at shutdown.
+        One thread per connected client.
+        spill_dir: if set, a spill thread moves least recently used
+            objects to files in spill_dir when more than high_water
+            (fraction of capacity) is in use, down to 90% of that
+        log_size: sequence numbers remembered for sealed_since
+    '''
+    def __init__(self, store_loc='/tmp/store', size=40000000000,
+                 spill_dir=None, high_water=0.9, log_size=1000000):
+        self.store_loc = store_loc
+        self.capacity = int(size)
+        self.used = 0
+        self.index = {}
+        self.cond = threading.Condition()
+        self.subscribers = []
+        self.seq = 0  # sequence number of the last sealed object
+        self.log = []  # ids sealed with sequence numbers log_start..seq
+        self.log_start = 1
+        self.log_size = log_size
+        self.names = {}  # id: (name, frame) given at seal, if named
+        self.access = {}  # id: last seal or lookup time, for LRU spilling
+        self.spill_dir = spill_dir
+        self.spilled = {}  # id: (file path, size)
+        self.spilling = set()
+        self.high_water = int(self.capacity*high_water)
+        self.low_water = int(self.high_water*0.9)
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+            threading.Thread(target=self._spiller, daemon=True).start()
+
+    def serve(self):
+        ''' Accept client connections until terminated
+        '''
+        if os.path.exists(self.store_loc):
+            os.unlink(self.store_loc)
+        listener = Listener(self.store_loc, 'AF_UNIX')
+        logger.info('Shared memory store listening on {}'.format(self.store_loc))
+        try:
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=self._serveClient, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+            self.shutdown()
+
+    def shutdown(self):
+        ''' Unlink every segment still in the store
+        '''
+        with self.cond:
+            for segment, _ in self.index.values():
+                _unlinkSegment(segment)
+            for path, _ in self.spilled.values():
+                _removeFile(path)
+            self.index = {}
+            self.spilled = {}
+            self.names = {}
+            self.used = 0
+
+    def _serveClient(self, conn):
+        ops = {'seal': self.seal, 'lookup': self.lookup, 'list': self.list,
+               'delete': self.delete, 'contains': self.contains, 'stats': self.stats,
+               'since': self.since}
+        while True:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                break
+            if request[0] == 'subscribe':
+                self._addSubscriber(conn, *request[1:])
+                return
+            try:
+                reply = ops[request[0]](*request[1:])
+            except Exception as e:
+                logger.error('Store request {} failed: {}'.format(request[0], e))
+                reply = ('error', str(e))
+            try:
+                conn.send(reply)
+            except (EOFError, OSError):
+                break
+        conn.close()
+
+    def seal(self, object_id, segment, data_size, name=None, frame=None):
+        ''' Register a fully written segment under object_id and notify
+            subscribers to a prefix of name.
+            When full, spills objects first if a spill directory is set
+        '''
+        with self.cond:
+            if object_id in self.index or object_id in self.spilled:
+                return ('exists',)
+            victims = []
+            if self.used + data_size > self.capacity and self.spill_dir is not None:
+                victims = self._victims(self.used + data_size - self.low_water)
+        for victim in victims:
+            self._spill(*victim)
+        with self.cond:
+            if self.used + data_size > self.capacity:
+                return ('full', self.capacity - self.used)
+            self.index[object_id] = (segment, data_size)
+            if name is not None:
+                self.names[object_id] = (name, frame)
+            self.access[object_id] = time.monotonic()
+            self.used += data_size
+            self.seq += 1
+            self.log.append(object_id)
+            if len(self.log) >= 2*self.log_size:
+                # Trim in halves so appends stay amortized O(1)
+                del self.log[:-self.log_size]
+                self.log_start = self.seq - self.log_size + 1
+            self.cond.notify_all()
+            for q, prefixes in self.subscribers:
+                if prefixes is None or (name is not None and name.startswith(prefixes)):
+                    self._notify(q, (object_id, data_size, 0, name, frame))
+        return ('ok',)
+
+    def lookup(self, object_ids, timeout_ms):
+        ''' Return (segment or spill file, size, spilled, name) per id, or None
+            if the id is not sealed within timeout_ms.
+            A negative timeout waits indefinitely.
+        '''
+        deadline = None if timeout_ms < 0 else time.monotonic() + timeout_ms/1000
+        with self.cond:
+            while not all(i in self.index or i in self.spilled for i in object_ids):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            now = time.monotonic()
+            entries = []
+            for i in object_ids:
+                if i in self.index:
+                    self.access[i] = now
+                    entries.append(self.index[i] + (False, self.names.get(i, (None,))[0]))
+                elif i in self.spilled:
+                    entries.append(self.spilled[i] + (True, self.names.get(i, (None,))[0]))
+                else:
+                    entries.append(None)
+            return entries
+
+    def since(self, seq, limit, timeout_ms):
+        ''' Ids sealed after sequence number seq, oldest first and at most
+            limit of them, waiting up to timeout_ms for one if there are
+            none yet. Returns (sequence number of the last id returned,
+            number of ids no longer in the log, ids); pass the first back
+            as seq to continue. Deleted objects are included
+        '''
+        deadline = None if timeout_ms < 0 else time.monotonic() + timeout_ms/1000
+        with self.cond:
+            while self.seq <= seq:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return (seq, 0, [])
+                self.cond.wait(remaining)
+            missed = max(0, self.log_start - seq - 1)
+            start = seq + 1 + missed - self.log_start
+            stop = len(self.log) if limit is None else min(len(self.log), start + limit)
+            ids = self.log[start:stop]
+            return (seq + missed + len(ids), missed, ids)
+
+    def list(self):
+        with self.cond:
+            listing = {i: {'data_size': size} for i, (_, size) in self.index.items()}
+            listing.update({i: {'data_size': size, 'spilled': True}
+                            for i, (_, size) in self.spilled.items()})
+            for i, (name, frame) in self.names.items():
+                if i in listing:
+                    listing[i].update(name=name, frame=frame)
+            return listing
+
+    def contains(self, object_id):
+        with self.cond:
+            return object_id in self.index or object_id in self.spilled
+
+    def delete(self, object_ids):
+        with self.cond:
+            for i in object_ids:
+                entry = self.index.pop(i, None)
+                self.access.pop(i, None)
+                self.names.pop(i, None)
+                if entry is not None:
+                    _unlinkSegment(entry[0])
+                    self.used -= entry[1]
+                entry = self.spilled.pop(i, None)
+                if entry is not None:
+                    _removeFile(entry[0])
+        return ('ok',)
+
+    def stats(self):
+        with self.cond:
+            return {'capacity': self.capacity, 'used': self.used, 'count': len(self.index),
+                    'spilled': len(self.spilled),
+                    'spilled_bytes': sum(size for _, size in self.spilled.values()),
+                    'seq': self.seq}
+
+    def _spiller(self):
+        ''' Spill thread: keep usage under the high-water mark
+        '''
+        while True:
+            with self.cond:
+                while self.used - self._spillingBytes() <= self.high_water:
+                    self.cond.wait()
+                victims = self._victims(self.used - self.low_water)
+            for victim in victims:
+                self._spill(*victim)
+
+    def _spillingBytes(self):
+        return sum(self.index[i][1] for i in self.spilling if i in self.index)
+
+    def _victims(self, nbytes):
+        ''' Pick least recently used objects totalling at least nbytes
+            and mark them as being spilled. Call with the lock held
+        '''
+        victims = []
+        for i in sorted(self.index, key=self.access.get):
+            if nbytes <= 0:
+                break
+            if i in self.spilling:
+                continue
+            segment, size = self.index[i]
+            self.spilling.add(i)
+            victims.append((i, segment, size))
+            nbytes -= size
+        return victims
+
+    def _spill(self, object_id, segment, data_size):
+        ''' Copy one object to a file in spill_dir and free its segment.
+            Readers still attached to the segment keep their mapping
+        '''
+        path = os.path.join(self.spill_dir, object_id.hex())
+        try:
+            try:
+                shm = _openSegment(segment)
+            except FileNotFoundError:
+                return
+            try:
+                with shm.buf[:data_size] as view, open(path + '.tmp', 'wb') as f:
+                    f.write(view)
+                os.replace(path + '.tmp', path)
+            except OSError as e:
+                logger.error('Cannot spill object to {}: {}'.format(path, e))
+                _removeFile(path + '.tmp')
+                return
+            finally:
+                shm.close()
+            with self.cond:
+                if self.index.get(object_id) != (segment, data_size):
+                    _removeFile(path)  # deleted while we copied it
+                    return
+                del self.index[object_id]
+                self.access.pop(object_id, None)
+                self.spilled[object_id] = (path, data_size)
+                self.used -= data_size
+            _unlinkSegment(segment)
+        finally:
+            with self.cond:
+                self.spilling.discard(object_id)
+
+    def _addSubscriber(self, conn, prefixes=None):
+        # Notifications are queued and sent from a separate thread so a
+        # subscriber that never reads cannot block puts from other clients
+        q = queue.Queue(maxsize=100000)
+        entry = (q, None if prefixes is None else tuple(prefixes))
+        with self.cond:
+            self.subscribers.append(entry)
+        conn.send(('ok',))  # registered: objects sealed from now on are sent
+
+        def sender():
+            while True:
+                try:
+                    conn.send(q.get())
+                except (EOFError, OSError):
+                    break
+            with self.cond:
+                self.subscribers.remove(entry)
+            conn.close()
+        threading.Thread(target=sender, daemon=True).start()
+
+    @staticmethod
+    def _notify(q, item):
+        try:
+            q.put_nowait(item)
+        except queue.Full:
+            pass  # slow subscriber, drop the notification
+
+
+class SharedMemoryClient():
+    ''' Client for SharedMemoryServer exposing the PlasmaClient calls
+        that Limbo relies on (put, get, list, contains, delete,
+        subscribe, get_next_notification, disconnect).
+    '''
+    def __init__(self, store_loc, cache_size=64):
+        self.store_loc = store_loc
+        self.conn = Client(store_loc, 'AF_UNIX')
+        self.lock = threading.Lock()
+        # Attached segments by id, least recently used first. Bounded so
+        # that segments deleted by other clients get unmapped here too;
+        # views handed out keep their mapping alive after detaching
+        self.segments = OrderedDict()
+        self.names = {}  # names of attached objects, by id
+        self.cache_size = cache_size
+        self.notifications = None
+
+    def _request(self, *request):
+        with self.lock:
+            self.conn.send(request)
+            return self.conn.recv()
+
+    def put(self, value, object_id=None, name=None, frame=None):
+        ''' Serialize value into a new segment and seal it.
+            name and frame are passed on to subscribers.
+            Returns the ObjectID.
+        '''
+        if object_id is None:
+            object_id = ObjectID.from_random()
+        stream, raws, table, size = serialize(value)
+        return self._putSegment(object_id, size, lambda buf: writeSegment(buf, stream, raws, table),
+                                name, frame)
+
+    def put_segment(self, segment, object_id, name=None, frame=None):
+        ''' Put a value already laid out as a segment (e.g. read from a
+            snapshot file), copying it in without unpickling it
+        '''
+        size = len(segment)
+        return self._putSegment(object_id, size, lambda buf: buf.__setitem__(slice(0, size), segment),
+                                name, frame)
+
+    def _putSegment(self, object_id, size, write, name, frame):
+        try:
+            shm = _openSegment(_segmentName(object_id), create=True, size=max(size, 1))
+        except FileExistsError:
+            raise ObjectExistsError('Object {} already exists'.format(object_id))
+        try:
+            write(shm.buf)
+            reply = self._request('seal', object_id.binary(), shm.name, shm.size, name, frame)
+        except BaseException:
+            shm.close()
+            _unlinkSegment(shm.name)
+            raise
+        if reply[0] != 'ok':
+            shm.close()
+            _unlinkSegment(shm.name)
+            if reply[0] == 'exists':
+                raise ObjectExistsError('Object {} already exists'.format(object_id))
+            elif reply[0] == 'full':
+                raise StoreFullError('Cannot fit {} bytes, {} bytes free'.format(size, reply[1]))
+            raise IOError('Store error: {}'.format(reply[1:]))
+        if name is not None:
+            self.names[object_id.binary()] = name
+        self._cache(object_id.binary(), shm)
+        return object_id
+
+    def get(self, object_ids, timeout_ms=-1):
+        ''' Get one object or a list of objects.
+            Missing objects come back as ObjectNotAvailable.
+        '''
+        if not isinstance(object_ids, (list, tuple)):
+            return self.get([object_ids], timeout_ms)[0]
+        results = []
+        for segment in self.get_segments(object_ids, timeout_ms):
+            results.append(ObjectNotAvailable if segment is None else readSegment(segment))
+        return results
+
+    def get_segments(self, object_ids, timeout_ms=0):
+        ''' Read-only views of the segments of a list of objects, just
+            as long as their contents, or None for missing objects
+        '''
+        missing = [i.binary() for i in object_ids if i.binary() not in self.segments]
+        for attempt in range(2):
+            if not missing:
+                break
+            moved = []
+            for binary, entry in zip(missing, self._request('lookup', missing, timeout_ms)):
+                if entry is not None:
+                    try:
+                        if entry[2]:
+                            self.segments[binary] = _SpillFile(entry[0])
+                        else:
+                            self.segments[binary] = _openSegment(entry[0])
+                    except FileNotFoundError:
+                        moved.append(binary)  # spilled or deleted after lookup
+                        continue
+                    if entry[3] is not None:
+                        self.names[binary] = entry[3]
+            missing, timeout_ms = moved, 0
+        segments = []
+        for i in object_ids:
+            shm = self.segments.get(i.binary())
+            if shm is None:
+                segments.append(None)
+            else:
+                self.segments.move_to_end(i.binary())
+                buf = shm.buf.toreadonly()
+                segments.append(buf[:segmentSize(buf)])
+        self._trim()
+        return segments
+
+    def contains(self, object_id):
+        return self._request('contains', object_id.binary())
+
+    def name(self, object_id):
+        ''' Name the object was put under, if known here (it was
+            put or got through this client and is still attached)
+        '''
+        return self.names.get(object_id.binary())
+
+    def list(self):
+        return {ObjectID(i): info for i, info in self._request('list').items()}
+
+    def delete(self, object_ids):
+        self._request('delete', [i.binary() for i in object_ids])
+        for i in object_ids:
+            self._detach(i.binary())
+
+    def store_capacity(self):
+        return self._request('stats')['capacity']
+
+    def stats(self):
+        return self._request('stats')
+
+    def sealed_since(self, seq, limit=None, timeout_ms=0):
+        ''' Objects sealed after sequence number seq (0 for all).
+            Returns (cursor, missed, ids): pass cursor back as seq to
+            continue; missed counts ids that aged out of the store's log
+            before they were asked for. See SharedMemoryServer.since
+        '''
+        cursor, missed, ids = self._request('since', seq, limit, timeout_ms)
+        return cursor, missed, [ObjectID(i) for i in ids]
+
+    def subscribe(self, prefixes=None):
+        ''' Open a Subscription to objects sealed under any of the
+            name prefixes, or to all objects. The last one opened also
+            serves get_next_notification
+        '''
+        self.notifications = Subscription(self.store_loc, prefixes)
+        return self.notifications
+
+    def get_next_notification(self):
+        object_id, data_size, metadata_size, _, _ = self.notifications.conn.recv()
+        return ObjectID(object_id), data_size, metadata_size
+
+    def disconnect(self):
+        self.conn.close()
+        if self.notifications is not None:
+            self.notifications.close()
+        for binary in list(self.segments):
+            self._detach(binary)
+
+    def _cache(self, binary, shm):
+        self.segments[binary] = shm
+        self._trim()
+
+    def _trim(self):
+        while len(self.segments) > self.cache_size:
+            self._detach(next(iter(self.segments)))
+
+    def _detach(self, binary):
+        self.names.pop(binary, None)
+        shm = self.segments.pop(binary, None)
+        if shm is not None:
+            try:
+                shm.close()
+            except BufferError:
+                # Views are still exported: drop our handle on the mapping
+                # so it is unmapped together with the last view
+                shm._mmap = None
+                shm.close()
+
+
+class Subscription():
+    ''' Stream of Notifications for objects sealed under a set of
+        name prefixes, on its own connection to the store.
+        Waiting blocks in the kernel on the connection socket, so a
+        subscriber wakes as soon as the store pushes a notification
+        without spinning:
+            for name, frame, object_id in sub: ...        (blocking)
+            sub.next(timeout=0.5)                         (None on timeout)
+            async for name, frame, object_id in sub: ...  (asyncio)
+        fileno() can also be passed to select/poll directly.
+    '''
+    def __init__(self, store_loc, prefixes=None):
+        if isinstance(prefixes, str):
+            prefixes = [prefixes]
+        self.prefixes = None if prefixes is None else list(prefixes)
+        self.conn = Client(store_loc, 'AF_UNIX')
+        self.conn.send(('subscribe', self.prefixes))
+        self.conn.recv()
+
+    def fileno(self):
+        return self.conn.fileno()
+
+    def poll(self, timeout=0):
+        ''' Whether a notification is waiting, waiting up to timeout
+            seconds (None waits indefinitely)
+        '''
+        return self.conn.poll(timeout)
+
+    def next(self, timeout=None):
+        ''' Next Notification, or None if there is none within timeout
+            seconds. None waits indefinitely
+        '''
+        if timeout is not None and not self.conn.poll(timeout):
+            return None
+        object_id, _, _, name, frame = self.conn.recv()
+        return Notification(name, frame, ObjectID(object_id))
+
+    def drain(self):
+        ''' All notifications already waiting, without blocking
+        '''
+        out = []
+        while self.conn.poll():
+            out.append(self.next())
+        return out
+
+    def close(self):
+        self.conn.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return self.next()
+        except (EOFError, OSError):
+            raise StopIteration
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.conn.poll():
+            loop = asyncio.get_running_loop()
+            ready = loop.create_future()
+            loop.add_reader(self.fileno(), lambda: ready.done() or ready.set_result(None))
+            try:
+                await ready
+            finally:
+                loop.remove_reader(self.fileno())
+        try:
+            return self.next()
+        except (EOFError, OSError):
+            raise StopAsyncIteration
+
+
+def connect(store_loc, num_retries=20):
+    ''' Connect to a running SharedMemoryServer,
+        retrying while the store process starts up
+    '''
+    for i in range(num_retries):
+        try:
+            return SharedMemoryClient(store_loc)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if i == num_retries - 1:
+                raise
+            time.sleep(0.1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='improv shared memory store')
+    parser.add_argument('-s', dest='store_loc', default='/tmp/store', help='socket path')
+    parser.add_argument('-m', dest='size', type=int, default=40000000000, help='capacity in bytes')
+    parser.add_argument('-d', dest='spill_dir', default=None, help='directory to spill objects to when full')
+    parser.add_argument('-w', dest='high_water', type=float, default=0.9,
+                        help='fraction of capacity in use before spilling')
+    args = parser.parse_args(argv)
+
+    def terminate(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, terminate)
+
+    server = SharedMemoryServer(args.store_loc, args.size, args.spill_dir, args.high_water)
+    try:
+        server.serve()
+    except (SystemExit, KeyboardInterrupt):
+        pass
+    finally:
+        if os.path.exists(args.store_loc):
+            os.unlink(args.store_loc)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,172 @@
+''' Store snapshots: many objects in one indexed, memory-mappable file.
+
+    Each object is written as it is laid out in the shared-memory store
+    (see shm_store.serialize): a small pickle stream with its arrays as
+    raw, 64-byte aligned buffers. Objects are appended sequentially and
+    followed by an index of (object id, name, frame, offset, size), so
+    a snapshot is written in one pass and any object can be found
+    without reading the others. Written by Limbo.saveStore and
+    Limbo.saveSubstore, restored with Limbo.loadStore.
+
+    SnapshotReader maps a snapshot read-only; arrays it returns are
+    views into the file, so a snapshot can be inspected without a store.
+'''
+import os
+import pickle
+import struct
+from collections import namedtuple
+
+from improv.shm_store import serialize, readSegment, _HEADER, _BUFFER, _ALIGN, _SpillFile
+
+import logging; logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_MAGIC = b'IMPVSNAP'
+_VERSION = 1
+_FILE_HEADER = struct.Struct('<8sIIQQ')  # magic, version, count, index offset, index size
+_DATA_OFFSET = 4096
+_ZEROS = bytes(_ALIGN)
+
+# object_id: 20-byte id binary; name, frame: as put (frame may be None);
+# offset, size: of the object's segment in the file
+SnapshotEntry = namedtuple('SnapshotEntry', ['object_id', 'name', 'frame', 'offset', 'size'])
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class SnapshotWriter():
+    ''' Appends objects to a new snapshot file. The file appears under
+        its name only once close() has written the index
+    '''
+    def __init__(self, path, buffer_size=8*2**20):
+        self.path = path
+        self.tmp = path + '.tmp'
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.tmp, 'wb', buffering=buffer_size)
+        self.file.write(bytes(_DATA_OFFSET))
+        self.pos = _DATA_OFFSET
+        self.entries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def addSegment(self, object_id, name, frame, segment):
+        ''' Append an object already laid out as a segment
+        '''
+        self._pad(_align(self.pos))
+        self.entries.append(SnapshotEntry(object_id, name, frame, self.pos, len(segment)))
+        self.file.write(segment)
+        self.pos += len(segment)
+
+    def addValue(self, object_id, name, frame, value):
+        ''' Append an object, laying it out as a segment
+        '''
+        stream, raws, table, size = serialize(value)
+        start = _align(self.pos)
+        self._pad(start)
+        head = bytearray(_HEADER.size + _BUFFER.size*len(table))
+        _HEADER.pack_into(head, 0, len(stream), len(raws))
+        for k, entry in enumerate(table):
+            _BUFFER.pack_into(head, _HEADER.size + k*_BUFFER.size, *entry)
+        self.file.write(head)
+        self.file.write(stream)
+        self.pos += len(head) + len(stream)
+        for (offset, length), raw in zip(table, raws):
+            self._pad(start + offset)
+            self.file.write(raw)
+            self.pos += length
+        self.entries.append(SnapshotEntry(object_id, name, frame, start, size))
+        self._pad(start + size)
+
+    def close(self):
+        ''' Write the index and header and move the file into place.
+            Returns the number of objects written
+        '''
+        index = pickle.dumps([tuple(e) for e in self.entries], protocol=5)
+        self.file.write(index)
+        self.file.seek(0)
+        self.file.write(_FILE_HEADER.pack(_MAGIC, _VERSION, len(self.entries), self.pos, len(index)))
+        self.file.close()
+        os.replace(self.tmp, self.path)
+        logger.info('Wrote {} objects to snapshot {}'.format(len(self.entries), self.path))
+        return len(self.entries)
+
+    def abort(self):
+        self.file.close()
+        os.unlink(self.tmp)
+
+    def _pad(self, pos):
+        while self.pos < pos:
+            n = min(pos - self.pos, len(_ZEROS))
+            self.file.write(_ZEROS[:n])
+            self.pos += n
+
+
+class SnapshotReader():
+    ''' Read-only mapping of a snapshot file. Values are rebuilt from
+        the mapping, with arrays as read-only views into it that stay
+        valid after close()
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.file = _SpillFile(path)
+        magic, version, count, index_offset, index_size = _FILE_HEADER.unpack_from(self.file.buf, 0)
+        if magic != _MAGIC:
+            raise ValueError('{} is not an improv snapshot'.format(path))
+        if version != _VERSION:
+            raise ValueError('Unsupported snapshot version {}'.format(version))
+        index = pickle.loads(self.file.buf[index_offset:index_offset+index_size])
+        self.entries = [SnapshotEntry(*e) for e in index]
+        self.keys = {}  # name or (name, frame): entry
+        for entry in self.entries:
+            if entry.name is not None:
+                self.keys[entry.name if entry.frame is None else (entry.name, entry.frame)] = entry
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def select(self, prefixes=None):
+        ''' Entries whose name or name prefix is listed in prefixes,
+            or all entries
+        '''
+        if prefixes is None:
+            return list(self.entries)
+        from improv.store import splitKey
+        prefixes = set(prefixes)
+        return [e for e in self.entries if e.name is not None and
+                (e.name in prefixes or (e.frame is None and splitKey(e.name)[0] in prefixes))]
+
+    def segment(self, entry):
+        ''' The object's segment, as a read-only view into the file
+        '''
+        return self.file.buf[entry.offset:entry.offset+entry.size]
+
+    def value(self, entry):
+        return readSegment(self.segment(entry))
+
+    def get(self, key):
+        ''' Value of the object put under name or (name, frame) key
+        '''
+        return self.value(self.keys[key])
+
+    def close(self):
+        self.file.close()
@@ -1,17 +1,43 @@
 import datetime
 import os
 import pickle
+import queue
+import struct
+import threading
 import time
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
 import numpy as np
-import pyarrow as arrow
-import pyarrow.plasma as plasma
-from pyarrow.plasma import PlasmaObjectExists
-from pyarrow.lib import ArrowIOError
-from pyarrow.plasma import ObjectNotAvailable
-from scipy.sparse import csc_matrix
+import scipy.sparse
 from improv.actor import Spike
+from improv import shm_store, store_proxy
+from improv.compression import (CODECS, CODEC_IDS, checkCodec, isArrayCodec,
+                                compress, decompress, encodeArray, decodeArray)
+from improv.shm_store import ObjectExistsError
+from improv.ring import FrameRing, RingRef
+from improv.roi import ROITable
+from improv.metrics import StoreMetrics, nbytes
+from improv.snapshot import SnapshotWriter, SnapshotReader
 from queue import Empty
 
+try:
+    import pyarrow
+    import pyarrow.plasma as plasma
+    from pyarrow.plasma import PlasmaObjectExists
+    from pyarrow.lib import ArrowIOError
+    from pyarrow.plasma import ObjectNotAvailable
+    # plasma puts and gets with pyarrow's default serialization context,
+    # which rejects classes it has not been told about
+    pyarrow.default_serialization_context().register_type(ROITable, 'improv.ROITable', pickle=True)
+except ImportError:
+    # pyarrow.plasma was removed from recent pyarrow releases;
+    # only the shared memory backend (SharedLimbo) is available then
+    plasma = None
+    PlasmaObjectExists = ObjectExistsError
+    ArrowIOError = OSError
+    from improv.shm_store import ObjectNotAvailable
+
 import logging; logger=logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
@@ -40,13 +66,14 @@ class Limbo(StoreInterface):
     ''' Basic interface for our specific data store
         implemented with apache arrow plasma
         Objects are stored with object_ids
-        References to objects are contained in a dict where key is
-          shortname, value is object_id
+        References to objects are contained in a StoredIndex where key is
+          shortname (or (prefix, frame)), value is object_id
     '''
 
     def __init__(self, name='default', store_loc='/tmp/store',
                  hdd_path='output/', use_hdd=False, hdd_maxstore=1e12,
-                 flush_immediately=False, commit_freq=20):
+                 flush_immediately=False, commit_freq=20, eviction=None,
+                 index_size=65536, codecs=None, metrics=False):
         # TODO TODO TODO: Refactor to use local hdd settings instead of put and get
         ''' Constructor for Limbo
             store_loc: Apache Arrow Plasma client location, default is /tmp/store
@@ -56,12 +83,32 @@ class Limbo(StoreInterface):
                 TODO: NO errors raised without being handled or suggested resolution
             flush_immediately: Save objects to disk immediately
             commit_freq: If not flush_immediately, flush data to disk every N puts
+            eviction: dict of name prefix: rule for the objects this Limbo puts,
+                e.g. {'acq_raw': {'keep_last': 100}, 'Call': {'ttl': 30}}.
+                See EvictionPolicy
+            index_size: frames remembered per name prefix in self.stored;
+                older entries are dropped. See StoredIndex
+            codecs: dict of object type: compression codec for the LMDB.
+                See improv.compression
+            metrics: record operation latencies and sizes in a
+                shared memory block, self.metrics, freed by release().
+                Nexus turns this on with the store_metrics setting.
+                See improv.metrics
         '''
 
         self.name = name
         self.store_loc = store_loc
         self.client = self.connectStore(store_loc)
-        self.stored = {}
+        self.stored = StoredIndex(index_size)
+        self.rings = {}  # frame rings attached or created, by segment name
+        self.ring_names = {}  # rings created here, by registered name
+
+        # Longest prefix first so the most specific rule applies
+        self.policies = [EvictionPolicy(prefix, **rule) for prefix, rule in
+                         sorted((eviction or {}).items(), key=lambda p: -len(p[0]))]
+        self.tracked = {}  # object id: policy, for objects subject to eviction
+        self.pinned = {}  # object id: (policy, entry), exempt until unpinned
+        self.metrics = StoreMetrics.create() if metrics else None
 
         # Offline db
         self.use_hdd = use_hdd
@@ -69,7 +116,7 @@ class Limbo(StoreInterface):
 
         if use_hdd:
             self.lmdb_store = LMDBStore(max_size=hdd_maxstore, path=hdd_path, flush_immediately=flush_immediately,
-                                        commit_freq=commit_freq, from_limbo=True)
+                                        commit_freq=commit_freq, from_limbo=True, codecs=codecs)
 
     def connectStore(self, store_loc):
         ''' Connect to the store at store_loc
@@ -86,21 +133,29 @@ class Limbo(StoreInterface):
             raise CannotConnectToStoreError(store_loc)
         return self.client
 
-    def put(self, object, object_name, save=False):
+    def put(self, object, object_name, save=False, frame=None):
         ''' Put a single object referenced by its string name
             into the store
+            frame: register the object under (object_name, frame) rather
+                than the name object_name+str(frame); same entry, no string
+                formatting. Look it up with get((object_name, frame))
         '''
         object_id = None
+        start = time.perf_counter_ns()
         try:
-            # Need to pickle if object is csc_matrix
-            if isinstance(object, csc_matrix):
-                object_id = self.client.put(pickle.dumps(object, protocol=pickle.HIGHEST_PROTOCOL))
+            # Sparse matrices go in as their component arrays, not pickled
+            if scipy.sparse.issparse(object):
+                object_id = self._putObject(encodeSparse(object), object_name, frame)
             else:
-                object_id = self.client.put(object)
-            self.updateStored(object_name, object_id)
+                object_id = self._putObject(object, object_name, frame)
+            if self.metrics is not None:
+                self._record('put', object_name if frame is not None else splitKey(object_name)[0],
+                             start, object)
+            key = self.updateStored(object_name, object_id, frame)
+            self._track(object_name, object_id, key)
             if self.use_hdd:
-                self.lmdb_store.put(object, object_name, obj_id=object_id, save=save)
-        except PlasmaObjectExists:
+                self.lmdb_store.put(object, key, obj_id=object_id, save=save)
+        except (PlasmaObjectExists, ObjectExistsError):
             logger.error('Object already exists. Meant to call replace?')
         except ArrowIOError as e:
             logger.error('Could not store object '+object_name+': {} {}'.format(type(e).__name__, e))
@@ -110,6 +165,72 @@ class Limbo(StoreInterface):
             logger.error('Could not store object '+object_name+': {} {}'.format(type(e).__name__, e))
         return object_id
 
+    def putMany(self, objects, object_name=None, save=False, frame=None):
+        ''' Put a bundle of objects (dict of name: object) into the store
+            as a single object, e.g. all results for one frame.
+            One store round trip, one name registration and one LMDB insert.
+            object_name registers the bundle; defaults to the first name.
+            frame: as in put
+            Returns the bundle id, to be read back with getMany
+        '''
+        if object_name is None:
+            object_name = next(iter(objects))
+        bundle = {name: encodeSparse(obj) if scipy.sparse.issparse(obj) else obj
+                  for name, obj in objects.items()}
+        bundle[BUNDLE_HEADER] = True
+        object_id = None
+        start = time.perf_counter_ns()
+        try:
+            object_id = self._putObject(bundle, object_name, frame)
+            if self.metrics is not None:
+                self._record('putMany', object_name if frame is not None else splitKey(object_name)[0],
+                             start, objects)
+            key = self.updateStored(object_name, object_id, frame)
+            self._track(object_name, object_id, key)
+            if self.use_hdd:
+                self.lmdb_store.put(objects, key, obj_id=object_id, save=save)
+        except (PlasmaObjectExists, ObjectExistsError):
+            logger.error('Object already exists. Meant to call replace?')
+        except ArrowIOError as e:
+            logger.error('Could not store bundle '+object_name+': {} {}'.format(type(e).__name__, e))
+            logger.info('Refreshing connection and continuing')
+            self.reset()
+        except Exception as e:
+            logger.error('Could not store bundle '+object_name+': {} {}'.format(type(e).__name__, e))
+        return object_id
+
+    def getMany(self, names_or_ids):
+        ''' Get one bundle (or a list of them) written by putMany,
+            by bundle id or by registered name or (name, frame) key,
+            in a single store call.
+            Returns a dict of name: object per bundle
+            Raises ObjectNotFoundError if any bundle is missing
+        '''
+        start = time.perf_counter_ns()
+        single = not isinstance(names_or_ids, list)  # a tuple is a (name, frame) key
+        if single:
+            names_or_ids = [names_or_ids]
+        ids = []
+        for n in names_or_ids:
+            if isinstance(n, (str, tuple)):
+                if self.stored.get(n) is None:
+                    logger.error('Never recorded storing this object: {}'.format(n))
+                    raise CannotGetObjectError(query = n)
+                n = self.stored.get(n)
+            n = self._clientID(n)
+            if n in self.tracked:
+                self.tracked[n].touch(n)
+            ids.append(n)
+        bundles = []
+        for obj_id, res in zip(ids, self.client.get(ids, 0)):
+            if isinstance(res, type):
+                logger.warning('Object {} cannot be found.'.format(obj_id))
+                raise ObjectNotFoundError(obj_id_or_name = obj_id)
+            bundles.append(decodeBundle(res))
+        if self.metrics is not None and ids:
+            self._record('getMany', self._prefixOf(ids[0]), start, bundles[0])
+        return bundles[0] if single else bundles
+
     def get(self, object_name):
         ''' Get a single object from the store
             Checks to see if it knows the object first
@@ -119,37 +240,150 @@ class Limbo(StoreInterface):
         '''
         #print('trying to get ', object_name)
         if self.stored.get(object_name) is None:
-            logger.error('Never recorded storing this object: '+object_name)
+            logger.error('Never recorded storing this object: {}'.format(object_name))
             # Don't know anything about this object, treat as problematic
             raise CannotGetObjectError(query = object_name)
         else:
             return self._get(object_name)
 
+    def getRange(self, prefix, start, stop):
+        ''' Get the objects stored for frames start..stop-1 of prefix,
+            as a dict of frame: object. Frames no longer indexed are skipped
+        '''
+        found = self.stored.range(prefix, start, stop)
+        return dict(zip(found.keys(), self.getList(list(found.values()), timeout=0)))
+
     def getID(self, obj_id, hdd_only=False):
         ''' Preferred mechanism for getting. TODO: Rename
+            A RingRef resolves to a read-only view of its ring slot
         '''
+        obj_id = self._clientID(obj_id)
+        if self.metrics is None:
+            return self._getID(obj_id, hdd_only)
+        start = time.perf_counter_ns()
+        try:
+            res = self._getID(obj_id, hdd_only)
+        except ObjectNotFoundError:
+            self._record('miss', self._prefixOf(obj_id), start)
+            raise
+        self._record('get', self._prefixOf(obj_id), start, res)
+        return res
+
+    def _getID(self, obj_id, hdd_only=False):
+        if isinstance(obj_id, RingRef):
+            return self._getFrame(obj_id)
+        if obj_id in self.tracked:
+            self.tracked[obj_id].touch(obj_id)
+
         # Check in RAM
         if not hdd_only:
             res = self.client.get(obj_id,0)
-            if isinstance(res, type):
-                logger.warning('Object {} cannot be found.'.format(obj_id))
-                raise ObjectNotFoundError(obj_id_or_name = obj_id)
             # Deal with pickled objects.
-            elif isinstance(res, bytes): #TODO don't use generic bytes
+            if isinstance(res, bytes): #TODO don't use generic bytes
                 return pickle.loads(res)
-            else:
-                return res
+            elif not isinstance(res, type):
+                return decodeObject(res)
 
-        # Check in disk TODO: rework logic for faster gets
+        # Not in RAM (e.g. evicted): fault it back in from disk
         if self.use_hdd:
             res = self.lmdb_store.get(obj_id)
             if res is not None:
                 return res
+        logger.warning('Object {} cannot be found.'.format(obj_id))
+        raise ObjectNotFoundError(obj_id_or_name = obj_id)
+
+    def getList(self, ids, timeout=None):
+        ''' Get multiple objects from the store, waiting until all exist,
+            or at most timeout seconds (0 not to wait). Raises
+            ObjectNotFoundError if any is still missing (e.g. evicted);
+            getID each to fault them in from disk instead
+        '''
+        if any(isinstance(i, RingRef) for i in ids):
+            return [self.getID(i) if isinstance(i, RingRef) else self.getList([i], timeout)[0] for i in ids]
+        ids = [self._clientID(i) for i in ids]
+        start = time.perf_counter_ns()
+        res = []
+        timeout_ms = -1 if timeout is None else int(timeout*1000)
+        for obj_id, obj in zip(ids, self.client.get(ids, timeout_ms)):
+            if isinstance(obj, type):
+                logger.warning('Object {} cannot be found.'.format(obj_id))
+                raise ObjectNotFoundError(obj_id_or_name = obj_id)
+            res.append(decodeObject(obj))
+        if self.metrics is not None and ids:
+            self._record('getList', self._prefixOf(ids[0]), start, res)
+        return res
+
+    def _clientID(self, obj_id):
+        ''' Ids unpacked from a FrameMessage are shm_store.ObjectIDs;
+            plasma needs its own
+        '''
+        if isinstance(obj_id, shm_store.ObjectID):
+            return plasma.ObjectID(obj_id.binary())
+        return obj_id
+
+    def _record(self, op, prefix, start, obj=None):
+        ''' Record an operation begun at perf_counter_ns() start
+        '''
+        self.metrics.record(op, prefix, start, 0 if obj is None else nbytes(obj))
 
-    def getList(self, ids):
-        ''' Get multiple objects from the store
+    def typeOf(self, obj_id):
+        ''' Type (name prefix, see splitKey) of the stored object obj_id;
+            None if this Limbo cannot tell
         '''
-        return self.client.get(ids)
+        return None
+
+    def _prefixOf(self, obj_id):
+        ''' Name prefix to record an operation on obj_id under; '*' if
+            this Limbo cannot tell
+        '''
+        return 'ring' if isinstance(obj_id, RingRef) else (self.typeOf(obj_id) or '*')
+
+    def createRing(self, object_name, shape, dtype, capacity):
+        ''' Allocate a frame ring (see improv.ring) owned by this process
+            and register its descriptor in the store under object_name
+        '''
+        ring = FrameRing.create(shape, dtype, capacity)
+        self.rings[ring.name] = ring
+        self.ring_names[object_name] = ring
+        self.put(ring.descriptor(), object_name)
+        logger.info('Created ring {} of {} frames {} {}'.format(object_name, capacity, shape, dtype))
+        return ring
+
+    def putRing(self, frame, object_name, capacity):
+        ''' Write frame into the next slot of ring object_name, creating
+            the ring from the first frame's shape and dtype.
+            Returns a RingRef (ring, slot, sequence number) to send on
+            in place of an object id
+        '''
+        ring = self.ring_names.get(object_name)
+        if ring is None:
+            ring = self.createRing(object_name, frame.shape, frame.dtype, capacity)
+        return ring.put(frame)
+
+    def checkFrame(self, obj_id):
+        ''' Raise FrameOverrunError if obj_id is a RingRef whose slot
+            has been overwritten, e.g. after processing a view of it.
+            No-op for regular object ids
+        '''
+        if isinstance(obj_id, RingRef) and not self._ring(obj_id.name).valid(obj_id):
+            raise FrameOverrunError(obj_id)
+
+    def _ring(self, name):
+        ring = self.rings.get(name)
+        if ring is None:
+            ring = FrameRing.attach(name)
+            self.rings[name] = ring
+        return ring
+
+    def _getFrame(self, ref):
+        try:
+            frame = self._ring(ref.name).get(ref)
+        except FileNotFoundError:
+            raise ObjectNotFoundError(obj_id_or_name = ref)
+        if frame is None:
+            logger.warning('Frame {} was overwritten in its ring'.format(ref.seq))
+            raise FrameOverrunError(ref)
+        return frame
 
     def get_all(self):
         ''' Get a listing of all objects in the store
@@ -163,12 +397,31 @@ class Limbo(StoreInterface):
         logger.debug('Reset local connection to store')
 
     def release(self):
+        if self.use_hdd:
+            self.lmdb_store.flush()
         self.client.disconnect()
+        if self.metrics is not None:
+            self.metrics.close()
+            self.metrics = None
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
+        self.ring_names = {}
+
+    def sealedSince(self, seq, limit=None, timeout=0):
+        ''' Objects sealed after sequence number seq. Plasma does not
+            number objects; see SharedLimbo.sealedSince
+        '''
+        raise NotImplementedError('Plasma does not number sealed objects')
 
-    def subscribe(self):
-        ''' Subscribe to a section? of the ds for singals
+    def subscribe(self, prefixes=None):
+        ''' Subscribe to notifications for sealed objects, read with notify.
+            Plasma notifications carry no object names, so only
+            subscribing to everything is supported; see SharedLimbo
             Throws unknown errors
         '''
+        if prefixes is not None:
+            raise NotImplementedError('Plasma cannot filter notifications by name')
         try:
             self.client.subscribe()
         except Exception as e:
@@ -193,12 +446,17 @@ class Limbo(StoreInterface):
             ids.append(plasma.ObjectID(np.random.bytes(20)))
         return ids
 
-    def updateStored(self, object_name, object_id):
-        ''' Update local dict with info we need locally
+    def updateStored(self, object_name, object_id, frame=None):
+        ''' Update local index with info we need locally
             Report to Nexus that we updated the store
                 (did a put or delete/replace)
+            Returns the key the object is stored under
         '''
-        self.stored.update({object_name:object_id})
+        if frame is None:
+            self.stored[object_name] = object_id
+            return object_name
+        self.stored.add(object_name, frame, object_id)
+        return (object_name, frame)
 
     def getStored(self):
         ''' returns its info about what it has stored
@@ -210,6 +468,11 @@ class Limbo(StoreInterface):
         '''
         return self.client.put(obj, id)
 
+    def _putObject(self, obj, object_name, frame):
+        ''' Put obj into the store under a new id, for put and putMany
+        '''
+        return self.client.put(obj)
+
     def _get(self, object_name):
         ''' Get an object from the store using its name
             Assumes we know the id for the object_name
@@ -224,33 +487,94 @@ class Limbo(StoreInterface):
         else:
             return res
 
-    #TODO: Likely remove all this functionality for security.
-    # def deleteName(self, object_name):
-    #     ''' Deletes an object from the store based on name
-    #         assumes we have id from name
-    #         This prevents us from deleting other portions of
-    #         the store that we don't have access to
-    #     '''
-
-    #     if self.stored.get(object_name) is None:
-    #         logger.error('Never recorded storing this object: '+object_name)
-    #         # Don't know anything about this object, treat as problematic
-    #         raise CannotGetObjectError
-    #     else:
-    #         retcode = self._delete(object_name)
-    #         self.stored.pop(object_name)
-
-    # def delete(self, id):
-    #     try:
-    #         self.client.delete([id])
-    #     except Exception as e:
-    #         logger.error('Couldnt delete: {}'.format(e))
+    def deleteName(self, object_name):
+        ''' Deletes an object from the store based on name
+            assumes we have id from name
+            This prevents us from deleting other portions of
+            the store that we don't have access to
+        '''
+        if self.stored.get(object_name) is None:
+            logger.error('Never recorded storing this object: {}'.format(object_name))
+            # Don't know anything about this object, treat as problematic
+            raise CannotGetObjectError(query = object_name)
+        self.delete(self.stored.pop(object_name))
+
+    def delete(self, obj_id):
+        ''' Delete an object (or list of objects) from the store by id.
+            Views already handed out stay valid; the memory is freed
+            once the last of them is released
+        '''
+        ids = obj_id if isinstance(obj_id, list) else [obj_id]
+        for i in ids:
+            policy = self.tracked.pop(i, None)
+            if policy is not None:
+                policy.release(i)
+            self.pinned.pop(i, None)
+        try:
+            self.client.delete(ids)
+        except Exception as e:
+            logger.error('Couldnt delete: {}'.format(e))
+
+    def pin(self, obj_id):
+        ''' Exempt an object from this Limbo's eviction, e.g. until the
+            Watcher has saved it. Returns True if the object was subject
+            to eviction here; unpin it to make it so again
+        '''
+        policy = self.tracked.pop(obj_id, None)
+        if policy is None:
+            return False
+        self.pinned[obj_id] = (policy, policy.release(obj_id))
+        return True
+
+    def unpin(self, obj_id):
+        ''' Return a pinned object to its eviction policy, as its oldest
+            entry, and apply the policies.
+            Returns False if it was not pinned here
+        '''
+        pinned = self.pinned.pop(obj_id, None)
+        if pinned is None:
+            return False
+        policy, entry = pinned
+        policy.restore(obj_id, entry)
+        self.tracked[obj_id] = policy
+        self.evict()
+        return True
+
+    def evict(self):
+        ''' Apply the eviction policies. Runs on every put;
+            call it directly to enforce ttl between puts.
+            Returns the number of objects deleted
+        '''
+        now = time.time()
+        evicted = []
+        for policy in self.policies:
+            for obj_id, key in policy.expired(now):
+                self.tracked.pop(obj_id, None)
+                self.stored.discard(key, obj_id)
+                evicted.append(obj_id)
+        if evicted:
+            try:
+                self.client.delete(evicted)
+            except Exception as e:
+                logger.error('Couldnt evict {} objects: {}'.format(len(evicted), e))
+        return len(evicted)
+
+    def _track(self, object_name, object_id, key):
+        ''' Put a new object under the first policy matching its name
+        '''
+        for policy in self.policies:
+            if object_name.startswith(policy.prefix):
+                policy.add(object_id, key)
+                self.tracked[object_id] = policy
+                break
+        if self.policies:
+            self.evict()
 
     def saveStore(self, fileName='data/store_dump'):
-        ''' Save the entire store to disk
-            Uses pickle, should extend to mmap, hd5f, ...
+        ''' Save the entire store to one snapshot file (see improv.snapshot)
+            Returns the number of objects saved
         '''
-        raise NotImplementedError
+        return self.saveSubstore(None, fileName)
 
     def saveTweak(self, tweak_ids, fileName='data/tweak_dump'):
         ''' Save current Tweak object containing parameters
@@ -265,16 +589,396 @@ class Limbo(StoreInterface):
             pickle.dump(tweak, output, -1)
 
     def saveSubstore(self, keys, fileName='data/substore_dump'):
-        ''' Save portion of store based on keys
-            to disk
+        ''' Save the objects whose name or name prefix is in keys
+            (e.g. ['acq_raw', 'params_dict']) to one snapshot file,
+            with their names so loadStore can register them again.
+            keys=None saves everything; objects are written as laid
+            out in the store where the backend allows it
+            Returns the number of objects saved
         '''
-        raise NotImplementedError
+        keys = None if keys is None else set(keys)
+        objects = []
+        for obj_id, (name, frame) in self._names().items():
+            if keys is None or (name is not None and (name in keys or
+                                (frame is None and splitKey(name)[0] in keys))):
+                objects.append((obj_id, name, frame))
+        with SnapshotWriter(fileName) as snap:
+            for start in range(0, len(objects), 256):
+                batch = objects[start:start+256]
+                self._snapshotObjects(snap, batch)
+        return len(snap.entries)
+
+    def loadStore(self, fileName='data/store_dump', keys=None):
+        ''' Put the objects from a snapshot file (or those whose name or
+            name prefix is in keys) back into the store under their
+            original ids, and register their names here.
+            Objects already in the store are skipped
+            Returns the number of objects loaded
+        '''
+        loaded = 0
+        with SnapshotReader(fileName) as snap:
+            for entry in snap.select(keys):
+                try:
+                    obj_id = self._restoreObject(snap, entry)
+                except (PlasmaObjectExists, ObjectExistsError):
+                    logger.debug('Object {} is already in the store'.format(entry.object_id.hex()))
+                    continue
+                if entry.name is not None:
+                    key = self.updateStored(entry.name, obj_id, entry.frame)
+                    self._track(entry.name, obj_id, key)
+                loaded += 1
+        logger.info('Loaded {} objects from {}'.format(loaded, fileName))
+        return loaded
+
+    def _names(self):
+        ''' (name, frame) of every object in the store, by id. The shared
+            memory store records them at put; otherwise they come from
+            this Limbo's index, and are (None, None) for objects put by others
+        '''
+        names = {obj_id: (info.get('name'), info.get('frame'))
+                 for obj_id, info in self.client.list().items()}
+        for key in self.stored:
+            obj_id = self.stored.get(key)
+            if names.get(obj_id, (None,))[0] is None and obj_id in names:
+                names[obj_id] = key if isinstance(key, tuple) else (key, None)
+        return names
+
+    def _snapshotObjects(self, snap, objects):
+        ''' Append objects, a list of (id, name, frame), to a SnapshotWriter
+        '''
+        values = self.client.get([obj_id for obj_id, _, _ in objects], 0)
+        for (obj_id, name, frame), value in zip(objects, values):
+            if not isinstance(value, type):
+                snap.addValue(obj_id.binary(), name, frame, value)
+
+    def _restoreObject(self, snap, entry):
+        ''' Put one SnapshotEntry back into the store. Returns its id
+        '''
+        return self.client.put(snap.value(entry), plasma.ObjectID(entry.object_id))
+
+
+class StoredIndex(MutableMapping):
+    ''' Limbo's index of names to object ids, bounded in size.
+        Names ending in a frame number ('acq_raw12') are kept per prefix
+        in a fixed-size table indexed by frame modulo frames_per_prefix,
+        so entries for old frames are overwritten rather than accumulated.
+        Other names go in a plain dict.
+        Keys are names or (prefix, frame) tuples, which address the same
+        entry ('S12' and ('S', 12)). The tuple form and add/lookup avoid
+        building and parsing name strings per frame.
+    '''
+    def __init__(self, frames_per_prefix=65536):
+        self.frames_per_prefix = frames_per_prefix
+        self.tables = {}
+        self.names = {}
+
+    def add(self, prefix, frame, obj_id):
+        table = self.tables.get(prefix)
+        if table is None:
+            table = self.tables[prefix] = _FrameTable(self.frames_per_prefix)
+        table.set(frame, obj_id)
+
+    def lookup(self, prefix, frame):
+        table = self.tables.get(prefix)
+        return None if table is None else table.get(frame)
+
+    def range(self, prefix, start, stop):
+        ''' Dict of frame: id for the indexed frames in [start, stop)
+        '''
+        table = self.tables.get(prefix)
+        return {} if table is None else table.range(start, stop)
+
+    def discard(self, key, obj_id=None):
+        ''' Remove key if present (and, if given, still mapped to obj_id)
+        '''
+        if obj_id is None or self.get(key) == obj_id:
+            self.pop(key, None)
+
+    def get(self, key, default=None):
+        prefix, frame = splitKey(key)
+        if frame is None:
+            return self.names.get(prefix, default)
+        res = self.lookup(prefix, frame)
+        return default if res is None else res
+
+    def __getitem__(self, key):
+        res = self.get(key)
+        if res is None:
+            raise KeyError(key)
+        return res
+
+    def __setitem__(self, key, obj_id):
+        prefix, frame = splitKey(key)
+        if frame is None:
+            self.names[prefix] = obj_id
+        else:
+            self.add(prefix, frame, obj_id)
+
+    def __delitem__(self, key):
+        prefix, frame = splitKey(key)
+        if frame is None:
+            del self.names[prefix]
+        elif prefix not in self.tables or not self.tables[prefix].remove(frame):
+            raise KeyError(key)
+
+    def __iter__(self):
+        yield from self.names
+        for prefix, table in self.tables.items():
+            for frame in table.frames_held():
+                yield prefix + str(frame)
+
+    def __len__(self):
+        return len(self.names) + sum(t.count for t in self.tables.values())
+
+    def __repr__(self):
+        return 'StoredIndex({} names, {})'.format(len(self.names),
+            {p: t.count for p, t in self.tables.items()})
+
+
+class _FrameTable():
+    ''' Fixed-size frame number -> id table for one prefix.
+        A slot holds the most recent frame that maps to it.
+    '''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.frames = array('q', [-1])*capacity
+        self.ids = [None]*capacity
+        self.count = 0
+        self.last = -1  # highest frame set
+
+    def set(self, frame, obj_id):
+        slot = frame % self.capacity
+        if self.frames[slot] < 0:
+            self.count += 1
+        self.frames[slot] = frame
+        self.ids[slot] = obj_id
+        if frame > self.last:
+            self.last = frame
+
+    def get(self, frame):
+        slot = frame % self.capacity
+        return self.ids[slot] if self.frames[slot] == frame else None
+
+    def remove(self, frame):
+        slot = frame % self.capacity
+        if self.frames[slot] != frame:
+            return False
+        self.frames[slot] = -1
+        self.ids[slot] = None
+        self.count -= 1
+        return True
+
+    def range(self, start, stop):
+        # only the last capacity frames can still be held
+        start = max(start, 0, self.last + 1 - self.capacity)
+        stop = min(stop, self.last + 1)
+        if stop <= start:
+            return {}
+        wanted = np.arange(start, stop)
+        held = np.frombuffer(self.frames, dtype=np.int64)[wanted % self.capacity]
+        return {int(f): self.ids[f % self.capacity] for f in wanted[held == wanted]}
+
+    def frames_held(self):
+        frames = np.frombuffer(self.frames, dtype=np.int64)
+        return np.sort(frames[frames >= 0]).tolist()
+
+
+def splitKey(key):
+    ''' (prefix, frame) for names ending in a frame number, e.g.
+        'acq_raw12' -> ('acq_raw', 12); (name, None) for other names
+    '''
+    if isinstance(key, tuple):
+        return key
+    prefix = key.rstrip('0123456789')
+    digits = key[len(prefix):]
+    if not prefix or not digits or (digits[0] == '0' and len(digits) > 1):
+        return key, None
+    return prefix, int(digits)
+
+
+class EvictionPolicy():
+    ''' Lifetime rule for the objects a Limbo puts under one name prefix.
+        Only the Limbo that put an object evicts it.
+        keep_last: keep the N newest objects
+        ttl: delete objects older than this many seconds
+        lru: keep the N most recently used objects (put or read
+            through the owning Limbo)
+    '''
+    def __init__(self, prefix, keep_last=None, ttl=None, lru=None):
+        if keep_last is not None and lru is not None:
+            raise ValueError('Eviction for {}: use keep_last or lru, not both'.format(prefix))
+        self.prefix = prefix
+        self.limit = keep_last if keep_last is not None else lru
+        self.ttl = ttl
+        self.lru = lru is not None
+        self.entries = OrderedDict()  # object id: (stored key, time put), least recent first
+
+    def add(self, obj_id, key):
+        self.entries[obj_id] = (key, time.time())
+
+    def touch(self, obj_id):
+        if self.lru and obj_id in self.entries:
+            self.entries.move_to_end(obj_id)
+
+    def release(self, obj_id):
+        return self.entries.pop(obj_id, None)
+
+    def restore(self, obj_id, entry):
+        ''' Put back a released entry, as the least recent
+        '''
+        self.entries[obj_id] = entry
+        self.entries.move_to_end(obj_id, last=False)
+
+    def expired(self, now):
+        ''' Remove and return (id, stored key) of the objects to evict
+        '''
+        out = []
+        while self.limit is not None and len(self.entries) > self.limit:
+            obj_id, (key, _) = self.entries.popitem(last=False)
+            out.append((obj_id, key))
+        if self.ttl is not None:
+            for obj_id, (key, t) in list(self.entries.items()):
+                if now - t > self.ttl:
+                    del self.entries[obj_id]
+                    out.append((obj_id, key))
+                elif not self.lru:
+                    break  # in put order, the rest are newer
+        return out
+
+
+class SharedLimbo(Limbo):
+    ''' Limbo backed by the shared memory store (improv.shm_store)
+        instead of Plasma. Same put/get/getID/getList semantics;
+        arrays are returned as read-only views into shared memory.
+    '''
+
+    def connectStore(self, store_loc):
+        ''' Connect to the shared memory store at store_loc
+            Raises exception if can't connect
+        '''
+        try:
+            self.client = shm_store.connect(store_loc, 20)
+            logger.info('Successfully connected to store')
+        except Exception as e:
+            logger.exception('Cannot connect to store: {0}'.format(e))
+            raise CannotConnectToStoreError(store_loc)
+        return self.client
+
+    def random_ObjectID(self, number=1):
+        return [shm_store.ObjectID.from_random() for i in range(number)]
+
+    def _clientID(self, obj_id):
+        return obj_id
+
+    def subscribe(self, prefixes=None):
+        ''' Subscribe to objects put under any of the name prefixes
+            (e.g. 'acq_raw'), or to all objects.
+            Returns a shm_store.Subscription yielding
+            (name, frame, object_id) as objects are sealed; blocking,
+            select-able and async-iterable. notify reads the latest one
+        '''
+        self.subscription = self.client.subscribe(prefixes)
+        return self.subscription
+
+    def notify(self, timeout=None):
+        ''' Next (name, frame, object_id) from the latest subscription,
+            or None if nothing is put within timeout seconds
+        '''
+        return self.subscription.next(timeout)
+
+    def sealedSince(self, seq, limit=None, timeout=0):
+        ''' Objects sealed in the store (by any client) after sequence
+            number seq, oldest first; 0 gives everything still logged.
+            Waits up to timeout seconds if there are none yet.
+            Returns (cursor, ids); pass cursor back to continue
+        '''
+        cursor, missed, ids = self.client.sealed_since(seq, limit, int(timeout*1000))
+        if missed:
+            logger.warning('{} objects sealed after {} are no longer logged'.format(missed, seq))
+        return cursor, ids
+
+    def _putObject(self, obj, object_name, frame):
+        return self.client.put(obj, name=object_name, frame=frame)
+
+    def typeOf(self, obj_id):
+        name = None if isinstance(obj_id, RingRef) else self.client.name(obj_id)
+        return None if name is None else splitKey(name)[0]
+
+    def _snapshotObjects(self, snap, objects):
+        ''' Copy segments to the snapshot as they are, without unpickling
+        '''
+        segments = self.client.get_segments([obj_id for obj_id, _, _ in objects], 0)
+        for (obj_id, name, frame), segment in zip(objects, segments):
+            if segment is not None:
+                snap.addSegment(obj_id.binary(), name, frame, segment)
+
+    def _restoreObject(self, snap, entry):
+        ''' Copy the segment back as it is, without unpickling
+        '''
+        return self.client.put_segment(snap.segment(entry), shm_store.ObjectID(entry.object_id),
+                                       entry.name, entry.frame)
+
+
+class RemoteLimbo(Limbo):
+    ''' Limbo for a store on another host, served by improv.store_proxy.
+        store_loc is the proxy's 'host:port'. Same put/get/getID/getList
+        semantics as SharedLimbo; fetched objects are cached locally
+        (cache_bytes) and come back read-only. Frame rings can be read
+        but only created on the store host.
+        authkey: the proxy's secret key; by default IMPROV_STORE_KEY
+    '''
+    def __init__(self, *args, cache_bytes=256*2**20, authkey=None, **kwargs):
+        self.cache_bytes = cache_bytes
+        self.authkey = authkey
+        super().__init__(*args, **kwargs)
+
+    def connectStore(self, store_loc):
+        ''' Connect to the store proxy at store_loc
+            Raises exception if can't connect
+        '''
+        try:
+            self.client = store_proxy.connect(store_loc, self.cache_bytes, 20, self.authkey)
+            logger.info('Successfully connected to store proxy')
+        except Exception as e:
+            logger.exception('Cannot connect to store proxy: {0}'.format(e))
+            raise CannotConnectToStoreError(store_loc)
+        return self.client
+
+    def random_ObjectID(self, number=1):
+        return [shm_store.ObjectID.from_random() for i in range(number)]
+
+    def _clientID(self, obj_id):
+        return obj_id
+
+    def createRing(self, object_name, shape, dtype, capacity):
+        raise NotImplementedError('Frame rings can only be created on the store host')
+
+    def flush(self):
+        ''' Wait until every put so far has reached the store
+        '''
+        self.client.flush()
+
+    def _ring(self, name):
+        ring = self.rings.get(name)
+        if ring is None:
+            ring = self.client.ring(name)
+            self.rings[name] = ring
+        return ring
+
+    def _putObject(self, obj, object_name, frame):
+        return self.client.put(obj, name=object_name, frame=frame)
+
+    def _restoreObject(self, snap, entry):
+        return self.client.put(snap.value(entry), shm_store.ObjectID(entry.object_id),
+                               entry.name, entry.frame)
 
 
 class LMDBStore(StoreInterface):
 
     def __init__(self, path='output/', name=None, max_size=1e12,
-                 flush_immediately=False, commit_freq=20, from_limbo=False):
+                 flush_immediately=False, commit_freq=20, from_limbo=False,
+                 commit_interval=1.0, commit_bytes=64000000, queue_size=1000,
+                 max_types=127, codecs=None):
         '''
         Constructor for LMDB store
         path: Path to LMDB folder.
@@ -284,8 +988,23 @@ class LMDBStore(StoreInterface):
             If the database grows larger than map_size, a MapFullError will be raised.
             On 64-bit there is no penalty for making this huge. Must be <2GB on 32-bit.
         flush_immediately: Save objects to disk immediately
-        commit_freq: If not flush_immediately, flush data to disk every _ puts.
+        commit_freq: If not flush_immediately, commit to disk every _ puts,
+        commit_interval: or every _ seconds,
+        commit_bytes: or once _ bytes of pickled objects are pending.
         from_limbo: If instantiated from Limbo. Enables object ID functionality.
+        queue_size: Puts waiting for the writer thread before put blocks.
+        max_types: Maximum number of object types (name prefixes).
+        codecs: dict of object type: compression codec, see improv.compression.
+            Other types are stored uncompressed.
+
+        Objects are pickled and written by a background thread; put only
+        enqueues a reference, so objects must not be modified after put.
+        The thread starts on first use in each process, so a store made
+        before forking the actors also writes from the actors.
+
+        Each object type (name without its frame number, e.g. 'acq_raw')
+        gets a named sub-database, keyed by LMDB_KEY (type id, frame
+        number, timestamp) so records sort by frame; see LMDBReader.
         '''
 
         import lmdb
@@ -300,22 +1019,39 @@ class LMDBStore(StoreInterface):
             raise FileExistsError('LMDB of the same name already exists.')
 
         self.flush_immediately = flush_immediately
-        self.lmdb_env = lmdb.open(path + name, map_size=max_size, sync=flush_immediately)
-        self.lmdb_commit_freq = commit_freq
-        self.lmdb_obj_id_to_key = {}  # Can be name or key, depending on from_limbo
-        self.lmdb_put_cache = {}
+        self.lmdb_env = lmdb.open(path + name, map_size=int(max_size), sync=flush_immediately,
+                                  max_dbs=max_types+1)
+        self.types_db = self.lmdb_env.open_db(LMDB_TYPES_DB)
+        self.max_types = max_types
+        self.codecs = {t: checkCodec(c) for t, c in (codecs or {}).items()}
+        self.types = {}  # type name: type id
+        self.dbs = {}  # type id: sub-database, opened by the writer thread
+        self.lmdb_commit_freq = 1 if flush_immediately else commit_freq
+        self.lmdb_commit_interval = commit_interval
+        self.lmdb_commit_bytes = commit_bytes
+        self.lmdb_obj_id_to_key = {}  # Can be name or key, depending on from_limbo; to (type id, key)
         self.from_limbo = from_limbo
 
+        self.queue_size = queue_size
+        self.queue = None
+        self.writer = None
+        self.writer_pid = None  # process the writer thread runs in
+
     def get(self, obj_name_or_id):
         ''' Get object from object name (!from_limbo) or ID (from_limbo).
             Return None if object is not found.
         '''
-
-        with self.lmdb_env.begin() as txn:
-            get_key = self.lmdb_obj_id_to_key[obj_name_or_id]
+        get_key = self.lmdb_obj_id_to_key.get(obj_name_or_id)
+        if get_key is None:
+            return None
+        self.drain()  # it may still be waiting to be written
+        type_id, get_key = get_key
+        if type_id not in self.dbs:
+            return None
+        with self.lmdb_env.begin(db=self.dbs[type_id]) as txn:
             r = txn.get(get_key)
             if r is not None:
-                return pickle.loads(r)
+                return decodeRecord(r, copy=True)
             else:
                 return None
 
@@ -323,40 +1059,55 @@ class LMDBStore(StoreInterface):
         '''
         Put object ID / object pair into LMDB.
         obj: Object to be saved
-        save: For storage of critical objects.
+        obj_name: Name, or (type, frame) key as in Limbo.stored
+        save: For storage of critical objects; written and synced
+            to disk without waiting for the rest of the batch.
         '''
-
-        put_key: bytes = b''.join([obj_name.encode(), pickle.dumps(time.time())])
+        obj_type, frame = splitKey(obj_name)
+        type_id = self.types.get(obj_type)
+        if type_id is None:
+            if len(self.types) >= self.max_types:
+                raise ValueError('LMDBStore holds at most {} object types'.format(self.max_types))
+            type_id = self.types[obj_type] = len(self.types)
+        put_key = LMDB_KEY.pack(type_id, LMDB_NO_FRAME if frame is None else frame, time.time())
 
         if self.from_limbo:
-            self.lmdb_obj_id_to_key[obj_id] = put_key
+            self.lmdb_obj_id_to_key[obj_id] = (type_id, put_key)
         else:
-            self.lmdb_obj_id_to_key[obj_name] = put_key
+            self.lmdb_obj_id_to_key[obj_name] = (type_id, put_key)
 
-        self.lmdb_put_cache[put_key] = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
-
-        if len(self.lmdb_put_cache) > self.lmdb_commit_freq or (self.flush_immediately or save):
-            with self.lmdb_env.begin(write=True) as txn:
-                for key, value in self.lmdb_put_cache.items():
-                    txn.put(key, value, overwrite=True)
-
-            self.lmdb_put_cache = {}
-
-            if save:
-                self.lmdb_env.sync()
+        self._startWriter()
+        self.queue.put((type_id, obj_type, put_key, obj, save))
 
     def delete(self, obj_id):
         ''' Delete object from LMDB.
         '''
-        with self.lmdb_env.begin(write=True) as txn:
-            out = txn.pop(self.lmdb_obj_id_to_key[obj_id])
+        self.drain()
+        type_id, key = self.lmdb_obj_id_to_key[obj_id]
+        out = None
+        if type_id in self.dbs:
+            with self.lmdb_env.begin(write=True, db=self.dbs[type_id]) as txn:
+                out = txn.pop(key)
         if out is None:
             raise ObjectNotFoundError(obj_id_or_name = obj_id)
 
+    def drain(self):
+        ''' Block until everything put so far is committed to the LMDB
+        '''
+        if self.writer_pid != os.getpid():
+            return  # nothing put in this process yet
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
     def flush(self):
         ''' Must run before exiting.
             Flushes buffer to disk.
         '''
+        if self.writer_pid == os.getpid():
+            self.queue.put(None)
+            self.writer.join()
+            self.writer_pid = None
         self.lmdb_env.sync()
         self.lmdb_env.close()
         print('Flushed!')
@@ -365,6 +1116,171 @@ class LMDBStore(StoreInterface):
 
     def subscribe(self): pass #TODO
 
+    def _startWriter(self):
+        ''' Start the writer thread unless it runs in this process.
+            A forked child inherits the queue but not the thread, so it
+            gets its own, leaving the parent's pending puts to the parent
+        '''
+        if self.writer_pid == os.getpid():
+            return
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.writer = threading.Thread(target=self._write, name='lmdb_writer', daemon=True)
+        self.writer_pid = os.getpid()
+        self.writer.start()
+
+    def _write(self):
+        ''' Writer thread: pickle queued objects and commit them in
+            batches of commit_freq puts, commit_bytes or commit_interval
+            seconds, whichever comes first
+        '''
+        batch, size, sync = {}, 0, False
+        deadline = None
+        barriers = []
+        running = True
+        while running:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except Empty:
+                item = False  # commit interval elapsed
+            if item is None:
+                running = False
+            elif isinstance(item, threading.Event):
+                barriers.append(item)
+            elif item is not False:
+                type_id, obj_type, key, obj, save = item
+                try:
+                    value = encodeRecord(obj, self.codecs.get(obj_type, 'none'))
+                    batch[(type_id, key)] = (obj_type, value)
+                    size += len(value)
+                except Exception as e:
+                    logger.error('Cannot pickle {} for LMDB: {}'.format(obj_type, e))
+                sync = sync or save
+                if deadline is None:
+                    deadline = time.monotonic() + self.lmdb_commit_interval
+            if (not running or barriers or sync or item is False or size >= self.lmdb_commit_bytes
+                    or len(batch) >= self.lmdb_commit_freq):
+                if batch:
+                    self._commit(batch, sync)
+                batch, size, sync = {}, 0, False
+                deadline = None
+                for done in barriers:
+                    done.set()
+                barriers = []
+
+    def _commit(self, batch, sync):
+        try:
+            with self.lmdb_env.begin(write=True) as txn:
+                for (type_id, key), (obj_type, value) in batch.items():
+                    db = self.dbs.get(type_id)
+                    if db is None:
+                        db = self._openType(txn, type_id, obj_type)
+                    txn.put(key, value, overwrite=True, db=db)
+            if sync or self.flush_immediately:
+                self.lmdb_env.sync()
+        except Exception as e:
+            logger.error('LMDB commit of {} objects failed: {}'.format(len(batch), e))
+
+    def _openType(self, txn, type_id, obj_type):
+        ''' Create the sub-database for a new object type and record
+            its type id in the types database
+        '''
+        db = self.lmdb_env.open_db(obj_type.encode(), txn=txn)
+        txn.put(obj_type.encode(), LMDB_TYPE_ID.pack(type_id), db=self.types_db)
+        self.dbs[type_id] = db
+        return db
+
+
+# LMDB record key: type id, frame number, timestamp. Big-endian, so
+# records in a type's sub-database sort by frame, then by time put
+LMDB_KEY = struct.Struct('>HQd')
+LMDB_TYPE_ID = struct.Struct('>H')
+LMDB_NO_FRAME = 2**64 - 1  # frame number for names without one, sorts last
+LMDB_TYPES_DB = b'__types__'  # type name: type id
+
+# LMDB record header: codec id, padded to keep the payload 16-byte aligned
+LMDB_RECORD = struct.Struct('<B15x')
+
+def encodeRecord(obj, codec='none'):
+    ''' LMDB record value: a header naming the codec, then the shared
+        memory store's segment layout (pickle protocol 5 with array
+        buffers stored raw and aligned), so that uncompressed arrays
+        can be read directly from LMDB's memory map.
+        codec compresses the segment, or, for shuffle/delta, encodes a
+        numpy array directly (see improv.compression)
+    '''
+    if isArrayCodec(codec, obj):
+        return LMDB_RECORD.pack(CODEC_IDS[codec]) + encodeArray(obj, codec)
+    if codec in ('shuffle', 'delta'):
+        codec = 'zlib'
+    stream, raws, table, size = shm_store.serialize(obj)
+    buf = bytearray(LMDB_RECORD.size + size)
+    LMDB_RECORD.pack_into(buf, 0, CODEC_IDS[codec])
+    shm_store.writeSegment(memoryview(buf)[LMDB_RECORD.size:], stream, raws, table)
+    if codec == 'none':
+        return buf
+    return buf[:LMDB_RECORD.size] + compress(bytes(buf[LMDB_RECORD.size:]), codec)
+
+def decodeRecord(buf, copy=False):
+    ''' Rebuild an object from encodeRecord's layout. Without copy,
+        uncompressed arrays are read-only views into buf (e.g. an LMDB
+        buffer); decompressed objects are always new memory
+    '''
+    codec = CODECS[LMDB_RECORD.unpack_from(buf, 0)[0]]
+    payload = memoryview(buf)[LMDB_RECORD.size:]
+    if codec in ('shuffle', 'delta'):
+        return decodeArray(payload, codec)
+    if codec != 'none':
+        return shm_store.readSegment(memoryview(bytearray(decompress(payload, codec))), writeable=True)
+    if copy:
+        return shm_store.readSegment(memoryview(bytearray(payload)), writeable=True)
+    return shm_store.readSegment(payload)
+
+
+# Key marking a stored sparse matrix: value is (class name, shape)
+SPARSE_HEADER = '__sparse__'
+
+def encodeSparse(mat):
+    ''' Split a scipy.sparse matrix (CSC/CSR/COO) into a small header
+        plus its typed component arrays, which both store backends
+        write as raw buffers and hand back without copying.
+        Other sparse formats are converted to CSC.
+    '''
+    if mat.format not in ('csc', 'csr', 'coo'):
+        mat = mat.tocsc()
+    header = (type(mat).__name__, tuple(mat.shape))
+    if mat.format == 'coo':
+        return {SPARSE_HEADER: header, 'data': mat.data, 'row': mat.row, 'col': mat.col}
+    return {SPARSE_HEADER: header, 'data': mat.data, 'indices': mat.indices, 'indptr': mat.indptr}
+
+def decodeSparse(res):
+    ''' Rebuild a sparse matrix stored by encodeSparse around the
+        stored arrays (no copy). Anything else is returned unchanged.
+    '''
+    if not (isinstance(res, dict) and SPARSE_HEADER in res):
+        return res
+    name, shape = res[SPARSE_HEADER]
+    clss = getattr(scipy.sparse, name)
+    if 'row' in res:
+        return clss((res['data'], (res['row'], res['col'])), shape=shape, copy=False)
+    return clss((res['data'], res['indices'], res['indptr']), shape=shape, copy=False)
+
+
+# Key marking a bundle written by Limbo.putMany
+BUNDLE_HEADER = '__bundle__'
+
+def decodeBundle(res):
+    ''' Strip the bundle marker and rebuild any sparse members
+    '''
+    return {name: decodeSparse(obj) for name, obj in res.items() if name != BUNDLE_HEADER}
+
+def decodeObject(res):
+    ''' Undo the encoding Limbo.put/putMany applied, if any
+    '''
+    if isinstance(res, dict) and BUNDLE_HEADER in res:
+        return decodeBundle(res)
+    return decodeSparse(res)
+
 
 def saveObj(obj, name):
     with open('/media/hawkwings/Ext Hard Drive/dump/dump'+str(name)+'.pkl', 'wb') as output:
@@ -386,6 +1302,17 @@ class ObjectNotFoundError(Exception):
     def __str__(self):
         return self.message
 
+class FrameOverrunError(ObjectNotFoundError):
+    ''' Raised when a ring slot was overwritten before (or while)
+        a consumer read its frame
+    '''
+    def __init__(self, ref):
+
+        super().__init__(ref)
+
+        self.name = 'FrameOverrunError'
+        self.message = 'Frame {} in ring slot {} was overwritten'.format(ref.seq, ref.slot)
+
 class CannotGetObjectError(Exception):
 
     def __init__(self, query):
@@ -414,26 +1341,34 @@ class CannotConnectToStoreError(Exception):
         return self.message
 
 class Watcher():
-    ''' Monitors the store as separate process
+    ''' Monitors the store as separate process and saves every object
+        put in it, in the order they were sealed. Keeps a cursor (the
+        sequence number of the last object saved) and asks the store
+        only for objects sealed after it, so each pass costs the number
+        of new objects, not the store size. Plasma does not number
+        objects, so there the Watcher lists the whole store each pass
+        and saves the ids it has not saved before
         TODO: Facilitate Watcher being used in multiple processes (shared list)
     '''
-    def __init__(self, name, client):
+    def __init__(self, name, client, path='output/watcher/', batch=1000):
         self.name = name
         self.client = client
         self.flag = False
-        self.saved_ids = []
-
-        self.client.subscribe()
+        self.path = path
+        self.batch = batch
+        self.cursor = 0
         self.n = 0
+        self.saved_ids = set()  # plasma only
 
     def setLinks(self, links):
         self.q_sig = links
 
     def run(self):
+        os.makedirs(self.path, exist_ok=True)
         while True:
             if self.flag:
                 try:
-                    self.checkStore2()
+                    self.checkStore()
                 except Exception as e:
                     logger.error('Watcher exception during run: {}'.format(e))
                     #break
@@ -454,36 +1389,43 @@ class Watcher():
             except Empty as e:
                 pass #no signal from Nexus
 
-    # def checkStore(self):
-    #     notification_info = self.client.notify()
-    #     recv_objid, recv_dsize, recv_msize = notification_info
-    #     obj = self.client.getID(recv_objid)
-    #     try:
-    #         self.saveObj(obj)
-    #         self.n += 1
-    #     except Exception as e:
-    #         logger.error('Watcher error: {}'.format(e))
-
     def saveObj(self, obj, name):
-        with open('/media/hawkwings/Ext Hard Drive/dump/dump'+name+'.pkl', 'wb') as output:
+        with open(os.path.join(self.path, 'dump'+name+'.pkl'), 'wb') as output:
             pickle.dump(obj, output)
 
-    def checkStore2(self):
-        objs = list(self.client.get_all().keys())
-        ids_to_save = list(set(objs) - set(self.saved_ids))
-
-        # with Pool() as pool:
-        #     saved_ids = pool.map(saveObjbyID, ids_to_save)
-        # print('Saved :', len(saved_ids))
-        # self.saved_ids.extend(saved_ids)
-
-        for id in ids_to_save:
-            self.saveObj(self.client.getID(id), str(id))
-            self.saved_ids.append(id)
-
-# def saveObjbyID(id):
-#     client = plasma.connect('/tmp/store')
-#     obj = client.get(id)
-#     with open('/media/hawkwings/Ext\ Hard\ Drive/dump/dump'+str(id)+'.pkl', 'wb') as output:
-#         pickle.dump(obj, output)
-#     return id
+    def checkStore(self, timeout=0.005):
+        ''' Save the objects sealed since the last pass, up to batch of
+            them, waiting up to timeout seconds for new ones.
+            Objects deleted before we got to them are skipped
+            Returns the number saved
+        '''
+        try:
+            cursor, ids = self.client.sealedSince(self.cursor, self.batch, timeout)
+        except NotImplementedError:
+            return self._scanStore(timeout)
+        saved = self._save(ids)
+        self.cursor = cursor
+        return saved
+
+    def _scanStore(self, timeout):
+        ''' checkStore for stores that do not number objects: save up
+            to batch of the listed objects not saved before
+        '''
+        ids = [i for i in self.client.get_all() if i not in self.saved_ids][:self.batch]
+        if not ids:
+            time.sleep(timeout)
+            return 0
+        self.saved_ids.update(ids)
+        return self._save(ids)
+
+    def _save(self, ids):
+        saved = 0
+        for id in ids:
+            try:
+                obj = self.client.getID(id)
+            except ObjectNotFoundError:
+                continue
+            self.saveObj(obj, id.binary().hex())
+            saved += 1
+        self.n += saved
+        return saved
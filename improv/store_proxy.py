@@ -0,0 +1,448 @@
+''' TCP proxy for the store, so actors can run on other hosts.
+
+    StoreProxy runs next to the store and serves put/get/list/delete
+    requests from ProxyClients (used through store.RemoteLimbo) over TCP,
+    each connection with its own local store client. Messages use the
+    shared-memory segment layout (see shm_store.serialize) behind a length
+    prefix, so arrays are sent straight from the store's memory and come
+    back as read-only views of the receive buffer, without pickling the
+    array data.
+
+    Messages are unpickled, so both ends first prove they hold the same
+    secret key (multiprocessing.connection's HMAC challenge, both ways)
+    before any message is decoded. The key comes from the IMPROV_STORE_KEY
+    environment variable unless given; set it to the same value on every
+    host. The proxy serves on localhost unless told otherwise: serve on
+    another interface only on a trusted network.
+
+    Requests are pipelined: puts return as soon as they are sent (a failed
+    put raises its error from the next call or flush) and getList sends one request
+    per object before reading any reply. Objects are immutable once put,
+    so each client keeps a bounded LRU cache of objects it has fetched.
+
+    Run next to the store with:
+        $ IMPROV_STORE_KEY=<secret> python -m improv.store_proxy -s /tmp/store -b shared_memory -a 10.0.0.5:5555
+'''
+import os
+import sys
+import time
+import signal
+import socket
+import struct
+import argparse
+import threading
+from collections import OrderedDict
+from multiprocessing.connection import deliver_challenge, answer_challenge, AuthenticationError
+
+from improv import shm_store
+from improv.shm_store import (ObjectID, ObjectNotAvailable, ObjectExistsError, StoreFullError,
+                              serialize, readSegment, _HEADER, _BUFFER)
+from improv.ring import FrameRing
+
+import logging; logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_LENGTH = struct.Struct('<Q')
+_SMALL = 1 << 16  # messages up to this size are sent with a single copy
+_ZEROS = bytes(shm_store._ALIGN)
+KEY_VARIABLE = 'IMPROV_STORE_KEY'
+DEFAULT_ADDRESS = ('127.0.0.1', 5555)
+_ERRORS = {'ObjectExistsError': ObjectExistsError, 'PlasmaObjectExists': ObjectExistsError,
+           'StoreFullError': StoreFullError}
+
+
+def parseAddress(address):
+    ''' 'host:port' or (host, port) to (host, port)
+    '''
+    if isinstance(address, str):
+        host, _, port = address.rpartition(':')
+        return (host or 'localhost', int(port))
+    return tuple(address)
+
+
+def authKey(authkey=None):
+    ''' authkey as bytes, or the key in the IMPROV_STORE_KEY environment
+        variable. Raises ValueError if there is none
+    '''
+    if authkey is None:
+        authkey = os.environ.get(KEY_VARIABLE)
+    if not authkey:
+        raise ValueError('The store proxy needs a secret key: set {} to the same value '
+                         'on every host'.format(KEY_VARIABLE))
+    return authkey.encode() if isinstance(authkey, str) else bytes(authkey)
+
+
+class _Handshake():
+    ''' The send_bytes/recv_bytes that the multiprocessing.connection
+        challenges use, as raw length-prefixed bytes over the socket
+    '''
+    def __init__(self, sock, rfile):
+        self.sock = sock
+        self.rfile = rfile
+
+    def send_bytes(self, buf):
+        self.sock.sendall(_LENGTH.pack(len(buf)) + buf)
+
+    def recv_bytes(self, maxlength):
+        size = _LENGTH.unpack(_readExactly(self.rfile, bytearray(_LENGTH.size)))[0]
+        if size > maxlength:
+            raise AuthenticationError('handshake message too long')
+        return bytes(_readExactly(self.rfile, bytearray(size)))
+
+
+def sendMessage(sock, value):
+    ''' Send value as a length-prefixed segment. Buffers over _SMALL
+        bytes in total are sent from their own memory
+    '''
+    stream, raws, table, size = serialize(value)
+    head_len = table[0][0] if table else size
+    head = bytearray(_LENGTH.size + (size if size <= _SMALL else head_len))
+    _LENGTH.pack_into(head, 0, size)
+    view = memoryview(head)[_LENGTH.size:]
+    _HEADER.pack_into(view, 0, len(stream), len(raws))
+    pos = _HEADER.size
+    for entry in table:
+        _BUFFER.pack_into(view, pos, *entry)
+        pos += _BUFFER.size
+    view[pos:pos+len(stream)] = stream
+    if size <= _SMALL:
+        for (offset, length), raw in zip(table, raws):
+            view[offset:offset+length] = raw
+        sock.sendall(head)
+        return
+    sock.sendall(head)
+    pos = head_len
+    for (offset, length), raw in zip(table, raws):
+        if offset > pos:
+            sock.sendall(_ZEROS[:offset-pos])
+        sock.sendall(raw)
+        pos = offset + length
+
+
+def recvMessage(rfile):
+    ''' Read one message from a binary file over the socket.
+        Returns the value and its size in bytes
+    '''
+    size = _LENGTH.unpack(_readExactly(rfile, bytearray(_LENGTH.size)))[0]
+    body = _readExactly(rfile, bytearray(size))
+    return readSegment(memoryview(body)), size
+
+
+def _readExactly(rfile, buf):
+    view = memoryview(buf)
+    while view:
+        n = rfile.readinto(view)
+        if not n:
+            raise EOFError('Store proxy connection closed')
+        view = view[n:]
+    return buf
+
+
+class StoreProxy():
+    ''' Serves the store at store_loc on a TCP address, one thread
+        and one store client per connection, to clients holding authkey
+        (see authKey). backend is 'shared_memory' or 'plasma'
+    '''
+    def __init__(self, address=DEFAULT_ADDRESS, store_loc='/tmp/store', backend='shared_memory',
+                 authkey=None):
+        self.address = parseAddress(address)
+        self.store_loc = store_loc
+        self.backend = backend
+        self.authkey = authKey(authkey)
+
+    def serve(self):
+        ''' Accept connections until terminated
+        '''
+        listener = socket.create_server(self.address)
+        logger.info('Store proxy for {} listening on {}'.format(self.store_loc, self.address))
+        try:
+            while True:
+                sock, peer = listener.accept()
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                threading.Thread(target=self._serveClient, args=(sock, peer), daemon=True).start()
+        finally:
+            listener.close()
+
+    def _connect(self):
+        if self.backend == 'plasma':
+            import pyarrow.plasma as plasma
+            return plasma.connect(self.store_loc, 20), plasma.ObjectID
+        return shm_store.connect(self.store_loc, 20), ObjectID
+
+    def _serveClient(self, sock, peer):
+        rfile = sock.makefile('rb')
+        try:
+            handshake = _Handshake(sock, rfile)
+            deliver_challenge(handshake, self.authkey)
+            answer_challenge(handshake, self.authkey)
+        except Exception as e:
+            logger.warning('Store proxy refused {}: {}'.format(peer, e))
+            rfile.close()
+            sock.close()
+            return
+        client, makeID = self._connect()
+        rings = {}
+
+        def ring(name):
+            if name not in rings:
+                rings[name] = FrameRing.attach(name)
+            return rings[name]
+
+        def put(binary, value, name, frame):
+            if self.backend == 'plasma':
+                client.put(value, makeID(binary))
+            else:
+                client.put(value, makeID(binary), name, frame)
+
+        def get(binaries, timeout_ms):
+            res = client.get([makeID(b) for b in binaries], timeout_ms)
+            return [None if isinstance(r, type) else (r,) for r in res]
+
+        ops = {'put': put, 'get': get,
+               'contains': lambda binary: client.contains(makeID(binary)),
+               'delete': lambda binaries: client.delete([makeID(b) for b in binaries]),
+               'list': lambda: {i.binary(): info for i, info in client.list().items()},
+               'stats': lambda: client.stats(),
+               'frame': lambda ref: ring(ref.name).copy(ref),
+               'valid': lambda ref: bool(ring(ref.name).valid(ref))}
+
+        logger.info('Store proxy client connected from {}'.format(peer))
+        try:
+            while True:
+                try:
+                    request, _ = recvMessage(rfile)
+                except (EOFError, OSError):
+                    break
+                try:
+                    reply = ('ok', ops[request[0]](*request[1:]))
+                except Exception as e:
+                    reply = ('error', type(e).__name__, str(e))
+                sendMessage(sock, reply)
+        except OSError as e:
+            logger.info('Store proxy client {} dropped: {}'.format(peer, e))
+        finally:
+            rfile.close()
+            sock.close()
+            for r in rings.values():
+                r.close()
+            client.disconnect()
+
+
+class ProxyClient():
+    ''' Client for StoreProxy exposing the SharedMemoryClient calls
+        that Limbo relies on, with a local cache of fetched objects.
+        cache_bytes: size of the read cache; 0 disables it
+        max_pending: puts sent before their replies are read
+        authkey: as for StoreProxy (see authKey)
+    '''
+    def __init__(self, address, cache_bytes=256*2**20, max_pending=256, authkey=None):
+        self.address = parseAddress(address)
+        authkey = authKey(authkey)
+        self.sock = socket.create_connection(self.address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile('rb')
+        try:
+            handshake = _Handshake(self.sock, self.rfile)
+            answer_challenge(handshake, authkey)
+            deliver_challenge(handshake, authkey)
+        except Exception:
+            self.rfile.close()
+            self.sock.close()
+            raise
+        self.lock = threading.Lock()
+        self.pending = 0  # requests sent whose replies are unread
+        self.put_error = None  # first failed pipelined put, not yet raised
+        self.max_pending = max_pending
+        self.cache = OrderedDict()  # id binary: (value, size)
+        self.cache_bytes = cache_bytes
+        self.cached = 0
+
+    def _send(self, *request):
+        sendMessage(self.sock, request)
+        self.pending += 1
+
+    def _reply(self):
+        reply, size = recvMessage(self.rfile)
+        self.pending -= 1
+        return reply, size
+
+    def _drain(self, keep=0):
+        ''' Read replies to pipelined puts, leaving keep unread
+        '''
+        while self.pending > keep:
+            reply, _ = self._reply()
+            if reply[0] == 'error':
+                logger.error('Remote put failed: {}: {}'.format(*reply[1:]))
+                if self.put_error is None:
+                    self.put_error = _ERRORS.get(reply[1], IOError)(
+                        'Earlier put failed: {}: {}'.format(*reply[1:]))
+
+    def _raisePutError(self):
+        error, self.put_error = self.put_error, None
+        if error is not None:
+            raise error
+
+    def _request(self, *request):
+        with self.lock:
+            self._drain()
+            self._raisePutError()
+            self._send(*request)
+            reply, size = self._reply()
+        return self._result(reply), size
+
+    @staticmethod
+    def _result(reply):
+        if reply[0] == 'error':
+            raise _ERRORS.get(reply[1], IOError)('{}: {}'.format(*reply[1:]))
+        return reply[1]
+
+    def put(self, value, object_id=None, name=None, frame=None):
+        ''' Send value to the store without waiting for the reply.
+            Returns the ObjectID. Raises the error of an earlier put
+            that failed, without sending this one
+        '''
+        if object_id is None:
+            object_id = ObjectID.from_random()
+        with self.lock:
+            self._raisePutError()
+            self._send('put', object_id.binary(), value, name, frame)
+            if self.pending > self.max_pending:
+                self._drain()
+        return object_id
+
+    def get(self, object_ids, timeout_ms=0):
+        ''' Get one object or a list of objects, from the cache if
+            fetched before, waiting up to timeout_ms for each (-1 for
+            ever). Missing objects come back as ObjectNotAvailable
+        '''
+        if not isinstance(object_ids, (list, tuple)):
+            return self.get([object_ids], timeout_ms)[0]
+        missing = [i.binary() for i in object_ids if i.binary() not in self.cache]
+        found = {}
+        if missing:
+            with self.lock:
+                self._drain()
+                self._raisePutError()
+                for binary in missing:
+                    self._send('get', [binary], timeout_ms)
+                replies = [self._reply() for _ in missing]
+            for binary, (reply, size) in zip(missing, replies):
+                res = self._result(reply)[0]
+                if res is not None:
+                    found[binary] = res[0]
+                    self._cache(binary, res[0], size)
+        results = []
+        for i in object_ids:
+            binary = i.binary()
+            if binary in found:
+                results.append(found[binary])
+            elif binary in self.cache:
+                self.cache.move_to_end(binary)
+                results.append(self.cache[binary][0])
+            else:
+                results.append(ObjectNotAvailable)
+        return results
+
+    def contains(self, object_id):
+        return self._request('contains', object_id.binary())[0]
+
+    def list(self):
+        return {ObjectID(i): info for i, info in self._request('list')[0].items()}
+
+    def delete(self, object_ids):
+        self._request('delete', [i.binary() for i in object_ids])
+        for i in object_ids:
+            entry = self.cache.pop(i.binary(), None)
+            if entry is not None:
+                self.cached -= entry[1]
+
+    def store_capacity(self):
+        return self.stats()['capacity']
+
+    def stats(self):
+        return self._request('stats')[0]
+
+    def ring(self, name):
+        ''' Stand-in for the frame ring name on the store host
+        '''
+        return _RemoteRing(self, name)
+
+    def flush(self):
+        ''' Wait for replies to all puts sent. Raises the error of the
+            first that failed
+        '''
+        with self.lock:
+            self._drain()
+            self._raisePutError()
+
+    def disconnect(self):
+        try:
+            self.flush()
+        except (EOFError, OSError):
+            pass
+        self.rfile.close()
+        self.sock.close()
+        self.cache.clear()
+        self.cached = 0
+
+    def _cache(self, binary, value, size):
+        if size > self.cache_bytes:
+            return
+        self.cache[binary] = (value, size)
+        self.cached += size
+        while self.cached > self.cache_bytes:
+            _, (_, old) = self.cache.popitem(last=False)
+            self.cached -= old
+
+
+class _RemoteRing():
+    ''' The parts of FrameRing that Limbo uses to resolve RingRefs,
+        served by the proxy. Frames are copied, never cached
+    '''
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def get(self, ref):
+        return self.client._request('frame', ref)[0]
+
+    def valid(self, ref):
+        return self.client._request('valid', ref)[0]
+
+    def close(self):
+        pass
+
+
+def connect(address, cache_bytes=256*2**20, num_retries=20, authkey=None):
+    ''' Connect to a running StoreProxy,
+        retrying while the proxy process starts up
+    '''
+    for i in range(num_retries):
+        try:
+            return ProxyClient(address, cache_bytes, authkey=authkey)
+        except ConnectionRefusedError:
+            if i == num_retries - 1:
+                raise
+            time.sleep(0.1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='improv store proxy')
+    parser.add_argument('-s', dest='store_loc', default='/tmp/store', help='store socket path')
+    parser.add_argument('-b', dest='backend', default='shared_memory', help='shared_memory or plasma')
+    parser.add_argument('-a', dest='address', default='127.0.0.1:5555',
+                        help='host:port to serve on; the key is read from ' + KEY_VARIABLE)
+    args = parser.parse_args(argv)
+
+    def terminate(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, terminate)
+
+    try:
+        StoreProxy(args.address, args.store_loc, args.backend).serve()
+    except (SystemExit, KeyboardInterrupt):
+        pass
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
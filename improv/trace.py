@@ -0,0 +1,194 @@
+''' Per-frame latency tracing across the actor graph.
+
+    Nexus creates a TraceRing per actor process before forking. Links
+    record into the ring of the process they are used from (see attach)
+    three kinds of span for every FrameMessage:
+
+        enqueue: the message is put on a Link, and not dropped by its
+                 policy (start == end == sent)
+        dequeue: from when it was sent to when this actor got it
+        compute: from getting frame n to this actor putting frame n
+
+    Times are time.monotonic_ns(), which is one clock for all processes
+    on the host. A Link stamps the message's sent field on put, so the
+    receiving actor can time the queue wait.
+
+    Each ring is written by one process only, with plain stores and no
+    locks; once full, new spans overwrite the oldest. Nexus merges the
+    rings into one timeline (writeTimeline) when it quits.
+'''
+import os
+import time
+import struct
+from collections import OrderedDict
+from multiprocessing import shared_memory
+import numpy as np
+
+from improv.message import FrameMessage
+from improv.metrics import writeSnapshot
+
+import logging; logger = logging.getLogger(__name__)
+
+SPANS = ('enqueue', 'dequeue', 'compute')
+ENQUEUE, DEQUEUE, COMPUTE = range(3)
+DEFAULT_CAPACITY = 65536  # spans per ring
+PERCENTILES = (50, 90, 99)
+MAX_PENDING = 4096  # frames got but not yet put, per process
+
+_HEADER = struct.Struct('<qq')  # spans written, creating pid
+_WORDS = 4  # per span: frame, kind, start, end
+_SPAN = np.dtype([('frame', '<i8'), ('kind', '<i8'), ('start', '<i8'), ('end', '<i8')])
+
+_ring = None  # this process's TraceRing
+_pending = OrderedDict()  # frame: when this process got it
+
+
+class TraceRing():
+    ''' Spans of one actor process, in a shared memory block.
+        Use TraceRing.create before forking the actor and record() from
+        that actor's process only; spans() from anywhere
+    '''
+    def __init__(self, shm, capacity, owner_pid=None):
+        self.shm = shm
+        self.name = shm.name
+        self.capacity = capacity
+        self.owner_pid = owner_pid
+        self.words = shm.buf.cast('q')
+
+    @staticmethod
+    def create(capacity=DEFAULT_CAPACITY):
+        ''' Allocate a new zeroed ring, unlinked by close() in this
+            process (not in forked children)
+        '''
+        shm = shared_memory.SharedMemory('imt' + os.urandom(8).hex(), create=True,
+                                         size=_HEADER.size + capacity*_SPAN.itemsize)
+        _HEADER.pack_into(shm.buf, 0, 0, os.getpid())
+        return TraceRing(shm, capacity, os.getpid())
+
+    @staticmethod
+    def attach(name, capacity):
+        from improv.shm_store import _openSegment
+        return TraceRing(_openSegment(name), capacity)
+
+    def __reduce__(self):
+        return (TraceRing.attach, (self.name, self.capacity))
+
+    def record(self, kind, frame, start, end):
+        ''' Append a span, overwriting the oldest once full
+        '''
+        w = self.words
+        n = w[0]
+        base = 2 + (n % self.capacity)*_WORDS
+        w[base] = frame
+        w[base+1] = kind
+        w[base+2] = start
+        w[base+3] = end
+        # Publish the span once it is written
+        w[0] = n + 1
+
+    def written(self):
+        ''' Spans recorded so far, including overwritten ones
+        '''
+        return self.words[0]
+
+    def spans(self):
+        ''' Spans still in the ring, oldest first, as a structured array
+            of frame, kind, start, end
+        '''
+        n = self.written()
+        ring = np.frombuffer(self.shm.buf, dtype=_SPAN, offset=_HEADER.size, count=self.capacity)
+        if n <= self.capacity:
+            return ring[:n].copy()
+        return np.roll(ring, -(n % self.capacity))
+
+    def close(self):
+        ''' Unmap the ring; the creating process also unlinks it
+        '''
+        self.words.release()
+        self.shm.close()
+        if self.owner_pid == os.getpid():
+            self.shm.unlink()
+
+
+def attach(ring):
+    ''' Record this process's spans into ring (None to stop tracing)
+    '''
+    global _ring
+    _ring = ring
+    _pending.clear()
+
+
+def put(q, item, block=True, timeout=None):
+    ''' Put item on a Link's queue q (ShmQueue or BroadcastQueue),
+        stamping a FrameMessage and recording it unless q's policy
+        dropped it. Returns the number of items dropped, as q.put
+    '''
+    if _ring is not None and type(item) is FrameMessage:
+        item.sent = time.monotonic_ns()
+    dropped = q.put(item, block, timeout)
+    if not (dropped and q.policy == 'drop-newest'):  # else no consumer gets it
+        _enqueued(item)
+    return dropped
+
+
+def _enqueued(item):
+    ''' Record a FrameMessage stamped and put by put()
+    '''
+    if _ring is None or type(item) is not FrameMessage:
+        return
+    now = item.sent
+    _ring.record(ENQUEUE, item.frame, now, now)
+    got = _pending.pop(item.frame, None)
+    if got is not None:
+        _ring.record(COMPUTE, item.frame, got, now)
+
+
+def dequeued(item):
+    ''' Called by a Link that got item: record a FrameMessage's wait
+    '''
+    if _ring is None or type(item) is not FrameMessage:
+        return
+    now = time.monotonic_ns()
+    _ring.record(DEQUEUE, item.frame, item.sent or now, now)
+    _pending[item.frame] = now
+    _pending.move_to_end(item.frame)
+    if len(_pending) > MAX_PENDING:
+        _pending.popitem(last=False)
+
+
+def timeline(rings):
+    ''' Merge {actor name: TraceRing} into {'stages': {stage: {count,
+        p50_us, p90_us, p99_us, max_us}}, 'spans': [[actor, kind, frame,
+        start_ns, end_ns], ...]}, spans sorted by start. Stages are
+        'actor.kind' for dequeue and compute spans, and 'end_to_end' for
+        the first to the last span of each frame
+    '''
+    stages = {}
+    spans = []
+    first, last = {}, {}
+    for actor, ring in rings.items():
+        s = ring.spans()
+        for kind in (DEQUEUE, COMPUTE):
+            sel = s[s['kind'] == kind]
+            stages[actor + '.' + SPANS[kind]] = _latencies(sel['end'] - sel['start'])
+        for frame, kind, start, end in s.tolist():
+            spans.append([actor, SPANS[kind], frame, start, end])
+            first[frame] = min(first.get(frame, start), start)
+            last[frame] = max(last.get(frame, end), end)
+    stages['end_to_end'] = _latencies(np.array([last[f] - first[f] for f in first], dtype=np.int64))
+    spans.sort(key=lambda span: span[3])
+    return {'stages': stages, 'spans': spans}
+
+
+def writeTimeline(path, rings):
+    ''' Write the merged timeline of rings as JSON to path
+    '''
+    writeSnapshot(path, timeline(rings))
+
+
+def _latencies(ns):
+    out = {'count': int(len(ns))}
+    for q in PERCENTILES:
+        out['p{}_us'.format(q)] = float(np.percentile(ns, q))/1e3 if len(ns) else 0.0
+    out['max_us'] = float(ns.max())/1e3 if len(ns) else 0.0
+    return out
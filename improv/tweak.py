@@ -8,6 +8,26 @@ import logging; logger = logging.getLogger(__name__)
 
 #TODO: Write a save function for Tweak objects output as YAML configFile but using TweakModule objects
 
+# Defaults for the optional settings block of the yaml config
+DEFAULT_SETTINGS = {
+    'use_watcher': None,
+    'store_backend': 'plasma',      # 'plasma' or 'shared_memory'
+    'store_size': 40000000000,      # bytes; 40 GB
+    'store_loc': '/tmp/store',
+    'store_spill_dir': None,        # shared_memory: spill cold objects here when full
+    'store_high_water': 0.9,        # fraction of store_size in use before spilling
+    'store_proxy': None,            # 'host:port' to serve the store on for remote actors (needs IMPROV_STORE_KEY)
+    'eviction': None,               # name prefix: {keep_last: N} | {ttl: s} | {lru: N}
+    'index_size': 65536,            # frames per name prefix kept in Limbo.stored
+    'codecs': None,                 # object type or actor: none | zlib | lzma | shuffle | delta
+    'store_metrics': True,          # record store op latencies per Limbo (Nexus.storeMetrics)
+    'metrics_file': None,           # write a JSON metrics snapshot here periodically
+    'metrics_interval': 10,         # seconds between snapshots
+    'broadcast_policy': 'block',    # one-to-many links without a policy of their own: 'block' or 'drop-oldest'
+    'trace_file': None,             # trace frames through the links; write the timeline here at quit
+    'trace_capacity': 65536,        # spans kept per actor
+}
+
 class Tweak():
     ''' Handles configuration and logs of configs for
         the entire server/processing pipeline.
@@ -24,6 +44,7 @@ class Tweak():
         
         self.actors = {}
         self.connections = {}
+        self.linkOptions = {}  # connection name: {capacity, policy}
         self.hasGUI = False
         
     def createConfig(self):
@@ -33,11 +54,7 @@ class Tweak():
         with open(self.configFile, 'r') as ymlfile:
             cfg = yaml.safe_load(ymlfile)
 
-        if 'settings' in cfg:
-            self.settings = cfg['settings']
-        else:
-            self.settings = {}
-            self.settings['use_watcher'] = None
+        self.settings = self._settings(cfg)
 
         for name,actor in cfg['actors'].items(): 
             # put import/name info in TweakModule object TODO: make ordered?
@@ -80,10 +97,32 @@ class Tweak():
             #TODO check for correctness  TODO: make more generic (not just q_out)
             if name in self.connections.keys():
                 raise RepeatedConnectionsError(name)
+            if isinstance(conn, dict):
+                # {to: [...], capacity: max queued messages, policy: block | drop-oldest | drop-newest | latest-only}
+                self.linkOptions.update({name:{k:v for k,v in conn.items() if k != 'to'}})
+                conn = conn['to']
 
             self.connections.update({name:conn}) #conn should be a list
         
 
+    def loadSettings(self):
+        ''' Read only the settings block of the yaml config file.
+            Used by Nexus before any actor is created, e.g. to start the store
+        '''
+        with open(self.configFile, 'r') as ymlfile:
+            cfg = yaml.safe_load(ymlfile)
+
+        self.settings = self._settings(cfg)
+        return self.settings
+
+    def _settings(self, cfg):
+        ''' Fill in defaults for any setting missing from the config
+        '''
+        settings = dict(DEFAULT_SETTINGS)
+        if cfg.get('settings'):
+            settings.update(cfg['settings'])
+        return settings
+
     def addParams(self, type, param):
         ''' Function to add paramter param of type type
         '''
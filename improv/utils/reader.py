@@ -1,92 +1,183 @@
-import numbers
 import os
-import pickle
-from contextlib import contextmanager
-from typing import Dict, Set
+import heapq
 import lmdb
-from .utils import get_num_length_from_key
+from improv.store import LMDB_KEY, LMDB_TYPE_ID, LMDB_NO_FRAME, LMDB_TYPES_DB, decodeRecord
 
 
 class LMDBReader():
-    def __init__(self, path):
+    ''' Reads recordings written by LMDBStore: one sub-database per
+        object type, keyed by LMDB_KEY (type id, frame number, timestamp),
+        so lookups by type or frame are cursor range scans.
+
+        records() streams records in frame order without loading the
+        recording; values decode lazily, and arrays are read-only views
+        into the LMDB memory map, valid only while iterating (see
+        records). The get_* methods return dicts of copies.
+    '''
+    def __init__(self, path, max_types=127):
         ''' Constructor for the LMDB reader
             path: Path to LMDB folder
+            max_types: As given to LMDBStore
         '''
         if not os.path.exists(path):
             raise FileNotFoundError
         self.path = path
+        self.max_types = max_types
+        self.env = None
+        self.dbs = None  # type name: (type id, sub-database)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        ''' Map the LMDB read-only and load its types. Called as needed
+        '''
+        if self.env is not None:
+            return
+        self.env = lmdb.open(self.path, readonly=True, lock=False, max_dbs=self.max_types+1)
+        types_db = self.env.open_db(LMDB_TYPES_DB, create=False)
+        with self.env.begin() as txn:
+            types = {name.decode(): LMDB_TYPE_ID.unpack(type_id)[0]
+                     for name, type_id in txn.cursor(types_db)}
+        self.dbs = {name: (type_id, self.env.open_db(name.encode(), create=False))
+                    for name, type_id in types.items()}
+
+    def close(self):
+        ''' Unmap the LMDB
+        '''
+        if self.env is not None:
+            self.env.close()
+            self.env = None
+            self.dbs = None
+
+    def records(self, types=None, start=0, stop=None):
+        ''' Iterate over LMDBRecords in frame order (then time put),
+            optionally only for the types listed and for frame numbers
+            start..stop-1. Objects without a frame number come last,
+            and are left out if stop is given.
+            A record's buffer, and arrays in its value, point into the
+            read transaction, which may move on with the next record
+            and ends with the iteration: use each record before taking
+            the next, and copy() what must be kept.
+        '''
+        self.open()
+        if stop is None:
+            stop = LMDB_NO_FRAME + 1
+        with self.env.begin(buffers=True) as txn:
+            scans = [self._scan(txn, name, type_id, db, start, stop)
+                     for name, (type_id, db) in self.dbs.items()
+                     if types is None or name in types]
+            yield from heapq.merge(*scans, key=lambda r: (r._frame, r.timestamp))
 
     def get_all_data(self):
         ''' Load all data from LMDB into a dictionary
             Make sure that the LMDB is small enough to fit in RAM
         '''
-        with LMDBReader._lmdb_cur(self.path) as cur:
-            return {LMDBReader._decode_key(key): pickle.loads(value) for key, value in cur.iternext()}
+        return {r.key: r.copy() for r in self.records()}
 
     def get_data_types(self):
         ''' Return all data types defined as {object_name}, but without number.
         '''
-        num_idx = get_num_length_from_key()
-
-        with LMDBReader._lmdb_cur(self.path) as cur:
-            return {key[:-12 - num_idx.send(key)] for key in cur.iternext(values=False)}
+        self.open()
+        return set(self.dbs)
 
     def get_data_by_number(self, t):
         ''' Return data at a specific frame number t
         '''
-        num_idx = get_num_length_from_key()
-
-        def check_if_key_equals_t(key):
-            try:
-                return True if int(key[-12 - num_idx.send(key): -12]) == t else False
-            except ValueError:
-                return False
+        return self.get_data_by_range(t, t+1)
 
-        with LMDBReader._lmdb_cur(self.path) as cur:
-            keys = (key for key in cur.iternext(values=False) if check_if_key_equals_t(key))
-            return {LMDBReader._decode_key(key): pickle.loads(cur.get(key)) for key in keys}
+    def get_data_by_range(self, start, stop, types=None):
+        ''' Return data for frame numbers start..stop-1,
+            of all types or of the types listed
+        '''
+        return {r.key: r.copy() for r in self.records(types, start, stop)}
 
     def get_data_by_type(self, t):
         ''' Return data with key that starts with t
         '''
-        with LMDBReader._lmdb_cur(self.path) as cur:
-            keys = (key for key in cur.iternext(values=False) if key.startswith(t.encode()))
-            return {LMDBReader._decode_key(key): pickle.loads(cur.get(key)) for key in keys}
+        types = [name for name in self.get_data_types() if name.startswith(t)]
+        return {r.key: r.copy() for r in self.records(types)}
 
     def get_params(self):
         ''' Return parameters in a dictionary
         '''
-        with LMDBReader._lmdb_cur(self.path) as cur:
-            keys = [key for key in cur.iternext(values=False) if key.startswith(b'params_dict')]
-            return pickle.loads(cur.get(keys[-1]))
+        self.open()
+        with self.env.begin() as txn:
+            with txn.cursor(self.dbs['params_dict'][1]) as cur:
+                cur.last()
+                return decodeRecord(cur.value(), copy=True)
+
+    @staticmethod
+    def _scan(txn, name, type_id, db, start, stop):
+        ''' Records of one type with frame numbers in [start, stop)
+        '''
+        with txn.cursor(db) as cur:
+            if not cur.set_range(LMDB_KEY.pack(type_id, start, 0.0)):
+                return
+            for key, value in cur:
+                record = LMDBRecord(name, key, value)
+                if record._frame >= stop:
+                    break
+                yield record
 
     @staticmethod
-    def _decode_key(key):
-        ''' Helper method to convert key from byte to str
+    def _decode_key(name, key):
+        ''' Helper method to convert key from bytes to str
 
         Example:
-            >>> LMDBReader._decode_key(b'Call0\x80\x03GA\xd7Ky\x06\x9c\xddi.')
+            >>> LMDBReader._decode_key('Call', LMDB_KEY.pack(3, 0, 1563288602.4510138))
             'Call0_1563288602.4510138'
 
-        key: Encoded key. The last 12 bytes are pickled time.time(). 
-            The remaining are encoded object name.
+        name: Type (sub-database) name
+        key: LMDB_KEY packed type id, frame number and time.time()
         '''
+        _, frame, timestamp = LMDB_KEY.unpack(key)
+        if frame == LMDB_NO_FRAME:
+            return f'{name}_{timestamp}'
+        return f'{name}{frame}_{timestamp}'
+
+
+class LMDBRecord():
+    ''' One record from LMDBReader.records(). The value is decoded
+        on first access, which must be before the next record is taken.
+    '''
+    __slots__ = ('name', '_key', '_frame', 'timestamp', '_buf', '_value')
+
+    def __init__(self, name, key, buf):
+        self.name = name
+        self._key = bytes(key)
+        _, self._frame, self.timestamp = LMDB_KEY.unpack(self._key)
+        self._buf = buf
+        self._value = None
+
+    @property
+    def frame(self):
+        ''' Frame number, or None for objects stored without one
+        '''
+        return None if self._frame == LMDB_NO_FRAME else self._frame
 
-        return f'{key[:-12].decode()}_{pickle.loads(key[-12:])}'
+    @property
+    def key(self):
+        ''' Name as returned by the get_* methods, e.g. 'acq_raw12_1563288602.45'
+        '''
+        return LMDBReader._decode_key(self.name, self._key)
 
-    @staticmethod
-    @contextmanager
-    def _lmdb_cur(path):
-        ''' Helper context manager to open and ensure proper closure of LMDB
+    @property
+    def value(self):
+        ''' The object, with arrays as read-only views into the LMDB
         '''
+        if self._value is None:
+            self._value = decodeRecord(self._buf)
+        return self._value
 
-        env = lmdb.open(path)
-        txn = env.begin()
-        cur = txn.cursor()
-        try:
-            yield cur
+    def copy(self):
+        ''' The object, decoded into independent writeable memory
+        '''
+        return decodeRecord(self._buf, copy=True)
 
-        finally:
-            cur.__exit__()
-            txn.commit()
-            env.close()
+    def __repr__(self):
+        return 'LMDBRecord({})'.format(self.key)
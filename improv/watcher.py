@@ -1,6 +1,5 @@
 from multiprocessing import Process, Queue, Manager, cpu_count, set_start_method
 import numpy as np
-import pyarrow.plasma as plasma
 import asyncio
 import subprocess
 import signal
@@ -11,10 +10,9 @@ import logging; logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 import asyncio
 import concurrent
-from pyarrow.plasma import ObjectNotAvailable
 from improv.actor import Actor, Spike, RunManager, AsyncRunManager
-from improv.store import ObjectNotFoundError
-from pyarrow.plasma import ObjectNotAvailable
+from improv.store import ObjectNotFoundError, splitKey, encodeRecord, decodeRecord
+from improv.compression import checkCodec
 
 class BasicWatcher(Actor):
     '''
@@ -22,10 +20,15 @@ class BasicWatcher(Actor):
     and saves objects that have been flagged by those actors
     '''
 
-    def __init__(self, *args, inputs= None):
+    def __init__(self, *args, inputs= None, saved= None, codecs= None):
         super().__init__(*args)
 
         self.watchin= inputs
+        # actor name: link to send back the ids of pinned objects once saved
+        self.saved= saved or {}
+        # objects of the types (or from the actors) listed here are saved
+        # with that codec as LMDB-style records (.rec, see loadSaved)
+        self.codecs= {k: checkCodec(c) for k, c in (codecs or {}).items()}
         
 
     def setup(self):
@@ -77,8 +80,28 @@ class BasicWatcher(Actor):
                 actorID = self.polling[i].getStart() # name of actor asking watcher to save the object
                 try:
                     obj= self.client.getID(r[0])
-                    np.save('output/saved/'+actorID+r[1], obj)
+                    # frame messages name only the frame, so ask the store
+                    obj_type= self.client.typeOf(r[0]) or splitKey(r[1])[0]
+                    codec= self.codecs.get(obj_type, self.codecs.get(actorID, 'none'))
+                    if codec == 'none':
+                        np.save('output/saved/'+actorID+r[1], obj)
+                    else:
+                        with open('output/saved/'+actorID+r[1]+'.rec', 'wb') as f:
+                            f.write(encodeRecord(obj, codec))
                 except ObjectNotFoundError as e:
                     logger.info(e.message)
                     pass
+                if len(r) > 2 and r[2] and actorID in self.saved:
+                    # pinned by its owner (see Actor.put), which unpins it
+                    self.saved[actorID].put(r[0])
                 self.tasks[i] = (asyncio.ensure_future(self.polling[i].get_async()))
+
+
+def loadSaved(path):
+    ''' Load an object saved by BasicWatcher, either .npy or a
+        compressed .rec record
+    '''
+    if path.endswith('.rec'):
+        with open(path, 'rb') as f:
+            return decodeRecord(f.read())
+    return np.load(path, allow_pickle=True)
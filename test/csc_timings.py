@@ -5,33 +5,24 @@ sys.path.append(".")
 import matplotlib.pyplot as plt
 
 
-from unittest import TestCase
-from nexus.store import Limbo
-from multiprocessing import Process
+from improv.store import SharedLimbo
 from scipy.sparse import csc_matrix
 import numpy as np
-import pyarrow.plasma as plasma
 import pickle
 import subprocess
-from nexus.actor import RunManager, AsyncRunManager
 
 # Time putting and getting a matrix to the store
 # matrix is size (n x n)
-# Type of the matrix can be "normal" (default) or "csc"
+# Type of the matrix can be "normal" (default), "csc" (stored as its
+# data/indices/indptr arrays) or "csc_pickled" (the old path: pickled
+# into a bytes blob on put and unpickled on every get)
 
-def time_putget(n, type = "normal"):
-    # Start the process
-    p = subprocess.Popen(['plasma_store',
-                      '-s', '/tmp/store',
-                      '-m', str(10000000000)],
-                      stdout=subprocess.DEVNULL,
-                      stderr=subprocess.DEVNULL)
-    limbo = Limbo()
+def time_putget(limbo, n, type = "normal"):
 
     # Make an array of random integers in range [0,100) of size (n x n)
     data = np.random.randint(0,100,(n,n),dtype=np.int8)
 
-    if (type == "csc"):
+    if (type == "csc" or type == "csc_pickled"):
         matrix = csc_matrix(data)
     else:
         matrix = data
@@ -45,7 +36,10 @@ def time_putget(n, type = "normal"):
     # Time putting and getting to store
     print("Putting {type} matrix of size {n} by {n}".format(type = type, n = n))
     t = timeit.default_timer()
-    limbo.put(matrix, "matrix")
+    if type == "csc_pickled":
+        id = limbo.put(pickle.dumps(matrix, protocol=pickle.HIGHEST_PROTOCOL), "matrix"+str(n)+type)
+    else:
+        id = limbo.put(matrix, "matrix"+str(n)+type)
     putTime = timeit.default_timer() - t
     print('\tTime', putTime)
 
@@ -53,13 +47,10 @@ def time_putget(n, type = "normal"):
 
     print("Getting {type} matrix of size {n} by {n}".format(type = type, n = n))
     t = timeit.default_timer()
-    limbo.get("matrix")
+    limbo.getID(id)
     getTime = timeit.default_timer() - t
     print('\tTime', getTime)
 
-    # Kill the process
-    p.kill()
-
     # Return timings
 
     return putTime, getTime, size
@@ -72,6 +63,11 @@ timings = {
         "get": [],
         "size": []
     },
+    "csc_pickled": {
+        "put": [],
+        "get": [],
+        "size": []
+    },
     "normal": {
         "put": [],
         "get": [],
@@ -85,19 +81,6 @@ def updateTimings(putTime, getTime, size, type = "normal"):
     timings[type]["get"].append(getTime)
     timings[type]["size"].append(size)
 
-# TODO: add timings up to 1gb
-# Run results
-for i in range(100,500):
-    putTime, getTime, size = time_putget(i)
-    updateTimings(putTime, getTime, size)
-
-    putTime, getTime, size = time_putget(i, type = "csc")
-    updateTimings(putTime, getTime, size, type = "csc")
-
-
-print(timings)
-# TODO: Plot results
-
 
 def  plotTimings(type):
     putTimes = timings[type]["put"]
@@ -110,7 +93,32 @@ def  plotTimings(type):
     plt.xlabel("Size of matrix (bytes)")
 
 
-plotTimings("normal")
-plotTimings("csc")
-plt.legend()
-plt.show()
+if __name__ == '__main__':
+    # Start the store
+    p = subprocess.Popen([sys.executable, '-m', 'improv.shm_store',
+                      '-s', '/tmp/store',
+                      '-m', str(10000000000)],
+                      stdout=subprocess.DEVNULL,
+                      stderr=subprocess.DEVNULL)
+    limbo = SharedLimbo()
+
+    # TODO: add timings up to 1gb
+    # Run results
+    for i in range(100,2000,20):
+        for type in timings.keys():
+            putTime, getTime, size = time_putget(limbo, i, type = type)
+            updateTimings(putTime, getTime, size, type = type)
+
+    # Stop the store
+    limbo.release()
+    p.terminate()
+
+    for type in timings.keys():
+        print('{}: mean put {:.6f} s, mean get {:.6f} s'.format(type,
+              np.mean(timings[type]["put"]), np.mean(timings[type]["get"])))
+
+    plotTimings("normal")
+    plotTimings("csc")
+    plotTimings("csc_pickled")
+    plt.legend()
+    plt.show()
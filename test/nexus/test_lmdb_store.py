@@ -0,0 +1,196 @@
+from unittest import TestCase
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from improv.store import LMDBStore, encodeRecord
+from improv.watcher import loadSaved
+from improv.utils.reader import LMDBReader
+
+
+class LMDBStore_Writer(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.lmdb = LMDBStore(path=self.path, name='/test', commit_freq=5,
+                              commit_interval=0.05)
+
+    def tearDown(self):
+        self.lmdb.flush()
+        shutil.rmtree(self.path)
+
+    def committed(self):
+        with self.lmdb.lmdb_env.begin() as txn:
+            return sum(txn.stat(db)['entries'] for db in list(self.lmdb.dbs.values()))
+
+    def test_getAfterPut(self):
+        self.lmdb.put(np.arange(10), 'frame')
+        self.assertTrue(np.array_equal(self.lmdb.get('frame'), np.arange(10)))
+        self.assertIsNone(self.lmdb.get('never_put'))
+
+    def test_drain(self):
+        for i in range(3):
+            self.lmdb.put(i, 'obj'+str(i))
+        self.lmdb.drain()
+        self.assertEqual(3, self.committed())
+
+    def test_batchBySize(self):
+        self.lmdb.lmdb_commit_interval = 60
+        for i in range(5):
+            self.lmdb.put(i, 'obj'+str(i))
+        time.sleep(0.2)
+        self.assertEqual(5, self.committed())
+
+    def test_batchByTime(self):
+        self.lmdb.put(1, 'one')
+        time.sleep(0.3)
+        self.assertEqual(1, self.committed())
+
+    def test_forkedWriter(self):
+        self.lmdb.put(1, 'parent')
+        self.lmdb.drain()
+        p = multiprocessing.get_context('fork').Process(target=self.putInChild)
+        p.start()
+        p.join(timeout=10)
+        self.assertEqual(0, p.exitcode)
+        self.assertTrue(self.lmdb.writer.is_alive())
+
+    def putInChild(self):
+        # the parent's writer thread does not survive the fork
+        self.lmdb.put(2, 'child')
+        if not self.lmdb.writer.is_alive() or self.lmdb.get('child') != 2:
+            os._exit(1)
+        os._exit(0)
+
+    def test_delete(self):
+        self.lmdb.put(1, 'one')
+        self.lmdb.delete('one')
+        self.assertIsNone(self.lmdb.get('one'))
+
+
+class LMDBReader_Keys(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        lmdb = LMDBStore(path=self.path, name='/test')
+        lmdb.put({'k': 1}, 'params_dict')
+        for i in [1, 2, 10, 11, 100]:
+            lmdb.put(i, 'acq_raw'+str(i))
+            lmdb.put(-i, ('C', i))
+        lmdb.put({'k': 2}, 'params_dict')
+        lmdb.flush()
+        self.reader = LMDBReader(self.path+'/test')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_types(self):
+        self.assertEqual({'params_dict', 'acq_raw', 'C'}, self.reader.get_data_types())
+
+    def test_byNumber(self):
+        data = self.reader.get_data_by_number(10)
+        self.assertEqual(sorted(data.values()), [-10, 10])
+        self.assertTrue(all(k.startswith(('acq_raw10_', 'C10_')) for k in data))
+
+    def test_byRange(self):
+        # numeric order, not string order of the names
+        data = self.reader.get_data_by_range(2, 100, types=['acq_raw'])
+        self.assertEqual(list(data.values()), [2, 10, 11])
+
+    def test_byType(self):
+        self.assertEqual(5, len(self.reader.get_data_by_type('acq')))
+        self.assertEqual(12, len(self.reader.get_all_data()))
+
+    def test_params(self):
+        self.assertEqual({'k': 2}, self.reader.get_params())
+
+
+class LMDBReader_Records(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        lmdb = LMDBStore(path=self.path, name='/test')
+        lmdb.put({'k': 1}, 'params_dict')
+        for i in range(5):
+            lmdb.put(np.full((64, 64), i, dtype=np.float32), ('acq_raw', i))
+            lmdb.put({'C': np.arange(3)*i, 'n': i}, ('estimates', i))
+        lmdb.flush()
+        self.reader = LMDBReader(self.path+'/test')
+
+    def tearDown(self):
+        self.reader.close()
+        shutil.rmtree(self.path)
+
+    def test_frameOrder(self):
+        frames = [(r.frame, r.name) for r in self.reader.records()]
+        self.assertEqual(11, len(frames))
+        self.assertEqual(frames[-1], (None, 'params_dict'))
+        self.assertEqual([f for f, _ in frames[:-1]], sorted(f for f, _ in frames[:-1]))
+
+    def test_filter(self):
+        records = [(r.frame, r.value['n']) for r in self.reader.records(types=['estimates'], start=1, stop=3)]
+        self.assertEqual([(1, 1), (2, 2)], records)
+
+    def test_zeroCopy(self):
+        for r in self.reader.records(types=['acq_raw'], start=3, stop=4):
+            frame = r.value
+            self.assertFalse(frame.flags.writeable)
+            self.assertFalse(frame.flags.owndata)
+            self.assertEqual(3, frame[10, 10])
+            kept = r.copy()
+        self.assertTrue(kept.flags.writeable)
+        self.assertEqual(3, kept[10, 10])
+
+
+class LMDBStore_Codecs(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.codecs = {'raw': 'none', 'z': 'zlib', 'x': 'lzma', 's': 'shuffle', 'd': 'delta'}
+        self.lmdb = LMDBStore(path=self.path, name='/test', codecs=self.codecs)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_roundTrip(self):
+        rng = np.random.default_rng(0)
+        frame = (rng.poisson(5, (128, 128)) + 1000).astype(np.uint16)
+        for t in self.codecs:
+            self.lmdb.put(frame, (t, 0))
+            self.lmdb.put({'C': frame[:2], 'n': t}, (t, 1))
+        self.lmdb.flush()
+        with LMDBReader(self.path+'/test') as reader:
+            sizes = {}
+            for r in reader.records():
+                if r.frame == 0:
+                    self.assertTrue(np.array_equal(r.value, frame), r.name)
+                    sizes[r.name] = len(r._buf)
+                else:
+                    self.assertEqual(r.value['n'], r.name)
+                    self.assertTrue(np.array_equal(r.value['C'], frame[:2]))
+        self.assertLess(sizes['s'], sizes['raw']/3)
+        self.assertLess(sizes['s'], sizes['z'])
+
+    def test_deltaSmooth(self):
+        frame = np.add.outer(np.arange(256), np.arange(256)).astype(np.uint16)*7
+        self.lmdb.put(frame, ('d', 0))
+        self.lmdb.put(frame, ('s', 0))
+        self.lmdb.flush()
+        with LMDBReader(self.path+'/test') as reader:
+            (d, d_size), (s, s_size) = [(r.value, len(r._buf)) for r in reader.records()]
+            self.assertTrue(np.array_equal(d, frame))
+            self.assertLess(d_size, s_size)
+
+    def test_watcherRecord(self):
+        frame = np.arange(4096, dtype=np.uint16).reshape(64, 64)
+        for codec in ('lzma', 'delta'):
+            path = os.path.join(self.path, 'Processor12.rec')
+            with open(path, 'wb') as f:
+                f.write(encodeRecord(frame, codec))
+            self.assertTrue(np.array_equal(frame, loadSaved(path)))
+
+    def test_unknownCodec(self):
+        with self.assertRaises(ValueError):
+            LMDBStore(path=self.path, name='/bad', codecs={'a': 'gzip'})
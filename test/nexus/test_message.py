@@ -0,0 +1,75 @@
+from unittest import TestCase
+import multiprocessing
+from improv.message import FrameMessage
+from improv.shm_store import ObjectID
+from improv.ring import RingRef
+from improv.shm_queue import ShmQueue, BroadcastQueue
+
+ctx = multiprocessing.get_context('fork')
+
+
+def echo(q_in, q_out):
+    q_out.put(q_in.get(timeout=5))
+
+
+class FrameMessage_Packing(TestCase):
+
+    def test_packUnpack(self):
+        msg = FrameMessage(7, [ObjectID.from_random(), RingRef('acq_raw', 3, 42)])
+        buf = bytearray(8 + msg.nbytes())
+        msg.packInto(buf, 8)
+        self.assertEqual(msg, FrameMessage.unpackFrom(buf, 8))
+
+    def test_missing(self):
+        msg = FrameMessage.missing(12)
+        self.assertTrue(msg.isMissing)
+        self.assertEqual((), msg.ids)
+        buf = bytearray(msg.nbytes())
+        msg.packInto(buf, 0)
+        self.assertTrue(FrameMessage.unpackFrom(buf, 0).isMissing)
+        self.assertFalse(FrameMessage(12).isMissing)
+
+    def test_cannotPack(self):
+        with self.assertRaises(ValueError):
+            FrameMessage(0, ['acq_raw0']).nbytes()
+        with self.assertRaises(ValueError):
+            FrameMessage(0, [RingRef('r'*24, 0, 0)]).nbytes()
+
+
+class FrameMessage_Queues(TestCase):
+
+    def test_shmQueue(self):
+        q = ShmQueue(capacity=4096)
+        msgs = [FrameMessage(i, [ObjectID.from_random()]) for i in range(200)]
+        for m in msgs:
+            q.put(m)
+            self.assertEqual(m, q.get_nowait())
+        q.close()
+
+    def test_pickleFallback(self):
+        q = ShmQueue()
+        msg = FrameMessage(1, ['not an id'])
+        q.put(msg)
+        q.put([1])
+        self.assertEqual(msg, q.get_nowait())
+        self.assertEqual([1], q.get_nowait())
+
+    def test_broadcast(self):
+        log = BroadcastQueue(2, capacity=4096, policy='drop-oldest')
+        fast, slow = log.reader(0), log.reader(1)
+        for i in range(300):
+            log.put(FrameMessage(i, [RingRef('acq_raw', i % 8, i)]))
+            self.assertEqual(i, fast.get_nowait().frame)
+        msg = slow.get_nowait()
+        self.assertEqual(RingRef('acq_raw', msg.frame % 8, msg.frame), msg.ids[0])
+        self.assertEqual(msg.frame, slow.dropped())
+        log.close()
+
+    def test_acrossProcesses(self):
+        q_in, q_out = ShmQueue(), ShmQueue()
+        p = ctx.Process(target=echo, args=(q_in, q_out))
+        p.start()
+        msg = FrameMessage(5, [ObjectID.from_random(), RingRef('acq_raw', 1, 9)])
+        q_in.put(msg)
+        self.assertEqual(msg, q_out.get(timeout=5))
+        p.join()
@@ -0,0 +1,84 @@
+from unittest import TestCase
+import json
+import os
+import multiprocessing
+import tempfile
+import time
+import numpy as np
+from improv.metrics import StoreMetrics, MAX_SLOTS, writeSnapshot
+from improv.store import ObjectNotFoundError, SharedLimbo
+
+from test.nexus.test_shm_store import SharedStoreDependentTestCase
+
+
+def _recordInChild(metrics):
+    for _ in range(5):
+        metrics.record('put', 'acq_raw', time.perf_counter_ns() - 3000, 100)
+
+
+class StoreMetrics_Record(TestCase):
+
+    def setUp(self):
+        self.metrics = StoreMetrics.create()
+
+    def tearDown(self):
+        self.metrics.close()
+
+    def test_snapshot(self):
+        for ns in (1000, 1000, 1000, 1000000):
+            self.metrics.record('get', 'estimates', time.perf_counter_ns() - ns, 8)
+        stats = self.metrics.snapshot()['get']['estimates']
+        self.assertEqual((4, 32), (stats['count'], stats['bytes']))
+        self.assertGreaterEqual(stats['max_us'], 1000)
+        self.assertLess(stats['p50_us'], stats['p99_us'])
+        self.assertEqual(4, sum(stats['hist']))
+
+    def test_otherProcessWrites(self):
+        p = multiprocessing.get_context('spawn').Process(target=_recordInChild, args=(self.metrics,))
+        p.start()
+        p.join()
+        stats = self.metrics.snapshot()['put']['acq_raw']
+        self.assertEqual((5, 500), (stats['count'], stats['bytes']))
+
+    def test_slotsOverflow(self):
+        for i in range(MAX_SLOTS + 5):
+            self.metrics.record('put', 'p{}'.format(i), time.perf_counter_ns())
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(MAX_SLOTS - 1, len(snapshot['put']))
+        self.assertEqual(6, snapshot['other']['']['count'])
+
+    def test_writeSnapshot(self):
+        self.metrics.record('put', 'x', time.perf_counter_ns())
+        path = os.path.join(tempfile.mkdtemp(), 'metrics.json')
+        writeSnapshot(path, self.metrics.snapshot())
+        with open(path) as f:
+            self.assertEqual(1, json.load(f)['put']['x']['count'])
+
+
+class SharedLimbo_Metrics(SharedStoreDependentTestCase):
+    limbo_args = {'metrics': True}
+
+    def test_offByDefault(self):
+        other = SharedLimbo('other', store_loc=self.store_loc)
+        self.assertIsNone(other.metrics)
+        other.release()
+
+    def test_emptyGets(self):
+        self.assertEqual([], self.limbo.getMany([]))
+        self.assertEqual([], self.limbo.getList([]))
+        self.assertEqual({}, self.limbo.metrics.snapshot().get('getMany', {}))
+
+    def test_opsByPrefix(self):
+        ids = [self.limbo.put(np.zeros(100), 'acq_raw', frame=i) for i in range(3)]
+        self.limbo.put(1, 'estimates12')
+        self.limbo.getID(ids[0])
+        self.limbo.getList(ids)
+        self.limbo.delete(ids[0])
+        with self.assertRaises(ObjectNotFoundError):
+            self.limbo.getID(ids[0])
+        snapshot = self.limbo.metrics.snapshot()
+        self.assertEqual({'acq_raw', 'estimates'}, set(snapshot['put']))
+        self.assertEqual(2400, snapshot['put']['acq_raw']['bytes'])
+        self.assertEqual(1, snapshot['get']['acq_raw']['count'])
+        self.assertEqual(2400, snapshot['getList']['acq_raw']['bytes'])
+        self.assertEqual(1, sum(s['count'] for s in snapshot['miss'].values()))
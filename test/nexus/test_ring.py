@@ -0,0 +1,57 @@
+from unittest import TestCase
+import numpy as np
+from improv.ring import FrameRing, RingRef
+from improv.store import FrameOverrunError, ObjectNotFoundError
+
+from test.nexus.test_shm_store import SharedStoreDependentTestCase
+
+
+class FrameRing_PutGet(TestCase):
+
+    def setUp(self):
+        self.ring = FrameRing.create((4, 3), np.uint16, 3)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_roundTrip(self):
+        frame = np.arange(12, dtype=np.uint16).reshape(4, 3)
+        ref = self.ring.put(frame)
+        self.assertEqual(ref, RingRef(self.ring.name, 0, 0))
+        res = self.ring.get(ref)
+        self.assertTrue(np.array_equal(frame, res))
+        self.assertFalse(res.flags.writeable)
+        self.assertEqual(ref, self.ring.latest())
+
+    def test_otherProcessView(self):
+        ref = self.ring.put(np.ones((4, 3)))
+        other = FrameRing.attach(self.ring.name)
+        self.assertEqual((other.shape, other.dtype, other.capacity), ((4, 3), np.uint16, 3))
+        self.assertTrue(np.array_equal(other.copy(ref), np.ones((4, 3))))
+        other.close()
+
+    def test_overrun(self):
+        refs = [self.ring.put(np.full((4, 3), i)) for i in range(4)]
+        self.assertEqual(refs[3].slot, 0)
+        self.assertIsNone(self.ring.get(refs[0]))
+        self.assertFalse(self.ring.valid(refs[0]))
+        self.assertEqual(self.ring.get(refs[3])[0, 0], 3)
+
+
+class SharedLimbo_Ring(SharedStoreDependentTestCase):
+
+    def test_getID(self):
+        frame = np.random.rand(16, 16).astype(np.float32)
+        ref = self.limbo.putRing(frame, 'acq_raw', 2)
+        self.assertIn('acq_raw', self.limbo.stored)
+        self.assertEqual(self.limbo.get('acq_raw')['capacity'], 2)
+        self.assertTrue(np.array_equal(self.limbo.getID(ref), frame))
+        self.limbo.checkFrame(ref)
+
+    def test_overrunRaises(self):
+        refs = [self.limbo.putRing(np.full((8, 8), i), 'acq_raw', 2) for i in range(3)]
+        with self.assertRaises(FrameOverrunError):
+            self.limbo.getID(refs[0])
+        with self.assertRaises(ObjectNotFoundError):
+            self.limbo.checkFrame(refs[0])
+        self.assertEqual([1, 2], [f[0, 0] for f in self.limbo.getList(refs[1:])])
@@ -0,0 +1,57 @@
+from unittest import TestCase
+import numpy as np
+from improv.roi import ROITable
+
+from test.nexus.test_shm_store import SharedStoreDependentTestCase
+
+
+def makeContours(n):
+    contours = []
+    for i in range(n):
+        coords = np.random.rand(5 + i, 2)
+        coords[2] = np.nan
+        contours.append({'neuron_id': i + 1, 'CoM': np.array([i, 2.0*i]), 'coordinates': coords})
+    return contours
+
+
+class ROITable_Contours(TestCase):
+
+    def test_fromContours(self):
+        contours = makeContours(4)
+        table = ROITable.fromContours(contours, version=3)
+        self.assertEqual(4, len(table))
+        self.assertEqual(3, table.version)
+        self.assertTrue(np.array_equal([1, 2, 3, 4], table.ids))
+        self.assertEqual((4, 2), table.com.shape)
+        self.assertEqual(sum(len(c['coordinates']) for c in contours), len(table.vertices))
+        for i, c in enumerate(contours):
+            self.assertTrue(np.array_equal(c['coordinates'], table.contour(i), equal_nan=True))
+
+    def test_contoursAreViews(self):
+        table = ROITable.fromContours(makeContours(3))
+        for c in table.contours():
+            self.assertIs(table.vertices, c.base)
+
+    def test_toContours(self):
+        contours = makeContours(2)
+        back = ROITable.fromContours(contours).toContours()
+        self.assertEqual([1, 2], [c['neuron_id'] for c in back])
+        self.assertTrue(np.array_equal(contours[1]['CoM'], back[1]['CoM']))
+
+    def test_empty(self):
+        table = ROITable.fromContours([])
+        self.assertEqual(0, len(table))
+        self.assertEqual([], table.contours())
+        self.assertEqual((0, 2), table.com.shape)
+
+
+class SharedLimbo_ROITable(SharedStoreDependentTestCase):
+
+    def test_putGet(self):
+        table = ROITable.fromContours(makeContours(5), version=1)
+        id = self.limbo.put(table, 'coords', frame=table.version)
+        res = self.limbo.getID(id)
+        self.assertEqual(1, res.version)
+        self.assertTrue(np.array_equal(table.vertices, res.vertices, equal_nan=True))
+        self.assertTrue(np.array_equal(table.offsets, res.offsets))
+        self.assertFalse(res.vertices.flags.writeable)  # a view into the store
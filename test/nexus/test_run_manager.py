@@ -0,0 +1,103 @@
+from unittest import TestCase
+import os
+import time
+import select
+import multiprocessing
+from queue import Empty
+from improv.actor import RunManager, Spike
+from improv.shm_queue import ShmQueue
+
+ctx = multiprocessing.get_context('fork')
+
+
+def runEcho(q_sig, q_comm, q_in, q_out, spin):
+    ''' An actor passing q_in on to q_out, waiting on its input
+    '''
+    def step():
+        try:
+            q_out.put(q_in.get_nowait())
+        except Empty:
+            pass
+    with RunManager('echo', step, lambda: None, q_sig, q_comm, inputs=[q_in], spin=spin):
+        pass
+
+
+def childCPU():
+    t = os.times()
+    return t.children_user + t.children_system
+
+
+class RunManager_Events(TestCase):
+
+    def setUp(self):
+        self.q_sig, self.q_comm = ShmQueue(), ShmQueue()
+        self.q_in, self.q_out = ShmQueue(), ShmQueue()
+
+    def runActor(self, spin, idle):
+        ''' Echo 20 items through an actor, leave it idle for idle
+            seconds and quit it. Returns the CPU seconds it used
+        '''
+        before = childCPU()
+        p = ctx.Process(target=runEcho, args=(self.q_sig, self.q_comm, self.q_in, self.q_out, spin))
+        p.start()
+        self.q_sig.put(Spike.setup())
+        self.assertEqual([Spike.ready()], self.q_comm.get(timeout=5))
+        self.q_sig.put(Spike.run())
+        for i in range(20):
+            self.q_in.put(i)
+            self.assertEqual(i, self.q_out.get(timeout=5))
+        time.sleep(idle)
+        self.q_sig.put(Spike.quit())
+        p.join(timeout=5)
+        self.assertEqual(0, p.exitcode)
+        return childCPU() - before
+
+    def test_blockWhenIdle(self):
+        self.assertLess(self.runActor(spin=0, idle=0.5), 0.2)
+
+    def test_spinThenBlock(self):
+        self.assertLess(self.runActor(spin=0.001, idle=0.5), 0.2)
+
+    def test_wakeOnSignal(self):
+        rm = RunManager('test', None, None, self.q_sig, self.q_comm, inputs=[self.q_in])
+        self.q_sig.put(Spike.pause())
+        rm._wait([self.q_sig, self.q_in])
+        self.assertEqual(Spike.pause(), self.q_sig.get_nowait())
+
+    def test_adaptSpin(self):
+        rm = RunManager('test', None, None, self.q_sig, self.q_comm, inputs=[self.q_in], spin=0.002)
+        # Data came while polling: keep polling as long
+        self.q_in.put(1)
+        rm._wait([self.q_in])
+        self.assertEqual(0.002, rm.spinFor)
+        self.q_in.get_nowait()
+        with self.assertRaises(Empty):
+            self.q_in.get_nowait()
+        p = ctx.Process(target=lambda: (time.sleep(0.05), self.q_in.put(2)))
+        p.start()
+        rm._wait([self.q_in])  # polled in vain, then blocked: poll for less
+        self.assertEqual(0.001, rm.spinFor)
+        p.join()
+        for _ in range(10):
+            rm._wait([self.q_in])
+        self.assertEqual(0.002, rm.spinFor)
+
+
+class ShmQueue_Readiness(TestCase):
+
+    def test_readableWhileItemsLeft(self):
+        q = ShmQueue()
+        read = q._read
+
+        def racingRead():
+            # Two puts between finding the queue empty and clearing its doorbell
+            q._read = read
+            found = read()
+            q.put(2)
+            q.put(3)
+            return found
+
+        q._read = racingRead
+        self.assertEqual(2, q.get_nowait())
+        self.assertTrue(select.select([q], [], [], 0)[0])
+        self.assertEqual(3, q.get_nowait())
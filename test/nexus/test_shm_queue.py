@@ -0,0 +1,296 @@
+from unittest import TestCase
+import time
+import select
+import asyncio
+import multiprocessing
+from queue import Empty, Full
+import numpy as np
+from improv.shm_queue import ShmQueue, BroadcastQueue, getAsync
+
+ctx = multiprocessing.get_context('fork')
+
+
+def produce(q, n):
+    for i in range(n):
+        q.put([i, 'frame{}'.format(i)])
+
+
+def collect(reader, q_out, n):
+    q_out.put([reader.get(timeout=5) for _ in range(n)])
+
+
+def produceEach(queues):
+    for i, q in enumerate(queues):
+        q.put(i)
+
+
+def readable(q):
+    return bool(select.select([q], [], [], 0)[0])
+
+
+def echo(q_in, q_out):
+    while True:
+        item = q_in.get()
+        if item is None:
+            break
+        q_out.put(item)
+
+
+class ShmQueue_Local(TestCase):
+
+    def setUp(self):
+        self.q = ShmQueue(capacity=4096)
+
+    def tearDown(self):
+        self.q.close()
+
+    def test_putGet(self):
+        self.q.put({'a': 1})
+        self.q.put(np.arange(4))
+        self.assertEqual(2, self.q.qsize())
+        self.assertEqual({'a': 1}, self.q.get())
+        self.assertTrue(np.array_equal(np.arange(4), self.q.get()))
+        self.assertTrue(self.q.empty())
+
+    def test_wrapAround(self):
+        for i in range(1000):
+            self.q.put('x'*(i % 300))
+            self.assertEqual('x'*(i % 300), self.q.get(timeout=1))
+        self.assertEqual(0, self.q.qsize())
+
+    def test_emptyTimeout(self):
+        with self.assertRaises(Empty):
+            self.q.get_nowait()
+        t = time.monotonic()
+        with self.assertRaises(Empty):
+            self.q.get(timeout=0.05)
+        self.assertGreaterEqual(time.monotonic() - t, 0.05)
+
+    def test_full(self):
+        with self.assertRaises(Full):
+            while True:
+                self.q.put_nowait(b'y'*100)
+        n = self.q.qsize()
+        self.q.get()
+        self.q.put_nowait(b'y'*100)
+        self.assertEqual(n, self.q.qsize())
+
+    def test_tooLarge(self):
+        with self.assertRaises(ValueError):
+            self.q.put(b'z'*5000)
+
+
+class ShmQueue_Batch(TestCase):
+
+    def test_getBatch(self):
+        q = ShmQueue()
+        for i in range(10):
+            q.put(i)
+        self.assertEqual([0, 1, 2, 3], q.get_batch(4))
+        self.assertEqual(list(range(4, 10)), q.get_batch(100))
+        self.assertEqual([], q.get_batch(4, timeout=0.01))
+
+    def test_getBatchWaitsForFirst(self):
+        q = ShmQueue()
+        p = ctx.Process(target=produce, args=(q, 3))
+        p.start()
+        items = q.get_batch(3, timeout=5)
+        self.assertEqual([0, 'frame0'], items[0])
+        p.join()
+        items += q.get_batch(3, timeout=0)
+        self.assertEqual([[i, 'frame{}'.format(i)] for i in range(3)], items)
+
+    def test_broadcastBatch(self):
+        log = BroadcastQueue(2)
+        for i in range(5):
+            log.put(i)
+        self.assertEqual([0, 1, 2], log.reader(0).get_batch(3))
+        self.assertEqual(list(range(5)), log.reader(1).get_batch(10))
+        self.assertEqual([3, 4], log.reader(0).get_batch(10, timeout=0))
+
+
+class ShmQueue_Policies(TestCase):
+
+    def test_blockAtMaxsize(self):
+        q = ShmQueue(maxsize=3)
+        for i in range(3):
+            self.assertEqual(0, q.put_nowait(i))
+        self.assertTrue(q.full())
+        with self.assertRaises(Full):
+            q.put_nowait(3)
+        self.assertEqual(0, q.dropped())
+
+    def test_dropOldest(self):
+        q = ShmQueue(maxsize=3, policy='drop-oldest')
+        dropped = [q.put(i) for i in range(5)]
+        self.assertEqual([0, 0, 0, 1, 1], dropped)
+        self.assertEqual(2, q.dropped())
+        self.assertEqual([2, 3, 4], [q.get_nowait() for _ in range(3)])
+
+    def test_dropOldestBytes(self):
+        q = ShmQueue(capacity=1024, policy='drop-oldest')
+        for i in range(100):
+            q.put([i, b'x'*100])
+        n = q.qsize()
+        self.assertEqual(100, n + q.dropped())
+        self.assertEqual(list(range(100-n, 100)), [q.get_nowait()[0] for _ in range(n)])
+
+    def test_dropNewest(self):
+        q = ShmQueue(maxsize=2, policy='drop-newest')
+        self.assertEqual([0, 0, 1, 1], [q.put(i) for i in range(4)])
+        self.assertEqual(2, q.dropped())
+        self.assertEqual([0, 1], [q.get_nowait() for _ in range(2)])
+        self.assertTrue(q.empty())
+
+    def test_latestOnly(self):
+        q = ShmQueue(policy='latest-only')
+        for i in range(10):
+            q.put(i)
+        self.assertEqual(1, q.qsize())
+        self.assertEqual(9, q.get_nowait())
+        self.assertEqual(9, q.dropped())
+
+    def test_unknownPolicy(self):
+        with self.assertRaises(ValueError):
+            ShmQueue(policy='drop-all')
+
+
+class ShmQueue_Processes(TestCase):
+
+    def test_producerProcess(self):
+        q = ShmQueue(capacity=1024)
+        p = ctx.Process(target=produce, args=(q, 500))
+        p.start()
+        for i in range(500):
+            self.assertEqual([i, 'frame{}'.format(i)], q.get(timeout=5))
+        p.join()
+        q.close()
+
+    def test_roundTrip(self):
+        q_in, q_out = ShmQueue(), ShmQueue()
+        p = ctx.Process(target=echo, args=(q_in, q_out))
+        p.start()
+        for i in range(100):
+            q_in.put(i)
+            self.assertEqual(i, q_out.get(timeout=5))
+        q_in.put(None)
+        p.join(timeout=5)
+        self.assertEqual(0, p.exitcode)
+
+
+class BroadcastQueue_Readers(TestCase):
+
+    def test_everyReaderGetsEveryItem(self):
+        log = BroadcastQueue(3, capacity=4096)
+        readers = [log.reader(i) for i in range(3)]
+        for i in range(200):
+            log.put({'frame': i})
+            for r in readers:
+                self.assertEqual({'frame': i}, r.get(timeout=1))
+        self.assertTrue(all(r.empty() for r in readers))
+        log.close()
+
+    def test_blockOnSlowReader(self):
+        log = BroadcastQueue(2, capacity=4096)
+        fast, slow = log.reader(0), log.reader(1)
+        with self.assertRaises(Full):
+            while True:
+                log.put_nowait(b'x'*100)
+                fast.get_nowait()
+        n = slow.qsize()
+        slow.get()
+        log.put_nowait(b'x'*100)
+        self.assertEqual(n, slow.qsize())
+        self.assertEqual(0, slow.dropped())
+        log.close()
+
+    def test_skipSlowReader(self):
+        log = BroadcastQueue(2, capacity=4096, policy='drop-oldest')
+        fast, slow = log.reader(0), log.reader(1)
+        for i in range(1000):
+            log.put_nowait([i, b'x'*50])
+            self.assertEqual(i, fast.get_nowait()[0])
+        first = slow.get_nowait()[0]
+        self.assertGreater(first, 900)
+        self.assertEqual(first, slow.dropped())
+        rest = []
+        while not slow.empty():
+            rest.append(slow.get_nowait()[0])
+        self.assertEqual(list(range(first+1, 1000)), rest)
+        self.assertEqual(0, fast.dropped())
+        log.close()
+
+    def test_latestOnly(self):
+        log = BroadcastQueue(2, policy='latest-only')
+        fast, slow = log.reader(0), log.reader(1)
+        for i in range(5):
+            log.put(i)
+            self.assertEqual(i, fast.get_nowait())
+        self.assertEqual(4, slow.get_nowait())
+        self.assertEqual(4, slow.dropped())
+        self.assertEqual(4, log.dropped())
+        self.assertEqual(0, fast.dropped())
+
+    def test_dropNewestAtMaxsize(self):
+        log = BroadcastQueue(2, maxsize=2, policy='drop-newest')
+        fast, slow = log.reader(0), log.reader(1)
+        self.assertEqual([0, 0, 1], [log.put(i) for i in range(3)])
+        self.assertEqual([0, 1], [slow.get_nowait(), slow.get_nowait()])
+        self.assertEqual([0, 1], [fast.get_nowait(), fast.get_nowait()])
+        with self.assertRaises(Empty):
+            fast.get_nowait()
+        self.assertEqual(1, log.dropped())
+
+    def test_readerProcesses(self):
+        log = BroadcastQueue(2, capacity=2048)
+        results = ShmQueue()
+        procs = [ctx.Process(target=collect, args=(log.reader(i), results, 300)) for i in range(2)]
+        for p in procs:
+            p.start()
+        for i in range(300):
+            log.put(i)
+        for _ in procs:
+            self.assertEqual(list(range(300)), results.get(timeout=5))
+        for p in procs:
+            p.join()
+
+
+class ShmQueue_Fileno(TestCase):
+
+    def test_readableAfterPut(self):
+        q = ShmQueue()
+        with self.assertRaises(Empty):
+            q.get_nowait()
+        self.assertFalse(readable(q))
+        q.put(1)
+        self.assertTrue(readable(q))
+        self.assertEqual(1, q.get_nowait())
+        with self.assertRaises(Empty):
+            q.get_nowait()
+        self.assertFalse(readable(q))
+        q.close()
+
+    def test_broadcastReaderReadable(self):
+        log = BroadcastQueue(2)
+        r = log.reader(1)
+        self.assertFalse(readable(r))
+        log.put('x')
+        self.assertTrue(readable(r))
+        self.assertEqual('x', r.get_nowait())
+        with self.assertRaises(Empty):
+            r.get_nowait()
+        self.assertFalse(readable(r))
+        log.close()
+
+    def test_eventLoopWaitsOnManyQueues(self):
+        queues = [ShmQueue(capacity=4096) for _ in range(200)]
+
+        async def gather():
+            return await asyncio.gather(*[getAsync(q) for q in queues])
+
+        p = ctx.Process(target=produceEach, args=(queues,))
+        p.start()
+        self.assertEqual(list(range(200)), asyncio.run(asyncio.wait_for(gather(), 5)))
+        p.join()
+        for q in queues:
+            q.close()
@@ -0,0 +1,384 @@
+from unittest import TestCase, mock
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csc_matrix
+from improv.store import SharedLimbo, ObjectNotFoundError, StoredIndex, Watcher
+from improv.shm_store import ObjectNotAvailable, SharedMemoryServer
+from improv.shm_queue import ShmQueue
+from improv.message import FrameMessage
+from improv.actor import Actor
+
+
+class SharedStoreDependentTestCase(TestCase):
+    ''' Unit test base class that starts the shared memory store
+        for the tests in this case.
+    '''
+    store_loc = '/tmp/test_shm_store'
+    store_args = []
+    limbo_args = {}
+
+    def setUp(self):
+        ''' Start the server
+        '''
+        self.p = subprocess.Popen([sys.executable, '-m', 'improv.shm_store',
+                                   '-s', self.store_loc,
+                                   '-m', str(10000000)] + self.store_args,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        self.limbo = SharedLimbo(store_loc=self.store_loc, **self.limbo_args)
+
+    def tearDown(self):
+        ''' Stop the server, which unlinks its segments
+        '''
+        self.limbo.release()
+        self.p.terminate()
+        self.p.wait()
+
+
+class SharedLimbo_PutGet(SharedStoreDependentTestCase):
+
+    def test_getOne(self):
+        id = self.limbo.put(1, 'one')
+        self.assertEqual(1, self.limbo.get('one'))
+        self.assertEqual(id, self.limbo.stored['one'])
+
+    def test_arrayZeroCopy(self):
+        frame = np.arange(512*512, dtype=np.uint16).reshape(512, 512)
+        id = self.limbo.put(frame, 'acq_raw0')
+        res = self.limbo.getID(id)
+        self.assertTrue(np.array_equal(frame, res))
+        self.assertFalse(res.flags.writeable)
+
+    def test_otherClient(self):
+        id = self.limbo.put({'a': np.ones(10)}, 'dict')
+        other = SharedLimbo('other', store_loc=self.store_loc)
+        self.assertTrue(np.array_equal(other.getID(id)['a'], np.ones(10)))
+        other.release()
+
+    def test_typeOf(self):
+        id = self.limbo.put(np.zeros(4), 'acq_raw12')
+        self.assertEqual('acq_raw', self.limbo.typeOf(id))
+        other = SharedLimbo('other', store_loc=self.store_loc)
+        other.getID(id)
+        self.assertEqual('acq_raw', other.typeOf(id))
+        other.release()
+
+    def test_csc(self):
+        csc = csc_matrix(np.eye(4, dtype=np.int8))
+        id = self.limbo.put(csc, 'csc')
+        self.assertTrue(np.allclose(self.limbo.getID(id).toarray(), csc.toarray()))
+
+    def test_sparseZeroCopy(self):
+        for fmt in ['csc', 'csr', 'coo']:
+            mat = sparse.random(50, 40, density=0.1, format=fmt)
+            res = self.limbo.getID(self.limbo.put(mat, fmt))
+            self.assertEqual(res.format, fmt)
+            self.assertEqual((res != mat).nnz, 0)
+            # rebuilt around the stored buffers, not unpickled copies
+            self.assertFalse(res.data.flags.writeable)
+
+    def test_getList(self):
+        ids = [self.limbo.put(i, str(i)) for i in range(3)]
+        self.assertEqual([0, 1, 2], self.limbo.getList(ids))
+        self.assertEqual(3, len(self.limbo.get_all()))
+
+    def test_getListWaits(self):
+        id = self.limbo.random_ObjectID(1)[0]
+        with self.assertRaises(ObjectNotFoundError):
+            self.limbo.getList([id], timeout=0.05)
+        other = SharedLimbo('other', store_loc=self.store_loc)
+        later = threading.Timer(0.1, other.client.put, args=(5,), kwargs={'object_id': id})
+        later.start()
+        self.assertEqual([5], self.limbo.getList([id]))
+        later.join()
+        other.release()
+
+    def test_notPut(self):
+        with self.assertRaises(ObjectNotFoundError):
+            self.limbo.getID(self.limbo.random_ObjectID(1)[0])
+        self.assertIs(self.limbo.client.get(self.limbo.random_ObjectID(1)[0], 0), ObjectNotAvailable)
+
+    def test_full(self):
+        id = self.limbo.put(np.zeros(20000000, dtype=np.uint8), 'big')
+        self.assertIsNone(id)
+
+
+class SharedLimbo_PutGetMany(SharedStoreDependentTestCase):
+
+    def test_bundle(self):
+        bundle = {'coords': [{'CoM': np.ones(2)}], 'image': np.zeros((4, 4)),
+                  'C': csc_matrix(np.eye(3))}
+        id = self.limbo.putMany(bundle, 'estimates0')
+        self.assertEqual(id, self.limbo.stored['estimates0'])
+        self.assertEqual(1, len(self.limbo.get_all()))
+        res = self.limbo.getMany(id)
+        self.assertEqual(set(bundle.keys()), set(res.keys()))
+        self.assertTrue(np.allclose(res['C'].toarray(), np.eye(3)))
+        self.assertTrue(np.array_equal(self.limbo.getMany('estimates0')['image'], bundle['image']))
+
+    def test_list(self):
+        ids = [self.limbo.putMany({'a': i, 'b': -i}, 'bundle'+str(i)) for i in range(3)]
+        res = self.limbo.getMany(ids)
+        self.assertEqual([r['b'] for r in res], [0, -1, -2])
+
+    def test_missing(self):
+        with self.assertRaises(ObjectNotFoundError):
+            self.limbo.getMany(self.limbo.random_ObjectID(1))
+
+
+class StoredIndex_Keys(TestCase):
+
+    def setUp(self):
+        self.index = StoredIndex(frames_per_prefix=4)
+
+    def test_nameAndFrameKeys(self):
+        self.index['S12'] = 'a'
+        self.index.add('S', 13, 'b')
+        self.index['params_dict'] = 'p'
+        self.assertEqual('a', self.index[('S', 12)])
+        self.assertEqual('b', self.index.get('S13'))
+        self.assertEqual({'params_dict', 'S12', 'S13'}, set(self.index))
+        self.assertEqual(3, len(self.index))
+        # leading zeros and bare numbers are plain names
+        self.index['x007'] = 'c'
+        self.assertIsNone(self.index.lookup('x', 7))
+        self.assertEqual('c', self.index.pop('x007'))
+
+    def test_bounded(self):
+        for i in range(10):
+            self.index.add('acq_raw', i, i)
+        self.assertEqual(4, len(self.index))
+        self.assertIsNone(self.index.get('acq_raw0'))
+        self.assertEqual({7: 7, 8: 8}, self.index.range('acq_raw', 7, 9))
+        self.assertEqual([6, 7, 8, 9], list(self.index.range('acq_raw', 0, 100)))
+
+    def test_discard(self):
+        self.index.add('C', 1, 'old')
+        self.index.discard(('C', 1), 'other')
+        self.assertEqual('old', self.index.get('C1'))
+        self.index.discard('C1', 'old')
+        self.assertNotIn('C1', self.index)
+
+
+class SharedLimbo_Eviction(SharedStoreDependentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.owner = SharedLimbo('owner', store_loc=self.store_loc,
+                                 eviction={'acq_raw': {'keep_last': 2}, 'C': {'ttl': 0.05},
+                                           'Call': {'lru': 2}})
+
+    def tearDown(self):
+        self.owner.release()
+        super().tearDown()
+
+    def test_keepLast(self):
+        ids = [self.owner.put(np.ones(10), 'acq_raw', frame=i) for i in range(4)]
+        self.assertEqual(2, self.limbo.client.stats()['count'])
+        with self.assertRaises(ObjectNotFoundError):
+            self.limbo.getID(ids[0])
+        self.assertNotIn('acq_raw0', self.owner.stored)
+        self.assertEqual(self.limbo.getID(ids[3])[0], 1)
+        self.assertEqual([2, 3], list(self.owner.getRange('acq_raw', 0, 4)))
+
+    def test_getListEvicted(self):
+        ids = [self.owner.put(np.ones(10), 'acq_raw', frame=i) for i in range(4)]
+        t = time.monotonic()
+        with self.assertRaises(ObjectNotFoundError):
+            self.limbo.getList([ids[0], ids[3]], timeout=0)
+        self.assertLess(time.monotonic() - t, 1)
+        self.assertEqual(2, len(self.limbo.getList(ids[2:])))
+
+    def test_getFramesEvicted(self):
+        try:
+            from improv.actors.process import CaimanProcessor
+        except ImportError as e:
+            self.skipTest('processor dependencies missing: {}'.format(e))
+        ids = [self.owner.put(np.ones(10), 'acq_raw', frame=i) for i in range(4)]
+        proc = CaimanProcessor('Processor')
+        proc.setStore(self.limbo)
+        self.assertEqual([None, None], proc._getFrames([ids[0], ids[3]]))
+        with self.assertRaises(ObjectNotFoundError):
+            proc.client.getID(ids[0])
+        self.assertTrue(np.array_equal(np.ones(10), proc._getFrames([ids[3]])[0]))
+
+    def test_ttl(self):
+        id = self.owner.put(1, 'C0')
+        time.sleep(0.1)
+        self.assertEqual(1, self.owner.evict())
+        self.assertFalse(self.limbo.client.contains(id))
+
+    def test_lru(self):
+        ids = [self.owner.put(i, 'Call'+str(i)) for i in range(2)]
+        self.owner.getID(ids[0])
+        self.owner.put(2, 'Call2')
+        self.assertTrue(self.limbo.client.contains(ids[0]))
+        self.assertFalse(self.limbo.client.contains(ids[1]))
+
+    def test_pin(self):
+        id = self.owner.put(0, 'acq_raw0')
+        self.assertTrue(self.owner.pin(id))
+        for i in range(1, 4):
+            self.owner.put(i, 'acq_raw'+str(i))
+        self.assertEqual(0, self.limbo.getID(id))
+        # once saved, it is evicted by its policy again, as the oldest
+        self.assertTrue(self.owner.unpin(id))
+        self.assertFalse(self.limbo.client.contains(id))
+        self.assertFalse(self.owner.unpin(id))
+        self.assertFalse(self.owner.pin(self.owner.put(5, 'other')))
+
+    def test_readAfterSaved(self):
+        actor = Actor('Acquirer')
+        actor.setStore(self.owner)
+        actor.setLinkOut(ShmQueue())
+        actor.setLinkWatch(ShmQueue())
+        actor.setLinkSaved(ShmQueue())
+        id = self.owner.put(0, 'acq_raw', frame=0)
+        actor.put(FrameMessage(0, [id]), save=[True])
+        # the Watcher saves it and hands it back
+        saved_id, _, pinned = actor.q_watchout.get_nowait()
+        self.assertTrue(pinned)
+        self.assertEqual(0, self.limbo.getID(saved_id))
+        actor.q_watchin.put(saved_id)
+        actor.put(FrameMessage(1, [self.owner.put(1, 'acq_raw', frame=1)]))
+        # a consumer still behind the Watcher reads it
+        self.assertEqual(0, self.limbo.getID(actor.q_out.get_nowait().ids[0]))
+        self.assertEqual({}, self.owner.pinned)
+        self.owner.put(2, 'acq_raw', frame=2)
+        self.assertFalse(self.limbo.client.contains(id))
+
+
+class SharedLimbo_Spill(SharedStoreDependentTestCase):
+    spill_dir = tempfile.mkdtemp()
+    store_args = ['-d', spill_dir, '-w', '0.5']
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.spill_dir)
+
+    def test_spillAndReload(self):
+        ids = [self.limbo.put(np.full(1000000, i, dtype=np.uint8), 'acq_raw', frame=i)
+               for i in range(8)]
+        time.sleep(0.5)
+        stats = self.limbo.client.stats()
+        self.assertGreater(stats['spilled'], 0)
+        self.assertLessEqual(stats['used'], 5000000)
+        other = SharedLimbo('other', store_loc=self.store_loc)
+        for i, id in enumerate(ids):
+            self.assertEqual(i, other.getID(id)[-1])
+        other.release()
+
+    def test_fullSpillsFirst(self):
+        ids = [self.limbo.put(np.zeros(3000000, dtype=np.uint8), str(i)) for i in range(6)]
+        self.assertNotIn(None, ids)
+        self.limbo.delete(ids)
+        time.sleep(0.1)
+        self.assertEqual([], os.listdir(self.spill_dir))
+
+    def test_faultInFromHdd(self):
+        path = tempfile.mkdtemp()
+        limbo = SharedLimbo('hdd', store_loc=self.store_loc, use_hdd=True, hdd_path=path,
+                            eviction={'acq_raw': {'keep_last': 1}})
+        ids = [limbo.put(np.arange(5)+i, 'acq_raw', frame=i) for i in range(3)]
+        self.assertFalse(limbo.client.contains(ids[0]))
+        self.assertTrue(np.array_equal(limbo.getID(ids[0]), np.arange(5)))
+        limbo.release()
+        shutil.rmtree(path)
+
+
+class SharedLimbo_Subscribe(SharedStoreDependentTestCase):
+
+    def test_prefixFilter(self):
+        sub = self.limbo.subscribe(['acq_raw'])
+        self.limbo.put(1, 'estimates', frame=0)
+        id = self.limbo.put(np.zeros(4), 'acq_raw', frame=3)
+        name, frame, obj_id = self.limbo.notify(timeout=1)
+        self.assertEqual(('acq_raw', 3, id), (name, frame, obj_id))
+        self.assertIsNone(sub.next(timeout=0.05))
+
+    def test_wakesBlockedReader(self):
+        sub = self.limbo.subscribe('params')
+        got = []
+        reader = threading.Thread(target=lambda: got.append(sub.next()))
+        reader.start()
+        time.sleep(0.05)
+        id = self.limbo.put({'a': 1}, 'params_dict')
+        reader.join(1)
+        self.assertEqual([('params_dict', None, id)], got)
+
+    def test_asyncIterate(self):
+        sub = self.limbo.subscribe()
+        ids = [self.limbo.put(i, 'n', frame=i) for i in range(3)]
+
+        async def collect():
+            out = []
+            async for name, frame, obj_id in sub:
+                out.append(obj_id)
+                if len(out) == 3:
+                    return out
+        self.assertEqual(ids, asyncio.run(asyncio.wait_for(collect(), 1)))
+
+
+class SharedMemoryServer_Since(TestCase):
+
+    def setUp(self):
+        self.server = SharedMemoryServer('/tmp/test_since', 10000, log_size=4)
+        self.ids = [os.urandom(20) for i in range(10)]
+
+    def seal(self, ids):
+        for i in ids:
+            self.assertEqual(('ok',), self.server.seal(i, 'unused', 1))
+
+    def test_resume(self):
+        self.seal(self.ids[:3])
+        self.assertEqual((3, 0, self.ids[:3]), self.server.since(0, None, 0))
+        self.assertEqual((2, 0, self.ids[1:2]), self.server.since(1, 1, 0))
+        self.assertEqual((3, 0, []), self.server.since(3, None, 0))
+
+    def test_trimmedLog(self):
+        self.seal(self.ids)
+        cursor, missed, ids = self.server.since(0, None, 0)
+        self.assertEqual(10, cursor)
+        self.assertEqual(self.ids[10-len(ids):], ids)
+        self.assertEqual(10, missed + len(ids))
+
+
+class Watcher_Incremental(SharedStoreDependentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = tempfile.mkdtemp()
+        self.watcher = Watcher('watcher', self.limbo, path=self.path, batch=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super().tearDown()
+
+    def test_savesNewOnly(self):
+        ids = [self.limbo.put(i, 'n', frame=i) for i in range(3)]
+        self.limbo.delete(ids[1])
+        self.assertEqual(1, self.watcher.checkStore(0))  # ids[1] was deleted
+        self.assertEqual(1, self.watcher.checkStore(0))
+        self.assertEqual(0, self.watcher.checkStore(0))
+        self.assertEqual(3, self.watcher.cursor)
+        later = self.limbo.put(3, 'n', frame=3)
+        self.assertEqual(1, self.watcher.checkStore(0))
+        self.assertEqual({'dump'+i.binary().hex()+'.pkl' for i in (ids[0], ids[2], later)},
+                         set(os.listdir(self.path)))
+
+    def test_unnumberedStore(self):
+        # As on plasma: no sealedSince, so the Watcher scans the listing
+        ids = [self.limbo.put(i, 'n', frame=i) for i in range(3)]
+        with mock.patch.object(self.limbo, 'sealedSince', side_effect=NotImplementedError):
+            self.assertEqual(2, self.watcher.checkStore(0))
+            self.assertEqual(1, self.watcher.checkStore(0))
+            self.assertEqual(0, self.watcher.checkStore(0))
+        self.assertEqual({'dump'+i.binary().hex()+'.pkl' for i in ids}, set(os.listdir(self.path)))
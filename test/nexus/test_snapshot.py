@@ -0,0 +1,86 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import numpy as np
+from scipy.sparse import csc_matrix
+from improv.snapshot import SnapshotWriter, SnapshotReader
+from improv.store import SharedLimbo
+
+from test.nexus.test_shm_store import SharedStoreDependentTestCase
+
+
+class Snapshot_File(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'snap')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_roundTrip(self):
+        frames = [np.random.rand(5, 7).astype(np.float32) for _ in range(3)]
+        with SnapshotWriter(self.path) as snap:
+            for i, frame in enumerate(frames):
+                snap.addValue(bytes(20), 'acq_raw', i, frame)
+            snap.addValue(bytes(20), 'params_dict', None, {'a': [1, 2]})
+        with SnapshotReader(self.path) as snap:
+            self.assertEqual(4, len(snap))
+            res = snap.get(('acq_raw', 2))
+            self.assertTrue(np.array_equal(frames[2], res))
+            self.assertFalse(res.flags.writeable)
+            self.assertEqual(0, (res.ctypes.data - snap.get(('acq_raw', 1)).ctypes.data) % 64)
+            self.assertEqual({'a': [1, 2]}, snap.get('params_dict'))
+            self.assertEqual(3, len(snap.select(['acq_raw'])))
+        self.assertTrue(np.array_equal(frames[2], res))  # views outlive close
+
+    def test_abortLeavesNoFile(self):
+        with self.assertRaises(RuntimeError):
+            with SnapshotWriter(self.path) as snap:
+                snap.addValue(bytes(20), 'x', None, 1)
+                raise RuntimeError
+        self.assertEqual([], os.listdir(self.dir))
+
+
+class SharedLimbo_Snapshot(SharedStoreDependentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'store_dump')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        super().tearDown()
+
+    def test_saveAndRestore(self):
+        frames = [np.random.rand(32, 32) for _ in range(4)]
+        ids = [self.limbo.put(f, 'acq_raw', frame=i) for i, f in enumerate(frames)]
+        self.limbo.put({'x': 1}, 'params_dict')
+        self.limbo.put(csc_matrix(np.eye(3)), 'A')
+        self.assertEqual(6, self.limbo.saveStore(self.path))
+
+        # Restart the store, as after a crash
+        self.limbo.release()
+        self.p.terminate()
+        self.p.wait()
+        SharedStoreDependentTestCase.setUp(self)
+        fresh = self.limbo
+        self.assertEqual(6, fresh.loadStore(self.path))
+        self.assertTrue(np.array_equal(frames[2], fresh.getID(ids[2])))
+        self.assertTrue(np.array_equal(frames[3], fresh.get(('acq_raw', 3))))
+        self.assertEqual({'x': 1}, fresh.get('params_dict'))
+        self.assertEqual(3, fresh.get('A').nnz)
+        self.assertEqual(0, fresh.loadStore(self.path))  # already there
+
+    def test_saveSubstore(self):
+        for i in range(3):
+            self.limbo.put(np.zeros(4), 'acq_raw', frame=i)
+            self.limbo.put(i, 'estimates{}'.format(i))
+        other = SharedLimbo('other', store_loc=self.store_loc)
+        other.put(5, 'estimates9')
+        self.assertEqual(4, self.limbo.saveSubstore(['estimates'], self.path))
+        with SnapshotReader(self.path) as snap:
+            self.assertEqual(5, snap.get('estimates9'))
+        other.release()
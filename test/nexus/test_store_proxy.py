@@ -0,0 +1,131 @@
+from unittest import mock
+import os
+import socket
+import subprocess
+import sys
+import time
+import numpy as np
+from improv.store import RemoteLimbo, ObjectNotFoundError, FrameOverrunError, \
+    CannotConnectToStoreError
+from improv.shm_store import ObjectExistsError
+from improv.store_proxy import StoreProxy, KEY_VARIABLE, sendMessage
+
+from test.nexus.test_shm_store import SharedStoreDependentTestCase
+
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class RemoteStoreDependentTestCase(SharedStoreDependentTestCase):
+    ''' Starts the shared memory store and a store proxy for it, then
+        connects a RemoteLimbo over loopback as well as a local SharedLimbo
+    '''
+    def setUp(self):
+        super().setUp()
+        self.address = '127.0.0.1:{}'.format(freePort())
+        self.key = os.urandom(16).hex()
+        self.proxy = subprocess.Popen([sys.executable, '-m', 'improv.store_proxy',
+                                       '-s', self.store_loc, '-a', self.address],
+                                      env=dict(os.environ, **{KEY_VARIABLE: self.key}),
+                                      stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+        self.remote = RemoteLimbo('remote', store_loc=self.address, authkey=self.key)
+
+    def tearDown(self):
+        self.remote.release()
+        self.proxy.terminate()
+        self.proxy.wait()
+        super().tearDown()
+
+
+class RemoteLimbo_PutGet(RemoteStoreDependentTestCase):
+
+    def test_remoteToLocal(self):
+        frame = np.random.rand(64, 64)
+        id = self.remote.put(frame, 'acq_raw', frame=0)
+        self.remote.flush()
+        self.assertTrue(np.array_equal(frame, self.limbo.getID(id)))
+
+    def test_localToRemote(self):
+        ids = [self.limbo.put(np.full((300, 300), i), 'acq_raw', frame=i) for i in range(3)]
+        res = self.remote.getList(ids)
+        self.assertEqual([0, 1, 2], [r[0, 0] for r in res])
+        self.assertFalse(res[0].flags.writeable)
+        self.assertEqual({'a': 1}, self.remote.getID(self.limbo.put({'a': 1}, 'params')))
+
+    def test_pipelinedPuts(self):
+        ids = [self.remote.put(i, 'n', frame=i) for i in range(1000)]
+        self.assertEqual(list(range(1000)), self.remote.getList(ids))
+        self.assertEqual(999, self.remote.get(('n', 999)))
+
+    def test_cache(self):
+        id = self.limbo.put(np.zeros(10), 'x')
+        first = self.remote.getID(id)
+        self.assertIs(first, self.remote.getID(id))
+        self.remote.delete(id)
+        with self.assertRaises(ObjectNotFoundError):
+            self.remote.getID(id)
+
+    def test_putErrorsReported(self):
+        id = self.limbo.put(1, 'one')
+        self.remote.client.put(2, id)
+        with self.assertLogs('improv.store_proxy', 'ERROR'):
+            with self.assertRaises(ObjectExistsError):
+                self.remote.flush()
+        self.remote.flush()  # raised once
+        self.remote.client.put(2, id)
+        with self.assertRaises(ObjectExistsError):
+            self.remote.client.stats()  # raised by the next call
+        self.assertEqual(3, self.remote.getID(self.remote.put(3, 'three')))
+        with self.assertRaises(ObjectExistsError):
+            self.remote.client._request('put', id.binary(), 2, None, None)
+
+    def test_getMissing(self):
+        id = self.limbo.put(1, 'one')
+        self.limbo.delete(id)
+        t = time.monotonic()
+        with self.assertRaises(ObjectNotFoundError):
+            self.remote.getList([id], timeout=0)
+        self.assertLess(time.monotonic() - t, 1)
+
+
+class StoreProxy_Auth(RemoteStoreDependentTestCase):
+
+    def test_wrongKey(self):
+        with self.assertRaises(CannotConnectToStoreError):
+            RemoteLimbo('intruder', store_loc=self.address, authkey='not the key')
+        self.assertEqual(1, self.remote.getID(self.remote.put(1, 'one')))
+
+    def test_unauthenticatedMessage(self):
+        host, port = self.address.split(':')
+        with socket.create_connection((host, int(port))) as sock:
+            sendMessage(sock, ('stats',))
+            sock.settimeout(5)
+            received = b''
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                received += chunk
+        # Only the challenge and the refusal come back, never a reply
+        self.assertNotIn(b'capacity', received)
+
+    def test_needsKey(self):
+        with mock.patch.dict(os.environ, {KEY_VARIABLE: ''}):
+            with self.assertRaises(ValueError):
+                StoreProxy(store_loc=self.store_loc)
+
+
+class RemoteLimbo_Ring(RemoteStoreDependentTestCase):
+
+    def test_readRing(self):
+        refs = [self.limbo.putRing(np.full((8, 8), i), 'acq_raw', 2) for i in range(3)]
+        self.assertEqual(2, self.remote.getID(refs[2])[0, 0])
+        self.remote.checkFrame(refs[1])
+        with self.assertRaises(FrameOverrunError):
+            self.remote.getID(refs[0])
+        with self.assertRaises(NotImplementedError):
+            self.remote.putRing(np.zeros((8, 8)), 'acq_raw', 2)
@@ -0,0 +1,102 @@
+from unittest import TestCase
+import json
+import os
+import multiprocessing
+import tempfile
+from improv import trace
+from improv.trace import TraceRing, ENQUEUE, DEQUEUE, COMPUTE
+from improv.message import FrameMessage
+from improv.shm_queue import ShmQueue
+
+ctx = multiprocessing.get_context('fork')
+
+
+def stage(ring, q_in, q_out, n):
+    ''' A traced actor: get each frame and pass it on
+    '''
+    trace.attach(ring)
+    for _ in range(n):
+        msg = q_in.get(timeout=5)
+        trace.dequeued(msg)
+        trace.put(q_out, msg)
+
+
+class TraceRing_Spans(TestCase):
+
+    def setUp(self):
+        self.ring = TraceRing.create(capacity=8)
+
+    def tearDown(self):
+        trace.attach(None)
+        self.ring.close()
+
+    def test_record(self):
+        self.ring.record(DEQUEUE, 3, 100, 250)
+        spans = self.ring.spans()
+        self.assertEqual(1, len(spans))
+        self.assertEqual((3, DEQUEUE, 100, 250), tuple(spans[0]))
+
+    def test_overwriteOldest(self):
+        for i in range(20):
+            self.ring.record(ENQUEUE, i, i, i)
+        self.assertEqual(20, self.ring.written())
+        self.assertEqual(list(range(12, 20)), self.ring.spans()['frame'].tolist())
+
+    def test_enqueueDequeue(self):
+        trace.attach(self.ring)
+        q = ShmQueue()
+        msg = FrameMessage(5)
+        trace.dequeued(msg)
+        trace.put(q, msg)
+        trace.put(q, [1])  # only frame messages are traced
+        kinds = self.ring.spans()['kind'].tolist()
+        self.assertEqual([DEQUEUE, ENQUEUE, COMPUTE], kinds)
+        self.assertGreater(msg.sent, 0)
+        self.assertEqual(msg.sent, q.get_nowait().sent)
+
+    def test_dropped(self):
+        trace.attach(self.ring)
+        q = ShmQueue(maxsize=1, policy='drop-newest')
+        trace.put(q, FrameMessage(1))
+        self.assertEqual(1, trace.put(q, FrameMessage(2)))
+        spans = self.ring.spans()
+        self.assertEqual([(1, ENQUEUE)], list(zip(spans['frame'].tolist(), spans['kind'].tolist())))
+
+    def test_untraced(self):
+        msg = FrameMessage(5)
+        trace.put(ShmQueue(), msg)
+        self.assertEqual(0, msg.sent)
+        self.assertEqual(0, self.ring.written())
+
+
+class TraceRing_Timeline(TestCase):
+
+    def test_pipeline(self):
+        rings = {name: TraceRing.create(1024) for name in ('Acquirer', 'Processor')}
+        q_in, q_out = ShmQueue(), ShmQueue()
+        p = ctx.Process(target=stage, args=(rings['Processor'], q_in, q_out, 50))
+        p.start()
+        trace.attach(rings['Acquirer'])
+        for i in range(50):
+            trace.put(q_in, FrameMessage(i))
+            self.assertEqual(i, q_out.get(timeout=5).frame)
+        p.join()
+        trace.attach(None)
+
+        timeline = trace.timeline(rings)
+        stages = timeline['stages']
+        self.assertEqual(50, stages['Processor.dequeue']['count'])
+        self.assertEqual(50, stages['Processor.compute']['count'])
+        self.assertEqual(0, stages['Acquirer.dequeue']['count'])
+        self.assertEqual(50, stages['end_to_end']['count'])
+        self.assertLessEqual(stages['end_to_end']['p50_us'], stages['end_to_end']['p99_us'])
+        self.assertEqual(200, len(timeline['spans']))
+        starts = [s[3] for s in timeline['spans']]
+        self.assertEqual(sorted(starts), starts)
+
+        path = os.path.join(tempfile.mkdtemp(), 'timeline.json')
+        trace.writeTimeline(path, rings)
+        with open(path) as f:
+            self.assertEqual(50, json.load(f)['stages']['end_to_end']['count'])
+        for r in rings.values():
+            r.close()
@@ -0,0 +1,30 @@
+import numpy as np
+from improv.message import FrameMessage
+from improv.shm_queue import ShmQueue
+
+from test.nexus.test_shm_store import SharedStoreDependentTestCase
+
+
+class NaumannProcessor_Frames(SharedStoreDependentTestCase):
+    ''' The naumann demo processor unpacks the acquirers' FrameMessages
+    '''
+
+    def setUp(self):
+        try:
+            from demos.naumann.actors.processor import CaimanProcessor
+        except ImportError as e:
+            self.skipTest('processor dependencies missing: {}'.format(e))
+        super().setUp()
+        self.proc = CaimanProcessor('Processor')
+        self.proc.setStore(self.limbo)
+        self.proc.setLinkIn(ShmQueue())
+
+    def test_frameMessage(self):
+        frame = np.arange(16, dtype=np.uint16).reshape(4, 4)
+        id = self.limbo.put(frame, 'acq_raw', frame=0)
+        self.proc.q_in.put(FrameMessage(0, [id]))
+        msg = self.proc._checkFrames()
+        self.assertTrue(np.array_equal(frame, self.limbo.getID(self.proc._frameID(msg, 0))))
+
+    def test_missing(self):
+        self.assertIsNone(self.proc._frameID(FrameMessage.missing(3), 3))